@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Admission control of submitted jobs based on the backlog of the server
+
+    qd_fe writes the load of the server to static/log/qd_fe_load.json in each
+    loop (WriteServerLoad), with
+      - remaining_numseq: sequences of queued and running jobs not finished
+      - backlog_seconds:  remaining_numseq times the mean time of a sequence
+                          in the remote queue
+      - num_slot:         sum of the dispatch limits of the compute nodes
+      - throughput:       measured number of sequences finished per second
+      - est_wait:         estimated waiting time in seconds of a new job
+    The views read it at submission (CheckAdmission)
+      - a job is rejected if est_wait exceeds ADMISSION_REJECT_WAIT
+      - a large job (numseq >= ADMISSION_LARGE_NUMSEQ) is deferred if
+        est_wait exceeds ADMISSION_DEFER_WAIT, i.e. it is accepted with the
+        tag file runjob.deferred and qd_fe does not dispatch it until the
+        load has dropped or ADMISSION_MAX_DEFER_TIME has passed
+    If the load file is older than ADMISSION_MAX_STATE_AGE, e.g. qd_fe is not
+    running, all jobs are accepted.
+
+    The daemon is started by the views only if it is not running, and at most
+    once within LAUNCH_LOCK_TIME seconds (LaunchDaemon)
+"""
+import os
+import time
+import json
+import fcntl
+import subprocess
+
+ADMISSION_LARGE_NUMSEQ = 500
+ADMISSION_DEFER_WAIT = 4*3600
+ADMISSION_REJECT_WAIT = 48*3600
+ADMISSION_MAX_DEFER_TIME = 24*3600
+ADMISSION_MAX_STATE_AGE = 600
+LAUNCH_LOCK_TIME = 60
+
+ADMIT = "admit"
+DEFER = "defer"
+REJECT = "reject"
+
+def WriteServerLoad(loadfile, loadDict):#{{{
+    """Write loadDict to loadfile atomically"""
+    loadDict['update_epoch'] = time.time()
+    tmpfile = "%s.tmp.%d"%(loadfile, os.getpid())
+    with open(tmpfile, "w") as fpout:
+        json.dump(loadDict, fpout, sort_keys=True)
+    os.rename(tmpfile, loadfile)
+#}}}
+def ReadServerLoad(loadfile, max_age=ADMISSION_MAX_STATE_AGE):#{{{
+    """Return the dict written by WriteServerLoad, or None if the file does
+    not exist or is outdated"""
+    try:
+        with open(loadfile, "r") as fpin:
+            loadDict = json.load(fpin)
+    except (IOError, ValueError):
+        return None
+    if time.time() - loadDict.get('update_epoch', 0) > max_age:
+        return None
+    return loadDict
+#}}}
+def EstimateWait(remaining_numseq, backlog_seconds, num_slot, throughput):#{{{
+    """Return the estimated waiting time in seconds for a new job, from the
+    measured throughput if available, otherwise from the backlog divided by
+    the number of slots on the compute nodes"""
+    if throughput > 0:
+        return remaining_numseq/throughput
+    return backlog_seconds/max(1, num_slot)
+#}}}
+def CheckAdmission(loadfile, numseq, g_params):#{{{
+    """Return (decision, est_wait) for a job with numseq sequences, decision
+    is one of ADMIT, DEFER and REJECT, est_wait is None if unknown"""
+    loadDict = ReadServerLoad(loadfile, g_params['ADMISSION_MAX_STATE_AGE'])
+    if loadDict is None:
+        return (ADMIT, None)
+    est_wait = loadDict['est_wait']
+    if est_wait > g_params['ADMISSION_REJECT_WAIT']:
+        return (REJECT, est_wait)
+    if (numseq >= g_params['ADMISSION_LARGE_NUMSEQ'] and
+            est_wait > g_params['ADMISSION_DEFER_WAIT']):
+        return (DEFER, est_wait)
+    return (ADMIT, est_wait)
+#}}}
+def IsDeferred(rstdir, est_wait, g_params):#{{{
+    """Check whether the deferred job should still be held back, the tag file
+    is removed when the job is released"""
+    deferredtagfile = "%s/runjob.deferred"%(rstdir)
+    try:
+        mtime = os.path.getmtime(deferredtagfile)
+    except OSError:
+        return False
+    if (est_wait <= g_params['ADMISSION_DEFER_WAIT'] or
+            time.time() - mtime > g_params['ADMISSION_MAX_DEFER_TIME']):
+        try:
+            os.remove(deferredtagfile)
+        except OSError:
+            pass
+        return False
+    return True
+#}}}
+def FormatWait(seconds):#{{{
+    if seconds < 3600:
+        return "%d minutes"%(max(1, int(seconds/60)))
+    return "%.1f hours"%(seconds/3600.0)
+#}}}
+def IsDaemonRunning(scriptfile):#{{{
+    """Check whether the daemon holds its lock file, see qd_fe.py"""
+    lockname = os.path.realpath(scriptfile).replace(" ", "").replace("/", "-")
+    lock_file = "/tmp/%s.lock"%(lockname)
+    if not os.path.exists(lock_file):
+        return False
+    try:
+        fp = open(lock_file, 'a')
+    except IOError:
+        return False
+    try:
+        fcntl.lockf(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError:
+        return True
+    else:
+        fcntl.lockf(fp, fcntl.LOCK_UN)
+        return False
+    finally:
+        fp.close()
+#}}}
+def LaunchDaemon(cmd, scriptfile, launch_lockfile):#{{{
+    """Start the daemon in the background unless it is running or has been
+    started within LAUNCH_LOCK_TIME seconds
+    return True if started"""
+    try:
+        if time.time() - os.path.getmtime(launch_lockfile) < LAUNCH_LOCK_TIME:
+            return False
+        os.remove(launch_lockfile)
+    except OSError:
+        pass
+    try:
+        fd = os.open(launch_lockfile, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except OSError: # another request is launching the daemon
+        return False
+    os.close(fd)
+    if IsDaemonRunning(scriptfile):
+        return False
+    subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            close_fds=True, start_new_session=True)
+    return True
+#}}}
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Expiry index of the result folders keyed by the finish date
+
+    Finished jobs are added to a sqlite3 database with their finish epoch
+      - by run_job.py when it writes runjob.finish (AddItem)
+      - by qd_fe from the lines appended to finished_job.log since the last
+        update (UpdateFromFinishedLog), which covers the jobs run on the
+        remote nodes
+      - once, at the first update from finished_job.log, from the tag files
+        runjob.finish or runjob.failed of the folders already in path_result
+        (ScanResultDir), so that the results finished before the index was
+        created expire as well
+    A background thread of qd_fe (StartReaper) removes the items finished
+    more than MAX_KEEP_DAYS ago in batches of at most REAPER_BATCH_SIZE, with
+    the lowest CPU and I/O priority, so that expired results are found by an
+    indexed query instead of walking all result folders. The removed jobs
+    are removed from the job catalog as well. An item whose folder could not
+    be removed is kept and retried REAPER_RETRY_DELAY seconds later
+    (DelayItem), so that it does not hold back the other expired items.
+"""
+import os
+import time
+import shutil
+import sqlite3
+import threading
+import subprocess
+from datetime import datetime
+
+import logtail
+import jobcatalog
+
+REAPER_INTERVAL = 300       # seconds between two runs when nothing is expired
+REAPER_BATCH_SIZE = 100     # maximal number of items removed in one batch
+REAPER_PAUSE = 2.0          # seconds between two batches
+REAPER_RETRY_DELAY = 3600   # seconds before a failed removal is retried
+
+g_enableEvent = threading.Event()   # set when this worker is the leader
+g_deletedEvent = threading.Event()  # set when a result folder has been removed
+g_reaperThread = None
+
+def OpenDB(dbfile):#{{{
+    con = sqlite3.connect(dbfile, timeout=30)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS expiry(
+            path TEXT PRIMARY KEY,
+            finish_epoch REAL NOT NULL
+        )""")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_expiry_finish_epoch "
+            "ON expiry(finish_epoch)")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS tailstate(
+            logfile TEXT PRIMARY KEY,
+            inode INTEGER NOT NULL,
+            offset INTEGER NOT NULL
+        )""")
+    con.commit()
+    return con
+#}}}
+def AddItem(dbfile, path, finish_epoch=None):#{{{
+    """Add the folder path finished at finish_epoch (now if None)"""
+    if finish_epoch is None:
+        finish_epoch = time.time()
+    con = OpenDB(dbfile)
+    try:
+        with con:
+            con.execute("INSERT OR REPLACE INTO expiry(path, finish_epoch) "
+                    "VALUES (?, ?)", (os.path.realpath(path), finish_epoch))
+    finally:
+        con.close()
+#}}}
+def _ParseEpoch(date_str):#{{{
+    # dates are written with FORMAT_DATETIME, the timezone name is ignored
+    try:
+        return time.mktime(datetime.strptime(date_str[:19],
+            "%Y-%m-%d %H:%M:%S").timetuple())
+    except ValueError:
+        return None
+#}}}
+def ScanResultDir(path_result):#{{{
+    """Return a list of (path, finish_epoch) of the finished or failed jobs in
+    path_result, the finish epoch is read from the tag file or is its
+    modification time"""
+    path_result = os.path.realpath(path_result)
+    itemlist = []
+    try:
+        namelist = os.listdir(path_result)
+    except OSError:
+        return itemlist
+    for name in namelist:
+        rstdir = "%s/%s"%(path_result, name)
+        for tag in ["runjob.finish", "runjob.failed"]:
+            tagfile = "%s/%s"%(rstdir, tag)
+            try:
+                with open(tagfile, "r") as fpin:
+                    finish_epoch = _ParseEpoch(fpin.read().strip())
+                if finish_epoch is None:
+                    finish_epoch = os.path.getmtime(tagfile)
+            except (IOError, OSError):
+                continue
+            itemlist.append((rstdir, finish_epoch))
+            break
+    return itemlist
+#}}}
+def UpdateFromFinishedLog(dbfile, logfile, path_result):#{{{
+    """Add the result folders of the jobs appended to finished_job.log since
+    the last update, at the first update the finished folders already in
+    path_result are added as well
+    return the number of added items"""
+    path_result = os.path.realpath(path_result)
+    con = OpenDB(dbfile)
+    cnt = 0
+    try:
+        row = con.execute("SELECT inode, offset FROM tailstate WHERE logfile = ?",
+                (logfile,)).fetchone()
+        (inode, offset) = (-1, 0) if row is None else row
+        (lines, inode, offset) = logtail.ReadNewLines(logfile, inode, offset)
+        with con:
+            if row is None:
+                itemlist = ScanResultDir(path_result)
+                con.executemany("INSERT OR IGNORE INTO expiry(path, finish_epoch) "
+                        "VALUES (?, ?)", itemlist)
+                cnt += len(itemlist)
+            for line in lines:
+                strs = line.split("\t")
+                if len(strs) < 10 or strs[0] == "" or strs[0][0] == "#":
+                    continue
+                jobid = os.path.basename(strs[0])
+                finish_epoch = _ParseEpoch(strs[9])
+                if jobid == "" or finish_epoch is None:
+                    continue
+                con.execute("INSERT OR REPLACE INTO expiry(path, finish_epoch) "
+                        "VALUES (?, ?)", ("%s/%s"%(path_result, jobid), finish_epoch))
+                cnt += 1
+            con.execute("INSERT OR REPLACE INTO tailstate(logfile, inode, offset) "
+                    "VALUES (?, ?, ?)", (logfile, inode, offset))
+    finally:
+        con.close()
+    return cnt
+#}}}
+def GetExpiredList(dbfile, max_keep_days, limit):#{{{
+    """Return at most limit paths finished more than max_keep_days ago, the
+    oldest first"""
+    con = OpenDB(dbfile)
+    try:
+        return [row[0] for row in con.execute("SELECT path FROM expiry "
+            "WHERE finish_epoch < ? ORDER BY finish_epoch LIMIT ?",
+            (time.time() - max_keep_days*86400, limit))]
+    finally:
+        con.close()
+#}}}
+def DeleteItem(dbfile, pathlist):#{{{
+    con = OpenDB(dbfile)
+    try:
+        with con:
+            con.executemany("DELETE FROM expiry WHERE path = ?",
+                    [(path,) for path in pathlist])
+    finally:
+        con.close()
+#}}}
+def DelayItem(dbfile, pathlist, max_keep_days, delay):#{{{
+    """Set the finish epoch of the items so that they expire again in delay
+    seconds"""
+    finish_epoch = time.time() - max_keep_days*86400 + delay
+    con = OpenDB(dbfile)
+    try:
+        with con:
+            con.executemany("UPDATE expiry SET finish_epoch = ? WHERE path = ?",
+                    [(finish_epoch, path) for path in pathlist])
+    finally:
+        con.close()
+#}}}
+def ReapExpired(dbfile, g_params, loginfo=None):#{{{
+    """Remove one batch of expired folders, only the folders under
+    path_result or path_tmp are removed, except path_cache
+    return the number of processed items"""
+    allowed_rootli = [os.path.realpath(g_params[key]) + os.sep
+            for key in ['path_result', 'path_tmp'] if key in g_params]
+    protectset = set([os.path.realpath(g_params[key])
+        for key in ['path_result', 'path_tmp', 'path_cache'] if key in g_params])
+    path_result = os.path.realpath(g_params.get('path_result', ""))
+    pathlist = GetExpiredList(dbfile, g_params['MAX_KEEP_DAYS'],
+            g_params['REAPER_BATCH_SIZE'])
+    cnt = 0
+    removed_jobidlist = []
+    donelist = []   # items removed, already gone or never to be removed
+    failedlist = []
+    for path in pathlist:
+        if (path in protectset or
+                not any(path.startswith(root) for root in allowed_rootli)):
+            donelist.append(path)
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+            if os.path.exists(path):
+                if loginfo is not None:
+                    loginfo("Failed to rmtree(%s)"%(path))
+                failedlist.append(path)
+                continue
+            cnt += 1
+            if os.path.dirname(path) == path_result:
+                removed_jobidlist.append(os.path.basename(path))
+        donelist.append(path)
+    DeleteItem(dbfile, donelist)
+    DelayItem(dbfile, failedlist, g_params['MAX_KEEP_DAYS'],
+            g_params['REAPER_RETRY_DELAY'])
+    if 'jobcatalog_db' in g_params:
+        try:
+            jobcatalog.DeleteJob(g_params['jobcatalog_db'], removed_jobidlist)
+        except sqlite3.Error as e:
+            if loginfo is not None:
+                loginfo("Failed to remove %d jobs from the job catalog with errmsg=%s"%(
+                    len(removed_jobidlist), str(e)))
+    if cnt > 0:
+        g_deletedEvent.set()
+        if loginfo is not None:
+            loginfo("%d expired result folders removed"%(cnt))
+    return len(pathlist)
+#}}}
+def _SetLowPriority():#{{{
+    """Set the lowest CPU and the idle I/O priority of the calling thread,
+    both are per thread on Linux"""
+    try:
+        tid = threading.get_native_id()
+    except AttributeError:
+        return
+    try:
+        os.setpriority(os.PRIO_PROCESS, tid, 19)
+    except (AttributeError, OSError):
+        pass
+    try:
+        subprocess.call(["ionice", "-c", "3", "-p", str(tid)],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except OSError:
+        pass
+#}}}
+def _ReaperLoop(dbfile, g_params, loginfo):#{{{
+    _SetLowPriority()
+    while True:
+        g_enableEvent.wait()
+        num = 0
+        try:
+            num = ReapExpired(dbfile, g_params, loginfo)
+        except (sqlite3.Error, OSError) as e:
+            if loginfo is not None:
+                loginfo("ReapExpired failed with error message: %s"%(str(e)))
+        if num >= g_params['REAPER_BATCH_SIZE']:
+            time.sleep(g_params['REAPER_PAUSE'])
+        else:
+            time.sleep(g_params['REAPER_INTERVAL'])
+#}}}
+def StartReaper(dbfile, g_params, loginfo=None):#{{{
+    """Start the reaper thread, it is idle until EnableReaper(True) is called
+    loginfo(msg) is used to log messages"""
+    global g_reaperThread
+    if g_reaperThread is None:
+        g_reaperThread = threading.Thread(target=_ReaperLoop,
+                args=(dbfile, g_params, loginfo))
+        g_reaperThread.daemon = True
+        g_reaperThread.start()
+#}}}
+def EnableReaper(isEnable):#{{{
+    if isEnable:
+        g_enableEvent.set()
+    else:
+        g_enableEvent.clear()
+#}}}
+def IsAnyDeleted():#{{{
+    """Return whether folders have been removed since the last call"""
+    if g_deletedEvent.is_set():
+        g_deletedEvent.clear()
+        return True
+    return False
+#}}}
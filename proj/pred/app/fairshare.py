@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Weighted fair-share scheduling of sequences among users
+
+    A user is identified by the email address, or by the IP address if no
+    email is given. For each user the following is kept in a sqlite3 database
+      - usage: number of sequences dispatched to the compute nodes, decayed
+        exponentially with the half-life HALF_LIFE
+      - outstanding: number of sequences of the user in queued or running jobs
+      - weight: 1 by default, VIP_WEIGHT for users listed in vip_email.txt or
+        the weight given in the second column of vip_email.txt
+
+    The fair-share factor of a user is
+        F = 2^(-(usage/total_usage)/(weight/total_weight))
+    and the share of free slots of a node given to the user in each loop is
+    proportional to weight*F among the users with jobs in the queue. The jobs
+    run in the local queue are given the nice GetSlurmNice(priority).
+"""
+import os
+import time
+import math
+import sqlite3
+
+VIP_WEIGHT = 10.0     # default weight of users listed in vip_email.txt
+HALF_LIFE = 86400.0   # half-life in seconds of the past usage
+MAX_NICE = 10000      # nice of the Slurm jobs with the lowest priority
+
+def OpenDB(dbfile):#{{{
+    con = sqlite3.connect(dbfile, timeout=30)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS user(
+            user TEXT PRIMARY KEY,
+            usage REAL NOT NULL DEFAULT 0,
+            update_epoch REAL NOT NULL,
+            outstanding INTEGER NOT NULL DEFAULT 0,
+            weight REAL NOT NULL DEFAULT 1
+        )""")
+    con.commit()
+    return con
+#}}}
+def GetUserKey(email, ip):#{{{
+    """Return the key identifying the user of a job"""
+    email = email.strip()
+    if email != "":
+        return email
+    else:
+        return ip.strip()
+#}}}
+def ReadUserWeight(vip_email_file, vip_weight):#{{{
+    """Read weights of users from vip_email_file
+    Format: one user per line, email and optionally the weight
+    return a dict {user: weight}"""
+    weightDict = {}
+    try:
+        fpin = open(vip_email_file, "r")
+    except IOError:
+        return weightDict
+    with fpin:
+        for line in fpin:
+            strs = line.split()
+            if len(strs) < 1 or strs[0][0] == "#":
+                continue
+            weight = vip_weight
+            if len(strs) >= 2:
+                try:
+                    weight = float(strs[1])
+                except ValueError:
+                    pass
+            weightDict[strs[0]] = weight
+    return weightDict
+#}}}
+def _DecayedUsage(usage, update_epoch, epoch, half_life):#{{{
+    if half_life <= 0:
+        return usage
+    return usage * math.pow(0.5, max(0.0, epoch-update_epoch)/half_life)
+#}}}
+def AddUsage(dbfile, user, numseq, half_life):#{{{
+    """Charge numseq dispatched sequences to the user"""
+    epoch = time.time()
+    con = OpenDB(dbfile)
+    try:
+        with con:
+            row = con.execute("SELECT usage, update_epoch FROM user WHERE user = ?",
+                    (user,)).fetchone()
+            if row is None:
+                con.execute("INSERT INTO user(user, usage, update_epoch) VALUES (?, ?, ?)",
+                        (user, numseq, epoch))
+            else:
+                usage = _DecayedUsage(row[0], row[1], epoch, half_life) + numseq
+                con.execute("UPDATE user SET usage = ?, update_epoch = ? WHERE user = ?",
+                        (usage, epoch, user))
+    finally:
+        con.close()
+#}}}
+def UpdateOutstanding(dbfile, outstandingDict, weightDict):#{{{
+    """Set the number of sequences in the queue for each user in
+    outstandingDict, and 0 for all other users"""
+    epoch = time.time()
+    con = OpenDB(dbfile)
+    try:
+        with con:
+            con.execute("UPDATE user SET outstanding = 0")
+            for user in outstandingDict:
+                weight = weightDict.get(user, 1.0)
+                con.execute("INSERT OR IGNORE INTO user(user, update_epoch) VALUES (?, ?)",
+                        (user, epoch))
+                con.execute("UPDATE user SET outstanding = ?, weight = ? WHERE user = ?",
+                        (outstandingDict[user], weight, user))
+    finally:
+        con.close()
+#}}}
+def GetNumSeqThisUser(dbfile, user):#{{{
+    """Return the number of sequences of the user in queued or running jobs"""
+    if not os.path.exists(dbfile):
+        return 0
+    con = OpenDB(dbfile)
+    try:
+        row = con.execute("SELECT outstanding FROM user WHERE user = ?",
+                (user,)).fetchone()
+    finally:
+        con.close()
+    if row is None:
+        return 0
+    return row[0]
+#}}}
+def GetActiveUserList(dbfile):#{{{
+    """Return users with sequences in queued or running jobs"""
+    if not os.path.exists(dbfile):
+        return []
+    con = OpenDB(dbfile)
+    try:
+        return [row[0] for row in con.execute(
+            "SELECT user FROM user WHERE outstanding > 0")]
+    finally:
+        con.close()
+#}}}
+def GetFairShareFactor(dbfile, userlist, weightDict, half_life):#{{{
+    """Return a dict {user: (weight, F)} for the users in userlist"""
+    epoch = time.time()
+    usageDict = {}
+    con = OpenDB(dbfile)
+    try:
+        for (user, usage, update_epoch) in con.execute(
+                "SELECT user, usage, update_epoch FROM user"):
+            usageDict[user] = _DecayedUsage(usage, update_epoch, epoch, half_life)
+    finally:
+        con.close()
+
+    total_usage = sum([usageDict.get(user, 0.0) for user in userlist])
+    total_weight = sum([weightDict.get(user, 1.0) for user in userlist])
+    factorDict = {}
+    for user in userlist:
+        weight = weightDict.get(user, 1.0)
+        if total_usage <= 0.0 or total_weight <= 0.0:
+            factor = 1.0
+        else:
+            norm_usage = usageDict.get(user, 0.0)/total_usage
+            norm_weight = weight/total_weight
+            factor = math.pow(2.0, -norm_usage/norm_weight)
+        factorDict[user] = (weight, factor)
+    return factorDict
+#}}}
+def GetShare(factorDict):#{{{
+    """Return a dict {user: fraction of free slots}"""
+    shareDict = {}
+    total = sum([w*f for (w, f) in factorDict.values()])
+    for user in factorDict:
+        (weight, factor) = factorDict[user]
+        if total > 0.0:
+            shareDict[user] = weight*factor/total
+        else:
+            shareDict[user] = 1.0/len(factorDict)
+    return shareDict
+#}}}
+def GetPriority(weight, factor, numseq_this_user):#{{{
+    """Priority used for the local queue, higher value runs first"""
+    return weight*factor*1000.0/math.sqrt(max(1, numseq_this_user))
+#}}}
+def GetSlurmNice(priority):#{{{
+    """Nice value of the Slurm job of the given priority, a lower priority gets
+    a higher nice, it is not negative since only privileged users may give a
+    negative nice"""
+    return max(0, MAX_NICE - int(round(priority)))
+#}}}
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Incremental statistics of finished jobs
+
+    Lines appended to finished_job.log since the last update are read (see
+    logtail.py) and added to per-day rollups in a sqlite3 database, so that
+    the cost of an update depends only on the number of newly finished jobs.
+    The offset in the log file is committed in the same transaction as the
+    rollups. At the first update of a log file, the archived log files
+    (e.g. finished_job.log.1 or finished_job.log.1.gz, see
+    GetArchivedLogList) are added once, so that the statistics cover the jobs
+    finished before the database was created.
+
+    From the rollups the files incstat_finish_{day,week,month}.stat.txt and
+    the plots incstat_finish_{day,week,month}.stat.txt.{numjob,numseq}.png
+    under path_stat are written, which are shown on the server status page.
+    They count the jobs by the day they were submitted and are named apart
+    from the submit_* files written by qdcom.RunStatistics from
+    submitted_seq.log, so that the two never overwrite each other. The
+    totals (GetSummary) and the jobs by country (GetCountryStat) are read by
+    the views.
+
+    Format of finished_job.log
+        jobid, status, jobname, ip, email, numseq, method_submission,
+        submit_date, start_date, finish_date
+"""
+import os
+import glob
+import gzip
+import sqlite3
+from datetime import datetime, timedelta
+
+import logtail
+
+PERIOD_LIST = ["day", "week", "month"]
+MAX_NUM_BAR = {"day": 60, "week": 52, "month": 48}  # bars shown in the plots
+STATFILE_FORMAT = "incstat_finish_%s.stat.txt"      # % period
+
+def OpenDB(dbfile):#{{{
+    con = sqlite3.connect(dbfile, timeout=30)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS tailstate(
+            logfile TEXT PRIMARY KEY,
+            inode INTEGER NOT NULL,
+            offset INTEGER NOT NULL
+        )""")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS daystat(
+            date TEXT NOT NULL,
+            method_submission TEXT NOT NULL,
+            status TEXT NOT NULL,
+            numjob INTEGER NOT NULL,
+            numseq INTEGER NOT NULL,
+            sum_runtime REAL NOT NULL,
+            sum_waittime REAL NOT NULL,
+            PRIMARY KEY (date, method_submission, status)
+        )""")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS ipstat(
+            ip TEXT PRIMARY KEY,
+            country TEXT NOT NULL,
+            numjob INTEGER NOT NULL,
+            numseq INTEGER NOT NULL
+        )""")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_ipstat_country ON ipstat(country)")
+    con.commit()
+    return con
+#}}}
+def _Seconds(begin_date_str, end_date_str):#{{{
+    # dates are written with FORMAT_DATETIME in the same timezone, the
+    # timezone name is ignored
+    try:
+        begin = datetime.strptime(begin_date_str[:19], "%Y-%m-%d %H:%M:%S")
+        end = datetime.strptime(end_date_str[:19], "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return 0.0
+    return max(0.0, (end - begin).total_seconds())
+#}}}
+def ParseFinishedJobLine(line):#{{{
+    """Return a dict of the record or None if the line is not valid"""
+    strs = line.split("\t")
+    if len(strs) < 10 or strs[0] == "" or strs[0][0] == "#":
+        return None
+    try:
+        numseq = int(strs[5])
+    except ValueError:
+        numseq = 1
+    date = strs[7][:10]
+    try:
+        datetime.strptime(date, "%Y-%m-%d")
+    except ValueError:
+        return None
+    return {'jobid': strs[0], 'status': strs[1], 'ip': strs[3],
+            'numseq': numseq, 'method_submission': strs[6], 'date': date,
+            'runtime': _Seconds(strs[8], strs[9]),
+            'waittime': _Seconds(strs[7], strs[8])}
+#}}}
+def GetArchivedLogList(logfile):#{{{
+    """Return the list of the archived copies of logfile, the oldest first"""
+    filelist = [f for f in glob.glob("%s.*"%(logfile))
+            if not f.endswith(".lock") and ".tmp" not in f]
+    return sorted(filelist, key=lambda f: os.path.getmtime(f))
+#}}}
+def ReadArchivedLog(archivefile):#{{{
+    """Return the lines of an archived log file, which may be gzipped"""
+    opener = gzip.open if archivefile.endswith(".gz") else open
+    try:
+        with opener(archivefile, "rb") as fpin:
+            content = fpin.read()
+    except (IOError, OSError, EOFError):
+        return []
+    return content.decode('utf-8', 'replace').split("\n")
+#}}}
+def _AddRecord(con, rd, GetCountry):#{{{
+    con.execute("INSERT OR IGNORE INTO daystat(date, method_submission, "
+            "status, numjob, numseq, sum_runtime, sum_waittime) "
+            "VALUES (?, ?, ?, 0, 0, 0, 0)",
+            (rd['date'], rd['method_submission'], rd['status']))
+    con.execute("UPDATE daystat SET numjob = numjob + 1, "
+            "numseq = numseq + ?, sum_runtime = sum_runtime + ?, "
+            "sum_waittime = sum_waittime + ? WHERE date = ? AND "
+            "method_submission = ? AND status = ?",
+            (rd['numseq'], rd['runtime'], rd['waittime'], rd['date'],
+                rd['method_submission'], rd['status']))
+    if rd['ip'] != "":
+        if con.execute("SELECT 1 FROM ipstat WHERE ip = ?",
+                (rd['ip'],)).fetchone() is None:
+            country = ""
+            if GetCountry is not None:
+                country = GetCountry(rd['ip'])
+            con.execute("INSERT INTO ipstat(ip, country, numjob, numseq) "
+                    "VALUES (?, ?, 0, 0)", (rd['ip'], country))
+        con.execute("UPDATE ipstat SET numjob = numjob + 1, "
+                "numseq = numseq + ? WHERE ip = ?", (rd['numseq'], rd['ip']))
+#}}}
+def Update(dbfile, logfile, GetCountry=None):#{{{
+    """Add the jobs appended to logfile since the last update, at the first
+    update the archived copies of logfile are added as well
+    GetCountry(ip) returns the country name of the IP address
+    return the number of added jobs"""
+    con = OpenDB(dbfile)
+    cnt = 0
+    try:
+        row = con.execute("SELECT inode, offset FROM tailstate WHERE logfile = ?",
+                (logfile,)).fetchone()
+        lines = []
+        if row is None:
+            (inode, offset) = (-1, 0)
+            for archivefile in GetArchivedLogList(logfile):
+                lines += ReadArchivedLog(archivefile)
+        else:
+            (inode, offset) = row
+        (newlines, inode, offset) = logtail.ReadNewLines(logfile, inode, offset)
+        lines += newlines
+        with con:
+            for line in lines:
+                rd = ParseFinishedJobLine(line)
+                if rd is None:
+                    continue
+                _AddRecord(con, rd, GetCountry)
+                cnt += 1
+            con.execute("INSERT OR REPLACE INTO tailstate(logfile, inode, offset) "
+                    "VALUES (?, ?, ?)", (logfile, inode, offset))
+    finally:
+        con.close()
+    return cnt
+#}}}
+def IsPopulated(dbfile):#{{{
+    """Whether the existing log files have been added, i.e. Update has been
+    run at least once"""
+    if not os.path.exists(dbfile):
+        return False
+    con = OpenDB(dbfile)
+    try:
+        return con.execute("SELECT 1 FROM tailstate LIMIT 1").fetchone() is not None
+    finally:
+        con.close()
+#}}}
+def _PeriodKey(date, period):#{{{
+    if period == "day":
+        return date
+    dt = datetime.strptime(date, "%Y-%m-%d")
+    if period == "week":
+        return (dt - timedelta(days=dt.weekday())).strftime("%Y-%m-%d")
+    return dt.strftime("%Y-%m")
+#}}}
+def GetPeriodStat(dbfile, period):#{{{
+    """Return a sorted list of (date, numjob, numseq) by day, week or month"""
+    statDict = {}
+    con = OpenDB(dbfile)
+    try:
+        for (date, numjob, numseq) in con.execute(
+                "SELECT date, SUM(numjob), SUM(numseq) FROM daystat GROUP BY date"):
+            key = _PeriodKey(date, period)
+            if key not in statDict:
+                statDict[key] = [0, 0]
+            statDict[key][0] += numjob
+            statDict[key][1] += numseq
+    finally:
+        con.close()
+    return [(key, statDict[key][0], statDict[key][1]) for key in sorted(statDict.keys())]
+#}}}
+def GetSummary(dbfile):#{{{
+    """Return a dict with the totals of the finished jobs"""
+    summary = {'num_finished_jobs': 0, 'num_finished_seqs': 0,
+            'num_finished_jobs_web': 0, 'num_finished_jobs_wsdl': 0,
+            'num_unique_ip': 0, 'num_unique_country': 0, 'startdate': ""}
+    con = OpenDB(dbfile)
+    try:
+        for (method_submission, numjob, numseq) in con.execute(
+                "SELECT method_submission, SUM(numjob), SUM(numseq) FROM daystat "
+                "GROUP BY method_submission"):
+            summary['num_finished_jobs'] += numjob
+            summary['num_finished_seqs'] += numseq
+            if method_submission in ["web", "wsdl"]:
+                summary['num_finished_jobs_%s'%(method_submission)] += numjob
+        summary['num_unique_ip'] = con.execute(
+                "SELECT COUNT(*) FROM ipstat").fetchone()[0]
+        summary['num_unique_country'] = con.execute(
+                "SELECT COUNT(DISTINCT country) FROM ipstat WHERE country != ''").fetchone()[0]
+        row = con.execute("SELECT MIN(date) FROM daystat").fetchone()
+        if row[0] is not None:
+            summary['startdate'] = row[0]
+    finally:
+        con.close()
+    return summary
+#}}}
+def GetCountryStat(dbfile):#{{{
+    """Return a list of (country, numjob, numseq, numip) of the finished jobs,
+    the most jobs first"""
+    con = OpenDB(dbfile)
+    try:
+        return con.execute("SELECT country, SUM(numjob), SUM(numseq), COUNT(*) "
+                "FROM ipstat WHERE country != '' GROUP BY country "
+                "ORDER BY SUM(numjob) DESC, country").fetchall()
+    finally:
+        con.close()
+#}}}
+def PlotStat(statfile, li, period):#{{{
+    """Plot the number of jobs and sequences to statfile.{numjob,numseq}.png"""
+    # imported here so that the views reading the statistics do not load it
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    li = li[-MAX_NUM_BAR[period]:]
+    xticks = list(range(len(li)))
+    step = max(1, len(li)//12)
+    for (col, name) in [(1, "numjob"), (2, "numseq")]:
+        fig = plt.figure(figsize=(8, 3.5))
+        ax = fig.add_subplot(111)
+        ax.bar(xticks, [rd[col] for rd in li], color="#6a8fbf")
+        ax.set_xticks(xticks[::step])
+        ax.set_xticklabels([rd[0] for rd in li][::step], rotation=45, fontsize=8)
+        ax.set_ylabel("Number of %s"%({"numjob": "jobs", "numseq": "sequences"}[name]))
+        ax.set_title("Finished %s per %s of submission"%({"numjob": "jobs",
+            "numseq": "sequences"}[name], period))
+        fig.tight_layout()
+        outfile = "%s.%s.png"%(statfile, name)
+        tmpfile = "%s.tmp.%d.png"%(statfile, os.getpid())
+        fig.savefig(tmpfile)
+        plt.close(fig)
+        os.rename(tmpfile, outfile)
+#}}}
+def WriteStatFile(dbfile, path_stat, isPlot=True):#{{{
+    """Write incstat_finish_{day,week,month}.stat.txt and the plots to
+    path_stat"""
+    if not os.path.exists(path_stat):
+        os.makedirs(path_stat, exist_ok=True)
+    for period in PERIOD_LIST:
+        li = GetPeriodStat(dbfile, period)
+        statfile = "%s/%s"%(path_stat, STATFILE_FORMAT%(period))
+        tmpfile = "%s.tmp.%d"%(statfile, os.getpid())
+        with open(tmpfile, "w") as fpout:
+            fpout.write("#Date\tnumjob\tnumseq\n")
+            for (date, numjob, numseq) in li:
+                fpout.write("%s\t%d\t%d\n"%(date, numjob, numseq))
+        os.rename(tmpfile, statfile)
+        if isPlot and len(li) > 0:
+            PlotStat(statfile, li, period)
+#}}}
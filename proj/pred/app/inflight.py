@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Registry of the sequences being computed, shared by the run_job.py
+    processes, so that a sequence with the same cache key is computed only
+    once when several jobs contain it at the same time
+
+    The job computing the sequence holds the lock of the file
+    <path_inflight>/<md5_key>.lock, which contains the result folder of the
+    sequence in that job. Another job finding the lock held waits until it
+    is released and then copies the result from the cache or from that
+    folder if the sequence is recorded in the finished_seqs.txt of that job
+    (IsSeqFinished). The file is removed when the lock is released.
+
+    The sequences of the jobs dispatched by qd_fe to the remote nodes are
+    registered in the table dispatch of static/log/inflight.sqlite3, keyed by
+    the cache key, with the job, the node and the remote jobid computing it
+      - before a submission, the sequences of torun_seqindex.txt of the job
+        with a key registered for another job are held back in
+        inflight_seqindex.txt of the job, the next sequences to be submitted
+        are claimed (Claim)
+      - the rows of the job are replaced by the entries of its
+        remotequeue_seqindex.txt after each submission and retrieval
+        (SetDispatched), so that the key is released when the result of
+        the sequence has been retrieved or the sequence has failed
+      - a held sequence whose key is released is filled from the cache, or
+        from the other job if it finished the sequence, otherwise it is put
+        back to torun_seqindex.txt
+"""
+import os
+import time
+import fcntl
+import sqlite3
+
+POLL_INTERVAL = 5   # seconds between two attempts to get a held lock
+
+def _ReadOwnerPath(lockfile):#{{{
+    try:
+        with open(lockfile, "r") as fpin:
+            return fpin.read().strip()
+    except IOError:
+        return ""
+#}}}
+def _TryLock(lockfile):#{{{
+    """Return the locked file object, or None if the lock is held"""
+    while True:
+        fp = open(lockfile, "a+")
+        try:
+            fcntl.lockf(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            fp.close()
+            return None
+        # the file may have been removed by the previous holder between
+        # open and lockf, the lock is then on a stale file
+        try:
+            if os.stat(lockfile).st_ino == os.fstat(fp.fileno()).st_ino:
+                return fp
+        except OSError:
+            pass
+        fp.close()
+#}}}
+def Acquire(path_inflight, md5_key, outpath_this_seq, timeout=0):#{{{
+    """Register the sequence as being computed to outpath_this_seq, waiting
+    at most timeout seconds if it is computed by another job
+    return (fp, owner_path), fp is None if the lock was not acquired and
+    owner_path is the result folder of the last holder seen while waiting"""
+    if not os.path.exists(path_inflight):
+        os.makedirs(path_inflight, exist_ok=True)
+    lockfile = "%s/%s.lock"%(path_inflight, md5_key)
+    begin = time.time()
+    owner_path = ""
+    while True:
+        fp = _TryLock(lockfile)
+        if fp is not None:
+            fp.seek(0)
+            fp.truncate()
+            fp.write(outpath_this_seq)
+            fp.flush()
+            return (fp, owner_path)
+        path = _ReadOwnerPath(lockfile)
+        if path != "":
+            owner_path = path
+        if time.time() - begin >= timeout:
+            return (None, owner_path)
+        time.sleep(min(POLL_INTERVAL, max(0.1, timeout - (time.time() - begin))))
+#}}}
+def Release(fp):#{{{
+    """Release the registration, fp may be None"""
+    if fp is None:
+        return
+    try:
+        os.remove(fp.name)
+    except OSError:
+        pass
+    try:
+        fcntl.lockf(fp, fcntl.LOCK_UN)
+    except IOError:
+        pass
+    fp.close()
+#}}}
+def IsSeqFinished(outpath_result, subfolder):#{{{
+    """Return True if the sequence subfolder, e.g. seq_0, is recorded in the
+    finished_seqs.txt in outpath_result"""
+    try:
+        fpin = open("%s/finished_seqs.txt"%(outpath_result), "r")
+    except IOError:
+        return False
+    with fpin:
+        for line in fpin:
+            if line.split("\t", 1)[0] == subfolder:
+                return True
+    return False
+#}}}
+def OpenDB(dbfile):#{{{
+    con = sqlite3.connect(dbfile, timeout=30)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS dispatch(
+            md5_key TEXT PRIMARY KEY,
+            jobid TEXT NOT NULL,
+            seqindex INTEGER NOT NULL,
+            node TEXT NOT NULL,
+            remotejobid TEXT NOT NULL,
+            update_epoch REAL NOT NULL
+        )""")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_dispatch_jobid ON dispatch(jobid)")
+    con.commit()
+    return con
+#}}}
+def Claim(dbfile, jobid, keyli):#{{{
+    """Claim the keys of the sequences of the job about to be submitted,
+    keyli is a list of (seqindex, md5_key)
+    return {seqindex: (owner_jobid, owner_seqindex)} of the sequences with a
+    key registered for another job, which are not claimed"""
+    heldDict = {}
+    con = OpenDB(dbfile)
+    try:
+        with con:
+            # the insert is tried first, so that of two jobs claiming the
+            # key at the same time one gets it and the other sees it held
+            for (seqindex, md5_key) in keyli:
+                con.execute("INSERT OR IGNORE INTO dispatch(md5_key, jobid, seqindex, "
+                        "node, remotejobid, update_epoch) VALUES (?, ?, ?, '', '', ?)",
+                        (md5_key, jobid, seqindex, time.time()))
+                row = con.execute("SELECT jobid, seqindex FROM dispatch WHERE "
+                        "md5_key = ?", (md5_key,)).fetchone()
+                if row[0] != jobid:
+                    heldDict[seqindex] = (row[0], row[1])
+    finally:
+        con.close()
+    return heldDict
+#}}}
+def SetDispatched(dbfile, jobid, entryli):#{{{
+    """Replace the rows of the job by its sequences in the remote queue,
+    entryli is a list of (seqindex, node, remotejobid, md5_key). Keys
+    registered for another job are left to that job"""
+    con = OpenDB(dbfile)
+    try:
+        with con:
+            con.execute("DELETE FROM dispatch WHERE jobid = ?", (jobid,))
+            con.executemany("INSERT OR IGNORE INTO dispatch(md5_key, jobid, "
+                    "seqindex, node, remotejobid, update_epoch) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(md5_key, jobid, seqindex, node, remotejobid, time.time())
+                        for (seqindex, node, remotejobid, md5_key) in entryli])
+    finally:
+        con.close()
+#}}}
+def GetOwner(dbfile, keyli):#{{{
+    """Return {md5_key: jobid} of the keys in keyli that are registered"""
+    ownerDict = {}
+    con = OpenDB(dbfile)
+    try:
+        for md5_key in keyli:
+            row = con.execute("SELECT jobid FROM dispatch WHERE md5_key = ?",
+                    (md5_key,)).fetchone()
+            if row is not None:
+                ownerDict[md5_key] = row[0]
+    finally:
+        con.close()
+    return ownerDict
+#}}}
+def CleanDispatch(dbfile, jobidset):#{{{
+    """Delete the rows of the jobs not in jobidset, i.e. finished or deleted"""
+    con = OpenDB(dbfile)
+    try:
+        with con:
+            jobidli = [row[0] for row in con.execute("SELECT DISTINCT jobid FROM dispatch")]
+            con.executemany("DELETE FROM dispatch WHERE jobid = ?",
+                    [(jobid,) for jobid in jobidli if jobid not in jobidset])
+    finally:
+        con.close()
+#}}}
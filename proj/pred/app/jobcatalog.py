@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Catalog of the jobs with their status, so that the status of many jobs
+    is read by one indexed query instead of the tag files of each job
+
+    The status is written
+      - Wait:     by the views when the job is submitted (AddJob)
+      - Running:  by run_job.py when it writes runjob.start
+      - Finished/Failed: by run_job.py, by the views for jobs finished from
+        the cache or failed to be queued, and by qd_fe from the tag files
+        after retrieving the result of a job run on the remote nodes
+        (UpdateFromTagFile)
+    qd_fe adds as well the jobs of runjob_log.log (SyncRunJobLog) and of the
+    lines appended to finished_job.log since the last update
+    (UpdateFromFinishedLog), which fills the catalog with the jobs submitted
+    before it was introduced. The job is removed when its result folder is
+    removed. Jobs not in the catalog are looked up from their tag files by
+    the callers (GetStatusFromTagFile).
+
+    The job lists of the queue, running, finished and failed pages are read
+    by page from the indexes on status, client_ip and email, ordered by the
+    submit date (GetJobList).
+
+    Format of finished_job.log and runjob_log.log
+        jobid, status, jobname, ip, email, numseq, method_submission,
+        submit_date, start_date, finish_date, ...
+"""
+import os
+import time
+import sqlite3
+
+import logtail
+
+MAX_JOBID_PER_QUERY = 500   # below the limit of host parameters of sqlite3
+
+def OpenDB(dbfile):#{{{
+    con = sqlite3.connect(dbfile, timeout=30)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS job(
+            jobid TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            submit_date TEXT NOT NULL DEFAULT '',
+            start_date TEXT NOT NULL DEFAULT '',
+            finish_date TEXT NOT NULL DEFAULT '',
+            numseq INTEGER NOT NULL DEFAULT 0,
+            jobname TEXT NOT NULL DEFAULT '',
+            email TEXT NOT NULL DEFAULT '',
+            client_ip TEXT NOT NULL DEFAULT '',
+            method_submission TEXT NOT NULL DEFAULT '',
+            update_epoch REAL NOT NULL
+        )""")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_job_status "
+            "ON job(status, submit_date)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_job_client_ip "
+            "ON job(client_ip, status, submit_date)")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_job_email "
+            "ON job(email, status, submit_date)")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS tailstate(
+            logfile TEXT PRIMARY KEY,
+            inode INTEGER NOT NULL,
+            offset INTEGER NOT NULL
+        )""")
+    con.commit()
+    return con
+#}}}
+def GetStatusFromTagFile(rstdir):#{{{
+    """Return the status of the job from the tag files in rstdir as checkjob
+    does, or None if rstdir does not exist"""
+    if not os.path.exists(rstdir):
+        return None
+    elif os.path.exists("%s/runjob.failed"%(rstdir)):
+        return "Failed"
+    elif os.path.exists("%s/runjob.finish"%(rstdir)):
+        return "Finished"
+    elif os.path.exists("%s/runjob.start"%(rstdir)):
+        return "Running"
+    else:
+        return "Wait"
+#}}}
+def AddJob(dbfile, jobid, submit_date, numseq, jobname, email, client_ip,#{{{
+        method_submission, status="Wait"):
+    """Add the job, the status is kept if the job has already been set
+    running or finished"""
+    con = OpenDB(dbfile)
+    try:
+        with con:
+            con.execute("INSERT OR IGNORE INTO job(jobid, status, update_epoch) "
+                    "VALUES (?, ?, ?)", (jobid, status, time.time()))
+            con.execute("UPDATE job SET submit_date = ?, numseq = ?, jobname = ?, "
+                    "email = ?, client_ip = ?, method_submission = ? WHERE jobid = ?",
+                    (submit_date, numseq, jobname, email, client_ip,
+                        method_submission, jobid))
+    finally:
+        con.close()
+#}}}
+def SetStatus(dbfile, jobid, status, date_str=""):#{{{
+    """Set the status of the job, date_str is the start date for Running and
+    the finish date for Finished and Failed"""
+    if status == "Running":
+        column = "start_date"
+    elif status in ["Finished", "Failed"]:
+        column = "finish_date"
+    else:
+        column = None
+    con = OpenDB(dbfile)
+    try:
+        with con:
+            con.execute("INSERT OR IGNORE INTO job(jobid, status, update_epoch) "
+                    "VALUES (?, ?, ?)", (jobid, status, time.time()))
+            if column is None:
+                con.execute("UPDATE job SET status = ?, update_epoch = ? "
+                        "WHERE jobid = ?", (status, time.time(), jobid))
+            else:
+                con.execute("UPDATE job SET status = ?, %s = ?, update_epoch = ? "
+                        "WHERE jobid = ?"%(column), (status, date_str, time.time(), jobid))
+    finally:
+        con.close()
+#}}}
+def UpdateFromTagFile(dbfile, jobid, rstdir):#{{{
+    """Set the status of the job from its tag files if it has changed"""
+    status = GetStatusFromTagFile(rstdir)
+    if status is None:
+        DeleteJob(dbfile, [jobid])
+        return
+    if GetStatus(dbfile, [jobid]).get(jobid) == status:
+        return
+    date_str = ""
+    tagfile = {"Running": "runjob.start", "Finished": "runjob.finish",
+            "Failed": "runjob.failed"}.get(status)
+    if tagfile is not None:
+        try:
+            with open("%s/%s"%(rstdir, tagfile), "r") as fpin:
+                date_str = fpin.read().strip()
+        except IOError:
+            pass
+    SetStatus(dbfile, jobid, status, date_str)
+#}}}
+def DeleteJob(dbfile, jobidlist):#{{{
+    if len(jobidlist) == 0:
+        return
+    con = OpenDB(dbfile)
+    try:
+        with con:
+            con.executemany("DELETE FROM job WHERE jobid = ?",
+                    [(jobid,) for jobid in jobidlist])
+    finally:
+        con.close()
+#}}}
+def GetStatus(dbfile, jobidlist):#{{{
+    """Return {jobid: status} of the jobs in the catalog"""
+    statusDict = {}
+    con = OpenDB(dbfile)
+    try:
+        for i in range(0, len(jobidlist), MAX_JOBID_PER_QUERY):
+            sublist = jobidlist[i:i+MAX_JOBID_PER_QUERY]
+            for (jobid, status) in con.execute("SELECT jobid, status FROM job "
+                    "WHERE jobid IN (%s)"%(",".join(["?"]*len(sublist))), sublist):
+                statusDict[jobid] = status
+    finally:
+        con.close()
+    return statusDict
+#}}}
+def GetSubmitter(dbfile, jobid):#{{{
+    """Return (email, client_ip) of the submitter of the job, or None if the
+    job is not in the catalog"""
+    con = OpenDB(dbfile)
+    try:
+        return con.execute("SELECT email, client_ip FROM job WHERE jobid = ?",
+                (jobid,)).fetchone()
+    finally:
+        con.close()
+#}}}
+def PruneMissing(dbfile, path_result):#{{{
+    """Remove the jobs of which the result folder does not exist any more
+    return the number of removed jobs"""
+    con = OpenDB(dbfile)
+    try:
+        jobidlist = [row[0] for row in con.execute("SELECT jobid FROM job")]
+    finally:
+        con.close()
+    missinglist = [jobid for jobid in jobidlist
+            if not os.path.exists("%s/%s"%(path_result, jobid))]
+    DeleteJob(dbfile, missinglist)
+    return len(missinglist)
+#}}}
+def ParseJobLogLine(line):#{{{
+    """Return a dict of a line of finished_job.log or runjob_log.log, or None
+    if the line is not valid"""
+    strs = line.split("\t")
+    if len(strs) < 10 or strs[0] == "" or strs[0][0] == "#":
+        return None
+    try:
+        numseq = int(strs[5])
+    except ValueError:
+        numseq = 1
+    return {'jobid': os.path.basename(strs[0]), 'status': strs[1],
+            'jobname': strs[2], 'client_ip': strs[3], 'email': strs[4],
+            'numseq': numseq, 'method_submission': strs[6],
+            'submit_date': strs[7], 'start_date': strs[8],
+            'finish_date': strs[9]}
+#}}}
+def _UpsertJob(con, rd):#{{{
+    con.execute("INSERT OR REPLACE INTO job(jobid, status, submit_date, "
+            "start_date, finish_date, numseq, jobname, email, client_ip, "
+            "method_submission, update_epoch) VALUES (?, ?, ?, ?, ?, ?, ?, ?, "
+            "?, ?, ?)", (rd['jobid'], rd['status'], rd['submit_date'],
+                rd['start_date'], rd['finish_date'], rd['numseq'],
+                rd['jobname'], rd['email'], rd['client_ip'],
+                rd['method_submission'], time.time()))
+#}}}
+def UpdateFromFinishedLog(dbfile, logfile, path_result):#{{{
+    """Set the jobs appended to finished_job.log since the last update, jobs
+    of which the result folder has been removed are skipped
+    return the number of updated jobs"""
+    con = OpenDB(dbfile)
+    cnt = 0
+    try:
+        row = con.execute("SELECT inode, offset FROM tailstate WHERE logfile = ?",
+                (logfile,)).fetchone()
+        (inode, offset) = (-1, 0) if row is None else row
+        (lines, inode, offset) = logtail.ReadNewLines(logfile, inode, offset)
+        with con:
+            for line in lines:
+                rd = ParseJobLogLine(line)
+                if (rd is None or rd['status'] not in ["Finished", "Failed"] or
+                        not os.path.exists("%s/%s"%(path_result, rd['jobid']))):
+                    continue
+                _UpsertJob(con, rd)
+                cnt += 1
+            con.execute("INSERT OR REPLACE INTO tailstate(logfile, inode, offset) "
+                    "VALUES (?, ?, ?)", (logfile, inode, offset))
+    finally:
+        con.close()
+    return cnt
+#}}}
+def SyncRunJobLog(dbfile, runjoblogfile):#{{{
+    """Set the jobs in runjob_log.log, i.e. the jobs waiting or running, of
+    which the status in the catalog is different
+    return the number of updated jobs"""
+    rdDict = {}
+    try:
+        with open(runjoblogfile, "r") as fpin:
+            for line in fpin:
+                rd = ParseJobLogLine(line.rstrip("\n"))
+                if rd is not None and rd['status'] in ["Wait", "Running"]:
+                    rdDict[rd['jobid']] = rd
+    except IOError:
+        return 0
+    statusDict = GetStatus(dbfile, list(rdDict.keys()))
+    # only jobs not yet known as running or finished are set, the status in
+    # runjob_log.log is older than the one written by run_job.py
+    rank = {"Wait": 0, "Running": 1, "Finished": 2, "Failed": 2}
+    updatelist = [rd for (jobid, rd) in rdDict.items() if jobid not in statusDict
+            or rank.get(statusDict[jobid], 0) < rank[rd['status']]]
+    if len(updatelist) == 0:
+        return 0
+    con = OpenDB(dbfile)
+    try:
+        with con:
+            for rd in updatelist:
+                _UpsertJob(con, rd)
+    finally:
+        con.close()
+    return len(updatelist)
+#}}}
+def _GetCondition(status, client_ip, email, min_submit_date):#{{{
+    condlist = ["status = ?"]
+    paralist = [status]
+    if client_ip is not None:
+        condlist.append("client_ip = ?")
+        paralist.append(client_ip)
+    if email is not None:
+        condlist.append("email = ?")
+        paralist.append(email)
+    if min_submit_date != "":
+        condlist.append("submit_date >= ?")
+        paralist.append(min_submit_date)
+    return (" AND ".join(condlist), paralist)
+#}}}
+def CountJob(dbfile, status, client_ip=None, email=None, min_submit_date=""):#{{{
+    """Return the number of jobs with the status, submitted from client_ip and
+    with email if they are not None, after min_submit_date if it is not
+    empty"""
+    (cond, paralist) = _GetCondition(status, client_ip, email, min_submit_date)
+    con = OpenDB(dbfile)
+    try:
+        return con.execute("SELECT COUNT(*) FROM job WHERE %s"%(cond),
+                paralist).fetchone()[0]
+    finally:
+        con.close()
+#}}}
+def GetJobList(dbfile, status, offset, limit, client_ip=None, email=None,#{{{
+        min_submit_date="", isNewestFirst=True):
+    """Return a list of dicts of the jobs selected as by CountJob, ordered by
+    the submit date, the rows offset to offset+limit"""
+    (cond, paralist) = _GetCondition(status, client_ip, email, min_submit_date)
+    con = OpenDB(dbfile)
+    try:
+        cursor = con.execute("SELECT jobid, status, submit_date, start_date, "
+                "finish_date, numseq, jobname, email, client_ip, method_submission "
+                "FROM job WHERE %s ORDER BY submit_date %s LIMIT ? OFFSET ?"%(
+                    cond, "DESC" if isNewestFirst else "ASC"),
+                paralist + [limit, offset])
+        namelist = [d[0] for d in cursor.description]
+        return [dict(zip(namelist, row)) for row in cursor]
+    finally:
+        con.close()
+#}}}
+def CountJobByClient(dbfile):#{{{
+    """Return {client_ip: {status: numjob}} of all jobs in the catalog"""
+    countDict = {}
+    con = OpenDB(dbfile)
+    try:
+        for (client_ip, status, numjob) in con.execute("SELECT client_ip, "
+                "status, COUNT(*) FROM job GROUP BY client_ip, status"):
+            countDict.setdefault(client_ip or "", {})[status] = numjob
+    finally:
+        con.close()
+    return countDict
+#}}}
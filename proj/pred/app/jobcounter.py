@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Counter of the queued, running, finished and failed jobs shown on every
+    page, shared by the web workers
+
+    The leader of qd_fe counts the jobs of each client IP from the job
+    catalog in each loop and writes them to static/log/jobcounter.json
+    (Refresh), with the counts of all jobs under the key KEY_ALL for the
+    super users. The views read the counter of the user from the file
+    (GetJobCounter), the parsed file is kept in the process until the file
+    is replaced, so that a page is rendered without reading the job logs.
+    The counter is served even if the file is older than max_age, e.g. a
+    loop of the leader takes long or qd_fe is not running on this node, the
+    age only makes the caller refresh the file from the job catalog, by one
+    process at a time (RefreshIfOutdated). None is returned only if there is
+    no counter file.
+
+    Format of jobcounter.json
+        {"update_epoch": float, "counter": {client_ip: {status: numjob}}}
+"""
+import os
+import time
+import json
+import fcntl
+
+import jobcatalog
+
+JOBCOUNTER_MAX_AGE = 60
+KEY_ALL = "__all__"
+
+# key in the counter of the pages: status in the job catalog
+STATUS_KEY_DICT = {
+        "queued": "Wait",
+        "running": "Running",
+        "finished": "Finished",
+        "failed": "Failed",
+        }
+
+g_cache = {'mtime': None, 'counterDict': {}}  # parsed counter file
+
+def WriteJobCounter(counterfile, counterDict):#{{{
+    """Write counterDict to counterfile atomically"""
+    tmpfile = "%s.tmp.%d"%(counterfile, os.getpid())
+    with open(tmpfile, "w") as fpout:
+        json.dump({'update_epoch': time.time(), 'counter': counterDict},
+                fpout, sort_keys=True)
+    os.rename(tmpfile, counterfile)
+#}}}
+def Refresh(counterfile, jobcatalog_db):#{{{
+    """Count the jobs of each client IP and of all clients from the job
+    catalog and write them to counterfile"""
+    counterDict = jobcatalog.CountJobByClient(jobcatalog_db)
+    allDict = {}
+    for statusDict in counterDict.values():
+        for (status, numjob) in statusDict.items():
+            allDict[status] = allDict.get(status, 0) + numjob
+    counterDict[KEY_ALL] = allDict
+    WriteJobCounter(counterfile, counterDict)
+#}}}
+def RefreshIfOutdated(counterfile, jobcatalog_db, max_age=JOBCOUNTER_MAX_AGE):#{{{
+    """Refresh counterfile if it is older than max_age, unless it is being
+    refreshed by another process
+    return True if the file has been refreshed"""
+    try:
+        if time.time() - os.stat(counterfile).st_mtime <= max_age:
+            return False
+    except OSError:
+        pass
+    with open("%s.lock"%(counterfile), "a") as fplock:
+        try:
+            fcntl.flock(fplock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            return False
+        try:
+            # refreshed by another process since the check above
+            if time.time() - os.stat(counterfile).st_mtime <= max_age:
+                return False
+        except OSError:
+            pass
+        Refresh(counterfile, jobcatalog_db)
+    return True
+#}}}
+def _ReadCounterFile(counterfile):#{{{
+    """Return (update_epoch, counterDict) of counterfile, the file is parsed
+    only if it has been replaced since the last call"""
+    try:
+        mtime = os.stat(counterfile).st_mtime
+    except OSError:
+        return (0, {})
+    if g_cache['mtime'] != mtime:
+        try:
+            with open(counterfile, "r") as fpin:
+                content = json.load(fpin)
+        except (IOError, ValueError):
+            return (0, {})
+        g_cache['update_epoch'] = content.get('update_epoch', 0)
+        g_cache['counterDict'] = content.get('counter', {})
+        g_cache['mtime'] = mtime
+    return (g_cache['update_epoch'], g_cache['counterDict'])
+#}}}
+def GetJobCounter(counterfile, key):#{{{
+    """Return the job counter of key, the client IP or KEY_ALL, in the format
+    of webcom.GetJobCounter, or None if counterfile does not exist. The lists
+    of jobids are not kept and are empty"""
+    (update_epoch, counterDict) = _ReadCounterFile(counterfile)
+    if update_epoch == 0:
+        return None
+    statusDict = counterDict.get(key, {})
+    jobcounter = {'nojobfolder': 0, 'nojobfolder_idlist': []}
+    for (name, status) in STATUS_KEY_DICT.items():
+        jobcounter[name] = statusDict.get(status, 0)
+        jobcounter['%s_idlist'%(name)] = []
+    return jobcounter
+#}}}
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Read the lines appended to a log file since the last read
+
+    The position of the reader is given by (inode, offset). Reading restarts
+    from the beginning when the file has been replaced (the inode changed) or
+    truncated (the size is smaller than the offset), e.g. by ArchiveLogFile.
+    Only complete lines are returned, a line being written is read next time.
+"""
+import os
+
+MAX_READ_SIZE = 64*1024*1024    # read at most this many bytes per call
+
+def ReadNewLines(logfile, inode, offset, max_size=MAX_READ_SIZE):#{{{
+    """Return (lines, inode, offset), lines is a list of str without the
+    trailing newline, the returned inode and offset are to be given in the
+    next call"""
+    try:
+        fpin = open(logfile, "rb")
+    except IOError:
+        return ([], inode, offset)
+    with fpin:
+        st = os.fstat(fpin.fileno())
+        if st.st_ino != inode or st.st_size < offset:
+            offset = 0
+        fpin.seek(offset)
+        buff = fpin.read(max_size)
+    end = buff.rfind(b"\n")
+    if end == -1:
+        return ([], st.st_ino, offset)
+    lines = buff[:end].decode('utf-8', 'replace').split("\n")
+    return (lines, st.st_ino, offset + end + 1)
+#}}}
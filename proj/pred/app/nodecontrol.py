@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Throughput-adaptive limit of the number of sequences dispatched to each
+    compute node
+
+    The limit of a node is adjusted every AIMD_INTERVAL seconds by an
+    additive-increase/multiplicative-decrease (AIMD) controller
+      - decrease: limit = limit*AIMD_DECREASE when the failure rate in the
+        last interval exceeds AIMD_MAX_FAILURE_RATE or the mean time that
+        finished sequences spent in the remote queue exceeds AIMD_MAX_LATENCY
+      - increase: limit = limit+AIMD_INCREASE when the node is healthy, all
+        slots of the node are in use and sequences are being finished
+    The limit is kept between AIMD_MIN_LIMIT and the static limit obtained
+    from MAX_SUBMIT_JOB_PER_NODE and computenode.txt.
+
+    Finished and failed sequences are read from the finished table of
+    remotequeue_index.py, failed requests to the node are reported by
+    RecordRequestError. The state of each node is kept in a sqlite3 database
+    so that it survives the restart of qd_fe.
+
+    The measured completion rate also gives the size of the chunks in which
+    sequences of a job are dispatched to the node, see GetChunkSize.
+"""
+import time
+import math
+import sqlite3
+import threading
+
+import remotequeue_index
+
+EWMA_ALPHA = 0.3    # weight of the last interval in the moving averages
+
+g_lock = threading.Lock()
+g_requestErrorDict = {}     # {node: number of failed requests}
+
+def OpenDB(dbfile):#{{{
+    con = sqlite3.connect(dbfile, timeout=30)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS nodestat(
+            node TEXT PRIMARY KEY,
+            dispatch_limit REAL NOT NULL,
+            rate REAL NOT NULL DEFAULT 0,
+            latency REAL NOT NULL DEFAULT 0,
+            failure_rate REAL NOT NULL DEFAULT 0,
+            update_epoch REAL NOT NULL
+        )""")
+    con.commit()
+    return con
+#}}}
+def RecordRequestError(node):#{{{
+    """Count a failed request (SubmitJob or GetResult) to the node"""
+    with g_lock:
+        g_requestErrorDict[node] = g_requestErrorDict.get(node, 0) + 1
+#}}}
+def _PopRequestError(node):#{{{
+    with g_lock:
+        return g_requestErrorDict.pop(node, 0)
+#}}}
+def ReadNodeStat(dbfile):#{{{
+    """Return a dict {node: {'dispatch_limit':, 'rate':, 'latency':,
+    'failure_rate':, 'update_epoch':}}, rate is in sequences per second"""
+    statDict = {}
+    con = OpenDB(dbfile)
+    try:
+        for row in con.execute("SELECT node, dispatch_limit, rate, latency, "
+                "failure_rate, update_epoch FROM nodestat"):
+            statDict[row[0]] = {'dispatch_limit': row[1], 'rate': row[2],
+                    'latency': row[3], 'failure_rate': row[4],
+                    'update_epoch': row[5]}
+    finally:
+        con.close()
+    return statDict
+#}}}
+def _Ewma(old, new):#{{{
+    return EWMA_ALPHA*new + (1.0-EWMA_ALPHA)*old
+#}}}
+def UpdateDispatchLimit(dbfile, remotequeue_db, cntSubmitJobDict, g_params):#{{{
+    """Update the dispatch limit of each node and set it to
+    cntSubmitJobDict[node][1]
+    return a list of (node, old_limit, new_limit) for changed limits"""
+    epoch = time.time()
+    statDict = ReadNodeStat(dbfile)
+    begin_epoch = min([statDict[node]['update_epoch'] for node in statDict] + [epoch])
+    finishedDict = remotequeue_index.GetFinishedStat(remotequeue_db, begin_epoch)
+    min_limit = g_params['AIMD_MIN_LIMIT']
+
+    changedli = []
+    updateli = []
+    for node in cntSubmitJobDict:
+        num_inflight = cntSubmitJobDict[node][0]
+        static_limit = cntSubmitJobDict[node][1]
+        if node not in statDict:
+            # start from the current load so that a restart does not flood
+            # the node
+            limit = min(static_limit, max(min_limit, num_inflight))
+            st = {'dispatch_limit': limit, 'rate': 0.0, 'latency': 0.0,
+                    'failure_rate': 0.0, 'update_epoch': epoch}
+            updateli.append((node, st))
+        else:
+            st = statDict[node]
+            limit = st['dispatch_limit']
+            duration = epoch - st['update_epoch']
+            if duration >= g_params['AIMD_INTERVAL']:
+                # finished sequences of this node are counted from its last
+                # update
+                (num_success, num_fail, sum_latency) = _CountFinished(
+                        remotequeue_db, node, st['update_epoch'], finishedDict,
+                        begin_epoch)
+                num_fail += _PopRequestError(node)
+                st['rate'] = _Ewma(st['rate'], num_success/duration)
+                failure_rate = 0.0
+                if num_success + num_fail > 0:
+                    failure_rate = float(num_fail)/(num_success+num_fail)
+                st['failure_rate'] = _Ewma(st['failure_rate'], failure_rate)
+                latency = 0.0
+                if num_success > 0:
+                    latency = sum_latency/num_success
+                    st['latency'] = _Ewma(st['latency'], latency)
+
+                if (failure_rate > g_params['AIMD_MAX_FAILURE_RATE'] or
+                        latency > g_params['AIMD_MAX_LATENCY']):
+                    limit = limit*g_params['AIMD_DECREASE']
+                elif num_inflight >= int(limit) and num_success > 0:
+                    limit = limit + g_params['AIMD_INCREASE']
+                st['update_epoch'] = epoch
+                updateli.append((node, st))
+            limit = min(static_limit, max(min_limit, limit))
+            if int(limit) != int(st['dispatch_limit']):
+                changedli.append((node, int(st['dispatch_limit']), int(limit)))
+            st['dispatch_limit'] = limit
+        cntSubmitJobDict[node][1] = min(static_limit, int(limit))
+
+    if len(updateli) > 0:
+        con = OpenDB(dbfile)
+        try:
+            with con:
+                con.executemany("INSERT OR REPLACE INTO nodestat(node, "
+                        "dispatch_limit, rate, latency, failure_rate, update_epoch) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        [(node, st['dispatch_limit'], st['rate'], st['latency'],
+                            st['failure_rate'], st['update_epoch'])
+                            for (node, st) in updateli])
+        finally:
+            con.close()
+    return changedli
+#}}}
+def ApplyDispatchLimit(dbfile, cntSubmitJobDict):#{{{
+    """Set the stored dispatch limits to cntSubmitJobDict without updating
+    them, used by qd_fe workers other than the leader"""
+    statDict = ReadNodeStat(dbfile)
+    for node in cntSubmitJobDict:
+        if node in statDict:
+            cntSubmitJobDict[node][1] = min(cntSubmitJobDict[node][1],
+                    int(statDict[node]['dispatch_limit']))
+#}}}
+def _CountFinished(remotequeue_db, node, update_epoch, finishedDict, begin_epoch):#{{{
+    if update_epoch <= begin_epoch:
+        return tuple(finishedDict.get(node, [0, 0, 0.0]))
+    stat = remotequeue_index.GetFinishedStat(remotequeue_db, update_epoch)
+    return tuple(stat.get(node, [0, 0, 0.0]))
+#}}}
+def GetChunkSize(nodestat, g_params):#{{{
+    """Return the number of sequences of one job that the node may have in
+    its remote queue, i.e. the number of sequences the node finishes in
+    CHUNK_TIME seconds, nodestat is an item of ReadNodeStat or None"""
+    chunk_size = g_params['MIN_CHUNK_SIZE']
+    if nodestat is not None:
+        chunk_size = max(chunk_size,
+                int(math.ceil(nodestat['rate']*g_params['CHUNK_TIME'])))
+    return chunk_size
+#}}}
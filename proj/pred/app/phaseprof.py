@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Timing of the phases of the qd_fe loop
+
+    The time of each phase (with Phase(name): ...) is added to a histogram
+    with the fixed bucket bounds BUCKET_BOUNDS. Phases run by the worker
+    threads, e.g. the per-job submit_job and get_result, are recorded as
+    well. At the end of each loop (EndLoop) the stats file is written with
+      - last_loop: {phase: seconds} of the last loop
+      - current:   {phase: histogram} of the current window of loops
+      - previous:  {phase: histogram} of the previous window
+    with histogram = {count, sum, max, buckets}, buckets[i] being the number
+    of samples <= BUCKET_BOUNDS[i], the last bucket for larger samples. The
+    window is rotated every window_size loops.
+
+    A loop can be profiled by cProfile (StartProfile and StopProfile), only
+    the main thread is profiled.
+"""
+import os
+import io
+import time
+import json
+import glob
+import pstats
+import cProfile
+import threading
+import contextlib
+
+BUCKET_BOUNDS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 600]
+
+g_lock = threading.Lock()
+g_currentDict = {}      # {phase: histogram}
+g_previousDict = {}
+g_lastLoopDict = {}     # {phase: seconds}
+g_windowStartLoop = 0
+
+def NewHistogram(bounds=BUCKET_BOUNDS):#{{{
+    return {'count': 0, 'sum': 0.0, 'max': 0.0,
+            'buckets': [0]*(len(bounds)+1)}
+#}}}
+def AddToHistogram(hist, seconds, bounds=BUCKET_BOUNDS):#{{{
+    hist['count'] += 1
+    hist['sum'] += seconds
+    hist['max'] = max(hist['max'], seconds)
+    idx = len(bounds)
+    for i in range(len(bounds)):
+        if seconds <= bounds[i]:
+            idx = i
+            break
+    hist['buckets'][idx] += 1
+#}}}
+def MergeHistogram(hist, other):#{{{
+    """Add the histogram other with the same bounds to hist"""
+    hist['count'] += other['count']
+    hist['sum'] += other['sum']
+    hist['max'] = max(hist['max'], other['max'])
+    for i in range(len(hist['buckets'])):
+        hist['buckets'][i] += other['buckets'][i]
+#}}}
+def GetQuantile(hist, q, bounds=BUCKET_BOUNDS):#{{{
+    """Return the q-quantile (0 < q < 1) estimated by linear interpolation
+    within the bucket, or None if the histogram is empty"""
+    if hist['count'] == 0:
+        return None
+    rank = q*hist['count']
+    cum = 0
+    for i in range(len(hist['buckets'])):
+        num = hist['buckets'][i]
+        if num > 0 and cum + num >= rank:
+            lower = 0.0 if i == 0 else bounds[i-1]
+            upper = bounds[i] if i < len(bounds) else hist['max']
+            upper = min(upper, hist['max'])
+            return lower + (upper - lower)*(rank - cum)/float(num)
+        cum += num
+    return hist['max']
+#}}}
+def AddTime(name, seconds):#{{{
+    with g_lock:
+        if name not in g_currentDict:
+            g_currentDict[name] = NewHistogram()
+        AddToHistogram(g_currentDict[name], seconds)
+        g_lastLoopDict[name] = g_lastLoopDict.get(name, 0.0) + seconds
+#}}}
+@contextlib.contextmanager
+def Phase(name):#{{{
+    """Record the time spent in the with block as the phase name"""
+    begin = time.time()
+    try:
+        yield
+    finally:
+        AddTime(name, time.time() - begin)
+#}}}
+def EndLoop(statfile, loop, loop_time, window_size):#{{{
+    """Record the time of the loop and write the stats file atomically"""
+    global g_currentDict, g_previousDict, g_lastLoopDict, g_windowStartLoop
+    AddTime("loop", loop_time)
+    with g_lock:
+        content = json.dumps({'update_epoch': time.time(), 'loop': loop,
+            'window_start_loop': g_windowStartLoop,
+            'bucket_bounds': BUCKET_BOUNDS, 'last_loop': g_lastLoopDict,
+            'current': g_currentDict, 'previous': g_previousDict}, sort_keys=True)
+        g_lastLoopDict = {}
+        if loop - g_windowStartLoop + 1 >= window_size:
+            g_previousDict = g_currentDict
+            g_currentDict = {}
+            g_windowStartLoop = loop + 1
+    tmpfile = "%s.tmp.%d"%(statfile, os.getpid())
+    with open(tmpfile, "w") as fpout:
+        fpout.write(content)
+    os.rename(tmpfile, statfile)
+#}}}
+def ReadStatFile(statfile):#{{{
+    """Return the dict written by EndLoop, or None"""
+    try:
+        with open(statfile, "r") as fpin:
+            return json.load(fpin)
+    except (IOError, ValueError):
+        return None
+#}}}
+def StartProfile():#{{{
+    prof = cProfile.Profile()
+    prof.enable()
+    return prof
+#}}}
+def StopProfile(prof, path_profile, loop, num_keep):#{{{
+    """Write loop_<loop>.prof and the summary loop_<loop>.txt sorted by the
+    cumulative time to path_profile, only the last num_keep are kept"""
+    prof.disable()
+    if not os.path.exists(path_profile):
+        os.makedirs(path_profile, exist_ok=True)
+    prof.dump_stats("%s/loop_%d.prof"%(path_profile, loop))
+    buff = io.StringIO()
+    pstats.Stats(prof, stream=buff).sort_stats("cumulative").print_stats(50)
+    with open("%s/loop_%d.txt"%(path_profile, loop), "w") as fpout:
+        fpout.write(buff.getvalue())
+    proflist = sorted(glob.glob("%s/loop_*.prof"%(path_profile)),
+            key=os.path.getmtime)
+    for proffile in proflist[:max(0, len(proflist)-num_keep)]:
+        for filename in [proffile, proffile[:-len(".prof")]+".txt"]:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+#}}}
@@ -5,6 +5,9 @@ Description:
     Daemon to submit jobs and retrieve results to/from remote servers
     run periodically
     At the end of each run generate a runlog file with the status of all jobs
+
+Usage: qd_fe.py [-worker NAME]
+    several workers with different names can share the jobs, see workerpool.py
 """
 import os
 import sys
@@ -23,6 +26,23 @@ from libpredweb import myfunc
 from libpredweb import dataprocess
 from libpredweb import webserver_common as webcom
 from libpredweb import qd_fe_common as qdcom
+import remotequeue_index
+import wsdl_client
+import fairshare
+import nodecontrol
+import speculation
+import admission
+import workerpool
+import incstat
+import expiry
+import phaseprof
+import serverstate
+import jobcatalog
+import jobcounter
+import submit_job_to_queue
+import resultindex
+import inflight
+import resultcache
 
 import time
 import requests
@@ -31,20 +51,33 @@ import urllib.request, urllib.parse, urllib.error
 import shutil
 import hashlib
 import subprocess
+import socket
+import math
+import threading
+import concurrent.futures
 from suds.client import Client
 import numpy
 
 from geoip import geolite2
 import pycountry
+
 TZ = "Europe/Stockholm"
 os.environ['TZ'] = TZ
 time.tzset()
 
-# make sure that only one instance of the script is running
-# this code is working 
+# several workers can be run with different names by "qd_fe.py -worker NAME"
+# on the same host, see workerpool.py. Make sure that only one instance of
+# each worker is running
 progname = os.path.basename(__file__)
 rootname_progname = os.path.splitext(progname)[0]
+worker_name = ""
+if "-worker" in sys.argv and sys.argv.index("-worker")+1 < len(sys.argv):
+    worker_name = sys.argv[sys.argv.index("-worker")+1]
 lockname = os.path.realpath(__file__).replace(" ", "").replace("/", "-")
+if worker_name != "":
+    lockname += "-%s"%(worker_name)
+else:
+    worker_name = workerpool.GetDefaultWorkerName()
 import fcntl
 lock_file = "/tmp/%s.lock"%(lockname)
 fp = open(lock_file, 'w')
@@ -62,6 +95,7 @@ basedir = os.path.realpath("%s/.."%(rundir)) # path of the application, i.e. pre
 path_static = "%s/static"%(basedir)
 path_log = "%s/static/log"%(basedir)
 path_stat = "%s/stat"%(path_log)
+path_tmp = "%s/tmp"%(path_static)
 path_result = "%s/static/result"%(basedir)
 path_cache = "%s/static/result/cache"%(basedir)
 computenodefile = "%s/config/computenode.txt"%(basedir)
@@ -70,8 +104,682 @@ gen_errfile = "%s/static/log/%s.err"%(basedir, progname)
 gen_logfile = "%s/static/log/%s.log"%(basedir, progname)
 black_iplist_file = "%s/config/black_iplist.txt"%(basedir)
 finished_date_db = "%s/cached_job_finished_date.sqlite3"%(path_log)
+remotequeue_db = "%s/remotequeue_index.sqlite3"%(path_log)
+fairshare_db = "%s/fairshare.sqlite3"%(path_log)
+nodecontrol_db = "%s/nodecontrol.sqlite3"%(path_log)
+speculation_db = "%s/speculation.sqlite3"%(path_log)
+loadfile = "%s/qd_fe_load.json"%(path_log)
+path_worker = "%s/qd_fe_worker"%(path_log)
+incstat_db = "%s/incstat.sqlite3"%(path_log)
+expiry_db = "%s/expiry.sqlite3"%(path_log)
+serverstate_db = "%s/serverstate.sqlite3"%(path_log)
+jobcatalog_db = "%s/jobcatalog.sqlite3"%(path_log)
+jobcounter_file = "%s/jobcounter.json"%(path_log)
+inflight_db = "%s/inflight.sqlite3"%(path_log)
+leader_leasefile = "%s/leader.lease"%(path_worker)
+phase_statfile = "%s/qd_fe_phase.%s.json"%(path_log, worker_name)
+path_profile = "%s/qd_fe_profile"%(path_log)
 vip_email_file = "%s/config/vip_email.txt"%(basedir)
 
+# suds clients created by qd_fe_common are cached and share one connection pool
+if not wsdl_client.InstallToModule(qdcom):
+    webcom.loginfo("qd_fe_common has no attribute Client, its suds clients "
+            "are created for each call without the cache of wsdl_client", gen_errfile)
+
+g_lock = threading.Lock()
+g_jobLockDict = {}          # {jobid: threading.Lock}
+g_nodeSemaphoreDict = {}    # {node: threading.BoundedSemaphore}
+g_seqKeyDict = {}           # {jobid: {seqindex: (md5_key, description, seqlen)}}
+g_finishedSeqCountDict = {} # {jobid: (inode, offset, count)} of finished_seqs.txt
+
+
+def GetJobLock(jobid):#{{{
+    """Return the lock of the job, so that SubmitJob and GetResult are never
+    run for the same job at the same time"""
+    with g_lock:
+        if jobid not in g_jobLockDict:
+            g_jobLockDict[jobid] = threading.Lock()
+        return g_jobLockDict[jobid]
+#}}}
+def CleanJobLock(jobidset):#{{{
+    """Delete locks and cache keys of the jobs that are no longer in the
+    queue"""
+    with g_lock:
+        for jobid in list(g_jobLockDict.keys()):
+            if jobid not in jobidset and not g_jobLockDict[jobid].locked():
+                del g_jobLockDict[jobid]
+        for jobid in list(g_seqKeyDict.keys()):
+            if jobid not in jobidset:
+                del g_seqKeyDict[jobid]
+#}}}
+def AcquireNodeSlot(nodelist, g_params):#{{{
+    """Limit the number of concurrent requests to each node
+    the semaphores are acquired in sorted order to avoid deadlock"""
+    semli = []
+    with g_lock:
+        for node in sorted(set(nodelist)):
+            if node not in g_nodeSemaphoreDict:
+                g_nodeSemaphoreDict[node] = threading.BoundedSemaphore(
+                        g_params['MAX_CONCURRENT_REQUEST_PER_NODE'])
+            semli.append(g_nodeSemaphoreDict[node])
+    for sem in semli:
+        sem.acquire()
+    return semli
+#}}}
+def ReleaseNodeSlot(semli):#{{{
+    for sem in reversed(semli):
+        sem.release()
+#}}}
+def GetCountry(ip):#{{{
+    """Return the country name of the IP address, or "" if unknown"""
+    try:
+        match = geolite2.lookup(ip)
+        return pycountry.countries.get(alpha_2=match.country).name
+    except Exception:
+        return ""
+#}}}
+def UpdateIncStat(finishedjoblogfile):#{{{
+    """Add newly finished jobs to the statistics
+    return the number of added jobs"""
+    try:
+        return incstat.Update(incstat_db, finishedjoblogfile, GetCountry)
+    except Exception as e:
+        webcom.loginfo("incstat.Update failed with errmsg=%s"%(str(e)), gen_errfile)
+        return 0
+#}}}
+def WriteIncStatFile():#{{{
+    """Rewrite the stat files and plots under path_stat"""
+    try:
+        incstat.WriteStatFile(incstat_db, path_stat)
+    except Exception as e:
+        webcom.loginfo("incstat.WriteStatFile failed with errmsg=%s"%(str(e)), gen_errfile)
+#}}}
+def SubmitPendingJob(jobid, g_params):#{{{
+    """Submit the job to the local queue if its submission by the web
+    process is pending for too long, see submit_job_to_queue.py"""
+    rstdir = "%s/%s"%(path_result, jobid)
+    try:
+        status = submit_job_to_queue.SubmitPending(rstdir,
+                g_params['SUBMIT_PENDING_TIMEOUT'])
+    except Exception as e:
+        webcom.loginfo("SubmitPending(%s) failed with errmsg=%s"%(jobid, str(e)),
+                gen_errfile)
+        status = 1
+    if status is None:
+        return
+    webcom.loginfo("pending submission of %s submitted with status %d"%(jobid,
+        status), gen_logfile)
+    if status != 0:
+        webcom.WriteDateTimeTagFile("%s/runjob.failed"%(rstdir),
+                "%s/runjob.log"%(rstdir), "%s/runjob.err"%(rstdir))
+        try:
+            jobcatalog.UpdateFromTagFile(jobcatalog_db, jobid, rstdir)
+        except Exception as e:
+            webcom.loginfo("jobcatalog.UpdateFromTagFile(%s) failed with errmsg=%s"%(
+                jobid, str(e)), gen_errfile)
+#}}}
+def ReadRunJobList(runjoblogfile):#{{{
+    """Read the jobs in queue or running from runjoblogfile
+    return a list of tuples (jobid, numseq, email, numseq_this_user, user)"""
+    joblist = []
+    hdl = myfunc.ReadLineByBlock(runjoblogfile)
+    if hdl.failure:
+        return joblist
+    lines = hdl.readlines()
+    while lines != None:
+        for line in lines:
+            strs = line.split("\t")
+            if len(strs) >= 11:
+                jobid = strs[0]
+                ip = strs[3]
+                email = strs[4]
+                try:
+                    numseq = int(strs[5])
+                except:
+                    numseq = 1
+                    pass
+                try:
+                    numseq_this_user = int(strs[10])
+                except:
+                    numseq_this_user = 1
+                    pass
+                user = fairshare.GetUserKey(email, ip)
+                joblist.append((jobid, numseq, email, numseq_this_user, user))
+        lines = hdl.readlines()
+    hdl.close()
+    return joblist
+#}}}
+def CountFinishedSeq(jobid):#{{{
+    """Return the number of finished sequences of the job, only the lines
+    appended to finished_seqs.txt since the last call are counted, the count
+    restarts when the file has been replaced or truncated (see logtail.py)"""
+    finished_seq_file = "%s/%s/%s/finished_seqs.txt"%(path_result, jobid, jobid)
+    (inode, offset, cnt) = g_finishedSeqCountDict.get(jobid, (-1, 0, 0))
+    try:
+        with open(finished_seq_file, "rb") as fpin:
+            st = os.fstat(fpin.fileno())
+            if st.st_ino != inode or st.st_size < offset:
+                (inode, offset, cnt) = (st.st_ino, 0, 0)
+            fpin.seek(offset)
+            for buff in iter(lambda: fpin.read(1024*1024), b""):
+                cnt += buff.count(b"\n")
+                offset += len(buff)
+    except IOError:
+        return 0
+    g_finishedSeqCountDict[jobid] = (inode, offset, cnt)
+    return cnt
+#}}}
+def UpdateServerLoad(joblist, cntSubmitJobDict, nodeStatDict, g_params):#{{{
+    """Write the load of the server used for the admission control of new
+    jobs, see admission.py
+    return the estimated waiting time in seconds"""
+    remaining_numseq = 0
+    for (jobid, numseq, email, numseq_this_user, user) in joblist:
+        if numseq > 1:
+            remaining_numseq += max(0, numseq - CountFinishedSeq(jobid))
+        else:
+            remaining_numseq += numseq
+    jobidset = set([rd[0] for rd in joblist])
+    for jobid in list(g_finishedSeqCountDict.keys()):
+        if jobid not in jobidset:
+            del g_finishedSeqCountDict[jobid]
+    mean_runtime = speculation.GetMeanRuntime(speculation_db,
+            g_params['AVERAGE_RUNTIME_PER_SEQ_IN_SEC'])
+    num_slot = sum([cntSubmitJobDict[node][1] for node in cntSubmitJobDict])
+    throughput = sum([nodeStatDict[node]['rate'] for node in nodeStatDict
+        if node in cntSubmitJobDict])
+    backlog_seconds = remaining_numseq*mean_runtime
+    est_wait = admission.EstimateWait(remaining_numseq, backlog_seconds,
+            num_slot, throughput)
+    loadDict = {'remaining_numseq': remaining_numseq,
+            'backlog_seconds': backlog_seconds, 'num_slot': num_slot,
+            'throughput': throughput, 'est_wait': est_wait,
+            'num_job': len(joblist),
+            'numseq_in_node': dict([(node, cntSubmitJobDict[node][0])
+                for node in cntSubmitJobDict])}
+    try:
+        admission.WriteServerLoad(loadfile, loadDict)
+    except (IOError, OSError) as e:
+        webcom.loginfo("Failed to write %s with errmsg=%s"%(loadfile, str(e)),
+                gen_errfile)
+    return est_wait
+#}}}
+def UpdateFairShareState(alljoblist, g_params):#{{{
+    """Update the number of queued sequences of the users with jobs in
+    alljoblist, i.e. all jobs in the queue"""
+    outstandingDict = {}
+    for (jobid, numseq, email, numseq_this_user, user) in alljoblist:
+        outstandingDict[user] = outstandingDict.get(user, 0) + numseq
+    weightDict = fairshare.ReadUserWeight(vip_email_file, g_params['VIP_WEIGHT'])
+    fairshare.UpdateOutstanding(fairshare_db, outstandingDict, weightDict)
+#}}}
+def OrderJobListByFairShare(joblist, g_params):#{{{
+    """return (ordered joblist, shareDict), in the ordered joblist users with
+    higher share come first, jobs of the same user keep their order"""
+    userlist = sorted(set([rd[4] for rd in joblist]))
+    weightDict = fairshare.ReadUserWeight(vip_email_file, g_params['VIP_WEIGHT'])
+    factorDict = fairshare.GetFairShareFactor(fairshare_db, userlist,
+            weightDict, g_params['FAIRSHARE_HALF_LIFE'])
+    shareDict = fairshare.GetShare(factorDict)
+    ordered_joblist = sorted(joblist, key=lambda x: -shareDict[x[4]])
+    return (ordered_joblist, shareDict)
+#}}}
+def GetSeqKeyDict(jobid):#{{{
+    """Return {seqindex: (md5_key, description, seqlen)} of the sequences of
+    the job, or None if the job is not to share results, i.e. force run"""
+    rstdir = "%s/%s"%(path_result, jobid)
+    if os.path.exists("%s/forcerun"%(rstdir)):
+        return None
+    with g_lock:
+        if jobid in g_seqKeyDict:
+            return g_seqKeyDict[jobid]
+    try:
+        query_para = resultcache.ReadQueryPara(myfunc.ReadFile(
+            "%s/query.para.txt"%(rstdir)))
+    except ValueError:
+        return None
+    recordlist = resultcache.ReadFastaRecord(myfunc.ReadFile("%s/query.fa"%(rstdir)))
+    keyDict = {}
+    for cnt in range(len(recordlist)):
+        (description, seq) = recordlist[cnt]
+        keyDict[cnt] = (resultcache.GetCacheKey(seq, query_para), description, len(seq))
+    with g_lock:
+        g_seqKeyDict[jobid] = keyDict
+    return keyDict
+#}}}
+def WriteLineList(lines, outfile):#{{{
+    """Write the lines to outfile atomically"""
+    tmpfile = "%s.tmp"%(outfile)
+    with open(tmpfile, "w") as fpout:
+        for line in lines:
+            fpout.write("%s\n"%(line))
+    os.rename(tmpfile, outfile)
+#}}}
+def HoldInflightSeq(jobid, num_claim):#{{{
+    """Claim the next num_claim sequences of torun_seqindex.txt of the job in
+    the dispatch registry, the sequences computed by another job at the
+    moment are moved to inflight_seqindex.txt. Called with the lock of the
+    job, see inflight.py"""
+    keyDict = GetSeqKeyDict(jobid)
+    if keyDict is None or num_claim <= 0:
+        return
+    rstdir = "%s/%s"%(path_result, jobid)
+    torun_idx_file = "%s/torun_seqindex.txt"%(rstdir)
+    toRunli = [x for x in myfunc.ReadFile(torun_idx_file).split("\n") if x.strip() != ""]
+    keyli = []
+    for idx in toRunli[:num_claim]:
+        seqindex = int(idx)
+        if seqindex in keyDict:
+            keyli.append((seqindex, keyDict[seqindex][0]))
+    heldDict = inflight.Claim(inflight_db, jobid, keyli)
+    if len(heldDict) < 1:
+        return
+    heldli = []
+    for seqindex in sorted(heldDict.keys()):
+        (owner_jobid, owner_seqindex) = heldDict[seqindex]
+        heldli.append("%d\t%s\t%s\t%d"%(seqindex, keyDict[seqindex][0],
+            owner_jobid, owner_seqindex))
+    myfunc.WriteFile("\n".join(heldli)+"\n", "%s/inflight_seqindex.txt"%(rstdir), "a", True)
+    WriteLineList([x for x in toRunli if int(x) not in heldDict], torun_idx_file)
+    webcom.loginfo("%d sequences of %s are computed by other jobs, held back"%(
+        len(heldDict), jobid), gen_logfile)
+#}}}
+def SyncDispatch(jobid):#{{{
+    """Register the sequences in the remote queue of the job as dispatched,
+    the keys of the other sequences of the job are released"""
+    keyDict = GetSeqKeyDict(jobid)
+    if keyDict is None:
+        return
+    remotequeue_idx_file = "%s/%s/remotequeue_seqindex.txt"%(path_result, jobid)
+    entryli = []
+    for (seqindex, node, remotejobid, description, seq) in \
+            speculation.ReadRemoteQueueEntry(remotequeue_idx_file):
+        if seqindex in keyDict:
+            entryli.append((seqindex, node, remotejobid, keyDict[seqindex][0]))
+    inflight.SetDispatched(inflight_db, jobid, entryli)
+#}}}
+def FillInflightSeq(jobid):#{{{
+    """Fill the held sequences of the job whose key has been released, from
+    the cache or from the result of the other job, the sequences the other
+    job has not finished are put back to torun_seqindex.txt. Called with the
+    lock of the job"""
+    rstdir = "%s/%s"%(path_result, jobid)
+    held_idx_file = "%s/inflight_seqindex.txt"%(rstdir)
+    if not os.path.exists(held_idx_file):
+        return
+    keyDict = GetSeqKeyDict(jobid)
+    heldli = []
+    for line in myfunc.ReadFile(held_idx_file).split("\n"):
+        strs = line.split("\t")
+        if len(strs) >= 4:
+            heldli.append((int(strs[0]), strs[1], strs[2], int(strs[3])))
+    ownerDict = inflight.GetOwner(inflight_db, [rd[1] for rd in heldli])
+    runjob_logfile = "%s/runjob.log"%(rstdir)
+    runjob_errfile = "%s/runjob.err"%(rstdir)
+    outpath_result = "%s/%s"%(rstdir, jobid)
+    keepli = []
+    requeueli = []
+    finishli = []
+    for (seqindex, md5_key, owner_jobid, owner_seqindex) in heldli:
+        if ownerDict.get(md5_key, jobid) != jobid:
+            keepli.append("%d\t%s\t%s\t%d"%(seqindex, md5_key, owner_jobid, owner_seqindex))
+            continue
+        outpath_this_seq = "%s/seq_%d"%(outpath_result, seqindex)
+        owner_outpath_result = "%s/%s/%s"%(path_result, owner_jobid, owner_jobid)
+        subfolder_owner = "seq_%d"%(owner_seqindex)
+        source = ""
+        if keyDict is None or seqindex not in keyDict:
+            pass
+        elif os.path.exists(outpath_this_seq):
+            source = "exist"
+        elif resultcache.IsCached(path_cache, md5_key):
+            source = resultcache.CopyFromCache(path_cache, md5_key, outpath_result,
+                    outpath_this_seq, runjob_logfile, runjob_errfile)
+        elif inflight.IsSeqFinished(owner_outpath_result, subfolder_owner):
+            try:
+                shutil.copytree("%s/%s"%(owner_outpath_result, subfolder_owner),
+                        outpath_this_seq)
+                source = "inflight"
+            except Exception as e:
+                webcom.loginfo("Failed to copy seq %d of %s from %s with errmsg=%s"%(
+                    seqindex, jobid, owner_jobid, str(e)), gen_errfile)
+        if source == "" or source == "exist":
+            requeueli.append("%d"%(seqindex))
+            continue
+        (md5_key, description, seqlen) = keyDict[seqindex]
+        info_finish = webcom.GetInfoFinish_PRODRES(outpath_this_seq, seqindex,
+                seqlen, description, source_result="cached", runtime=0.0)
+        finishli.append((seqindex, "\t".join(info_finish)))
+
+    if len(finishli) > 0:
+        myfunc.WriteFile("".join(["%s\n"%(rd[1]) for rd in finishli]),
+                "%s/finished_seqs.txt"%(outpath_result), "a", True)
+        myfunc.WriteFile("".join(["%d\n"%(rd[0]) for rd in finishli]),
+                "%s/finished_seqindex.txt"%(rstdir), "a", True)
+    if len(requeueli) > 0:
+        torun_idx_file = "%s/torun_seqindex.txt"%(rstdir)
+        toRunli = [x for x in myfunc.ReadFile(torun_idx_file).split("\n") if x.strip() != ""]
+        WriteLineList(requeueli + toRunli, torun_idx_file)
+    if len(keepli) > 0:
+        WriteLineList(keepli, held_idx_file)
+    else:
+        os.remove(held_idx_file)
+    if len(finishli) + len(requeueli) > 0:
+        webcom.loginfo("held sequences of %s: %d filled, %d put back to the queue"%(
+            jobid, len(finishli), len(requeueli)), gen_logfile)
+#}}}
+def SubmitChunkToNode(node, cnt_node, jobid, limit, numseq_this_user, user, g_params):#{{{
+    """Submit sequences of the job to the node until cnt_node[0] reaches limit
+    return the number of submitted sequences"""
+    cnt_job = [cnt_node[0], min(limit, cnt_node[1])] + cnt_node[2:]
+    joblock = GetJobLock(jobid)
+    with joblock:
+        if g_params['INFLIGHT_DISPATCH']:
+            try:
+                HoldInflightSeq(jobid, cnt_job[1] - cnt_job[0])
+            except Exception as e:
+                webcom.loginfo("HoldInflightSeq(%s) failed with errmsg=%s"%(
+                    jobid, str(e)), gen_errfile)
+        semli = AcquireNodeSlot([node], g_params)
+        try:
+            with phaseprof.Phase("submit_job"):
+                qdcom.SubmitJob(jobid, {node: cnt_job}, numseq_this_user, g_params)
+        except Exception as e:
+            webcom.loginfo("SubmitJob(%s) to %s failed with errmsg=%s"%(
+                jobid, node, str(e)), gen_errfile)
+            wsdl_client.InvalidateNode(node)
+            nodecontrol.RecordRequestError(node)
+        finally:
+            ReleaseNodeSlot(semli)
+        remotequeue_index.SyncJob(remotequeue_db, jobid, path_result)
+        if g_params['INFLIGHT_DISPATCH']:
+            try:
+                SyncDispatch(jobid)
+            except Exception as e:
+                webcom.loginfo("SyncDispatch(%s) failed with errmsg=%s"%(
+                    jobid, str(e)), gen_errfile)
+    num_submitted = cnt_job[0] - cnt_node[0]
+    if num_submitted > 0:
+        cnt_node[0] = cnt_job[0]
+        fairshare.AddUsage(fairshare_db, user, num_submitted,
+                g_params['FAIRSHARE_HALF_LIFE'])
+    return num_submitted
+#}}}
+def SubmitJobToNode(node, cntSubmitJobDict, joblist, shareDict, chunk_size,#{{{
+        jobNodeCountDict, g_params):
+    """Submit sequences of the jobs in joblist to a single node until the node
+    is full. Only this task modifies cntSubmitJobDict[node] during the loop
+
+    Sequences are given to the node in chunks, a job has at most chunk_size
+    sequences in the remote queue of this node, where chunk_size is the number
+    of sequences the node finishes in CHUNK_TIME. A large job is thus spread
+    over the nodes and a node gets the next chunk of the job when it has
+    finished the previous one.
+
+    In the first pass each user gets the fraction shareDict[user] of the free
+    slots of the node, the slots left are filled in the second pass in the
+    order of joblist. If the node still has free slots and the other nodes
+    have none, it takes one further chunk of each job, those with the largest
+    backlog on the other nodes first"""
+    cnt_node = cntSubmitJobDict[node]
+    num_free = cnt_node[1] - cnt_node[0]
+    quotaDict = {}
+    for user in shareDict:
+        quotaDict[user] = int(math.ceil(num_free*shareDict[user]))
+    allowDict = {}  # {jobid: number of sequences the node may still take}
+    for (jobid, numseq, email, numseq_this_user, user) in joblist:
+        num_on_node = jobNodeCountDict.get(jobid, {}).get(node, 0)
+        allowDict[jobid] = max(0, chunk_size - num_on_node)
+    for ipass in range(2):
+        for (jobid, numseq, email, numseq_this_user, user) in joblist:
+            if cnt_node[0] >= cnt_node[1]:
+                break
+            num_allow = allowDict[jobid]
+            if ipass == 0:
+                num_allow = min(num_allow, quotaDict[user])
+            if num_allow <= 0:
+                continue
+            num_submitted = SubmitChunkToNode(node, cnt_node, jobid,
+                    cnt_node[0] + num_allow, numseq_this_user, user, g_params)
+            allowDict[jobid] -= num_submitted
+            quotaDict[user] -= num_submitted
+
+    # work stealing: when the other nodes are full, the idle slots of this
+    # node are used for the jobs that have used up their chunk, at most one
+    # extra chunk per job in a loop, starting from the job with the largest
+    # backlog on the other nodes
+    if cnt_node[0] >= cnt_node[1]:
+        return
+    for nd in cntSubmitJobDict:
+        if nd != node and cntSubmitJobDict[nd][0] < cntSubmitJobDict[nd][1]:
+            return
+    backlogDict = {}
+    for (jobid, numseq, email, numseq_this_user, user) in joblist:
+        backlogDict[jobid] = sum([cnt for (nd, cnt) in
+            jobNodeCountDict.get(jobid, {}).items() if nd != node])
+    stealli = sorted([rd for rd in joblist if allowDict[rd[0]] <= 0],
+            key=lambda x: -backlogDict[x[0]])
+    for (jobid, numseq, email, numseq_this_user, user) in stealli:
+        if cnt_node[0] >= cnt_node[1]:
+            break
+        SubmitChunkToNode(node, cnt_node, jobid, cnt_node[0] + chunk_size,
+                numseq_this_user, user, g_params)
+#}}}
+def CallRemoteService(node, method, args, g_params):#{{{
+    """Call the WSDL service of the node directly
+    return the return value of the call or None if failed"""
+    wsdl_url = "http://%s/pred/api_submitseq/?wsdl"%(node)
+    semli = AcquireNodeSlot([node], g_params)
+    try:
+        myclient = wsdl_client.GetClient(wsdl_url, timeout=g_params['REMOTE_TIMEOUT'])
+        return getattr(myclient.service, method)(*args)
+    except Exception as e:
+        webcom.loginfo("%s%s to %s failed with errmsg=%s"%(method, str(args[:1]),
+            node, str(e)), gen_errfile)
+        wsdl_client.InvalidateNode(node)
+        nodecontrol.RecordRequestError(node)
+        return None
+    finally:
+        ReleaseNodeSlot(semli)
+#}}}
+def CancelRemoteJob(node, remotejobid, g_params):#{{{
+    """Discard a speculative duplicate on the node. The deletejob service of
+    the node only removes the result folder of the remote job, the node API
+    has no way to cancel its Slurm job, so a duplicate already running keeps
+    its slot on the node until it ends, its result is never retrieved"""
+    CallRemoteService(node, "deletejob", (remotejobid,), g_params)
+#}}}
+def ReadRemoteRuntime(outpath_result, subfolderset):#{{{
+    """Return {subfolder: runtime} of the sequences in subfolderset from
+    finished_seqs.txt, the run time recorded by the remote node. Sequences
+    without a run time, e.g. taken from the cache, are not included"""
+    runtimeDict = {}
+    if len(subfolderset) < 1:
+        return runtimeDict
+    try:
+        fpin = open("%s/finished_seqs.txt"%(outpath_result), "r")
+    except IOError:
+        return runtimeDict
+    with fpin:
+        for line in fpin:
+            seqDict = resultindex.ParseFinishedLine(line.rstrip("\n"))
+            if (seqDict is not None and seqDict['subfolder'] in subfolderset and
+                    seqDict['runtime'] is not None and seqDict['runtime'] > 0):
+                runtimeDict[seqDict['subfolder']] = seqDict['runtime']
+    return runtimeDict
+#}}}
+def SpeculateJob(jobid, entryli_before, epochDict, nodeStatDict, g_params):#{{{
+    """Learn the run time and the queue wait of the nodes from the sequences
+    finished by the last GetResult, resolve the speculative duplicates of the job and launch
+    duplicates for straggler sequences. Called with the lock of the job
+
+    entryli_before  entries of remotequeue_seqindex.txt before GetResult
+    epochDict       {(seqindex, node, remotejobid): submit_epoch} before GetResult
+    nodeStatDict    nodestat of the available nodes, see nodecontrol.py
+    """
+    rstdir = "%s/%s"%(path_result, jobid)
+    remotequeue_idx_file = "%s/remotequeue_seqindex.txt"%(rstdir)
+    outpath_result = "%s/%s"%(rstdir, jobid)
+    para_str = myfunc.ReadFile("%s/query.para.txt"%(rstdir))
+    try:
+        query_para = json.loads(para_str)
+    except ValueError:
+        query_para = {}
+    method = speculation.GetMethod(query_para)
+    epoch = time.time()
+    entryli = speculation.ReadRemoteQueueEntry(remotequeue_idx_file)
+    specDict = {}
+    for rd in speculation.GetSpeculativeList(speculation_db, jobid):
+        specDict[rd[1]] = rd
+
+    # learn from the sequences with results retrieved in this round, the
+    # time from the submission to the retrieval is the queue wait on the node
+    # plus the run time recorded by the node
+    currentset = set([tuple(e[:3]) for e in entryli])
+    retrievedli = []
+    for (seqindex, node, remotejobid, description, seq) in entryli_before:
+        key = (seqindex, node, remotejobid)
+        if key in currentset or seqindex in specDict or key not in epochDict:
+            continue
+        if os.path.exists("%s/seq_%d"%(outpath_result, seqindex)):
+            retrievedli.append((seqindex, node, len(seq), epoch - epochDict[key]))
+    runtimeDict = ReadRemoteRuntime(outpath_result,
+            set(["seq_%d"%(rd[0]) for rd in retrievedli]))
+    runtimeli = []
+    turnaroundli = []
+    for (seqindex, node, seqlen, residence) in retrievedli:
+        runtime = runtimeDict.get("seq_%d"%(seqindex))
+        if runtime is None:
+            continue
+        speculation.AddRuntime(speculation_db, method, seqlen, runtime)
+        speculation.AddQueueWait(speculation_db, node, max(0.0, residence - runtime))
+        runtimeli.append(runtime)
+        turnaroundli.append(residence)
+    serverstate.AddSample(serverstate_db, "seq_runtime:remote", runtimeli)
+    serverstate.AddSample(serverstate_db, "seq_turnaround:remote", turnaroundli)
+
+    # resolve the duplicates, the one finished first wins
+    entryDict = {}
+    for e in entryli:
+        entryDict[e[0]] = e
+    for (jobid_, seqindex, orig_node, orig_remotejobid, spec_node,
+            spec_remotejobid, start_epoch, is_switched) in list(specDict.values()):
+        orig = (orig_node, orig_remotejobid)
+        spec = (spec_node, spec_remotejobid)
+        if seqindex not in entryDict:
+            # the result has been retrieved, the original was discarded
+            # already if switched
+            if not is_switched:
+                CancelRemoteJob(spec_node, spec_remotejobid, g_params)
+            speculation.DeleteSpeculative(speculation_db, jobid, seqindex)
+            del specDict[seqindex]
+        elif not is_switched:
+            rtValue = CallRemoteService(spec_node, "checkjob", (spec_remotejobid,), g_params)
+            if rtValue is None:
+                continue
+            status = rtValue[0][0]
+            if status == "Finished":
+                if speculation.SwitchRemoteQueueEntry(remotequeue_idx_file,
+                        seqindex, orig, spec):
+                    speculation.SetSwitched(speculation_db, jobid, seqindex)
+                    webcom.loginfo("seq %d of %s: duplicate on %s finished first, "
+                            "discard %s on %s"%(seqindex, jobid, spec_node,
+                                orig_remotejobid, orig_node), gen_logfile)
+                    CancelRemoteJob(orig_node, orig_remotejobid, g_params)
+                else: # the entry has been changed, e.g. resubmitted
+                    CancelRemoteJob(spec_node, spec_remotejobid, g_params)
+                    speculation.DeleteSpeculative(speculation_db, jobid, seqindex)
+                    del specDict[seqindex]
+            elif status in ["Failed", "None"]:
+                speculation.DeleteSpeculative(speculation_db, jobid, seqindex)
+                del specDict[seqindex]
+    remotequeue_index.SyncJob(remotequeue_db, jobid, path_result)
+
+    # launch duplicates for stragglers
+    num_spec = len(speculation.GetSpeculativeList(speculation_db))
+    nodeli = sorted(nodeStatDict.keys(), key=lambda x: -nodeStatDict[x]['rate'])
+    for (seqindex, node, remotejobid, description, seq) in entryli:
+        if num_spec >= g_params['SPEC_MAX_INFLIGHT']:
+            break
+        key = (seqindex, node, remotejobid)
+        if seqindex in specDict or key not in epochDict:
+            continue
+        prediction = speculation.PredictRuntime(speculation_db, method, len(seq),
+                g_params['SPEC_MIN_SAMPLE'])
+        # the time waited in the queue of the node before the start is not
+        # part of the run time
+        elapsed = epoch - epochDict[key] - speculation.GetQueueWait(speculation_db, node)
+        if not speculation.IsStraggler(elapsed, prediction, g_params):
+            continue
+        targetli = [nd for nd in nodeli if nd != node]
+        if len(targetli) < 1:
+            break
+        spec_node = targetli[0]
+        fastaseq = ">%s\n%s\n"%(description, seq)
+        rtValue = CallRemoteService(spec_node, "submitjob_remote", (fastaseq,
+            para_str, "spec_%s_%d"%(jobid, seqindex), "", "1", "False"), g_params)
+        if rtValue is None or rtValue[0][0] in ["None", ""]:
+            continue
+        spec_remotejobid = rtValue[0][0]
+        speculation.AddSpeculative(speculation_db, jobid, seqindex,
+                (node, remotejobid), (spec_node, spec_remotejobid))
+        num_spec += 1
+        webcom.loginfo("seq %d of %s on %s is a straggler (%d s), duplicate "
+                "submitted to %s as %s"%(seqindex, jobid, node, elapsed,
+                    spec_node, spec_remotejobid), gen_logfile)
+#}}}
+def RetrieveJobResult(jobid, numseq, email, nodeStatDict, g_params):#{{{
+    """Retrieve the results of the job from the remote nodes and check whether
+    the job is finished"""
+    joblock = GetJobLock(jobid)
+    with joblock:
+        remotequeue_idx_file = "%s/%s/remotequeue_seqindex.txt"%(path_result, jobid)
+        entryli_before = speculation.ReadRemoteQueueEntry(remotequeue_idx_file)
+        epochDict = remotequeue_index.GetJobEntryDict(remotequeue_db, jobid)
+        nodelist = remotequeue_index.GetNodeListOfJob(remotequeue_db, jobid)
+        semli = AcquireNodeSlot(nodelist, g_params)
+        try:
+            with phaseprof.Phase("get_result"):
+                qdcom.GetResult(jobid, g_params) # the start tagfile is written when got the first result
+        except Exception as e:
+            webcom.loginfo("GetResult(%s) failed with errmsg=%s"%(jobid, str(e)),
+                    gen_errfile)
+            for node in nodelist:
+                wsdl_client.InvalidateNode(node)
+                nodecontrol.RecordRequestError(node)
+        finally:
+            ReleaseNodeSlot(semli)
+        remotequeue_index.SyncJob(remotequeue_db, jobid, path_result)
+        if g_params['SPECULATIVE_EXECUTION']:
+            try:
+                with phaseprof.Phase("speculate_job"):
+                    SpeculateJob(jobid, entryli_before, epochDict, nodeStatDict, g_params)
+            except Exception as e:
+                webcom.loginfo("SpeculateJob(%s) failed with errmsg=%s"%(jobid, str(e)),
+                        gen_errfile)
+        if g_params['INFLIGHT_DISPATCH']:
+            try:
+                with phaseprof.Phase("fill_inflight"):
+                    SyncDispatch(jobid)
+                    FillInflightSeq(jobid)
+            except Exception as e:
+                webcom.loginfo("FillInflightSeq(%s) failed with errmsg=%s"%(jobid, str(e)),
+                        gen_errfile)
+        try:
+            with phaseprof.Phase("check_if_job_finished"):
+                qdcom.CheckIfJobFinished(jobid, numseq, email, g_params)
+        except Exception as e:
+            webcom.loginfo("CheckIfJobFinished(%s) failed with errmsg=%s"%(jobid, str(e)),
+                    gen_errfile)
+        # the tag files of jobs run on the remote nodes are written by
+        # GetResult and CheckIfJobFinished
+        try:
+            jobcatalog.UpdateFromTagFile(jobcatalog_db, jobid, "%s/%s"%(path_result, jobid))
+        except Exception as e:
+            webcom.loginfo("jobcatalog.UpdateFromTagFile(%s) failed with errmsg=%s"%(jobid, str(e)),
+                    gen_errfile)
+#}}}
+
 
 def main(g_params):  # {{{
     if os.path.exists(black_iplist_file):
@@ -83,101 +791,284 @@ def main(g_params):  # {{{
     if not os.path.exists(path_cache):
         os.mkdir(path_cache)
 
+    socket.setdefaulttimeout(g_params['REMOTE_TIMEOUT'])
+    try:
+        workerpool.StartHeartbeat(path_worker, worker_name, g_params['HEARTBEAT_INTERVAL'])
+    except RuntimeError as e:
+        webcom.loginfo("Failed to start worker %s with errmsg=%s"%(worker_name, str(e)),
+                gen_errfile)
+        print("Error! %s"%(str(e)), file=sys.stderr)
+        return 1
+    expiry.StartReaper(expiry_db, g_params,
+            loginfo=lambda msg: webcom.loginfo(msg, gen_logfile))
+    executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=g_params['MAX_WORKER_THREAD'])
+    submitFutureDict = {}    # {node: future}
+    retrieveFutureDict = {}  # {jobid: future}
+
+    last_stat_epoch = 0
+    isStatChanged = True
     loop = 0
     while 1:
         # load the config file if exists
         if os.path.exists("%s/CACHE_CLEANING_IN_PROGRESS"%(path_result)):  #pause when cache cleaning is in progress
             continue
 
-        configfile = "%s/config/config.json"%(basedir)
-        config = {}
-        if os.path.exists(configfile):
-            text = myfunc.ReadFile(configfile)
-            config = json.loads(text)
+        loop_begin = time.time()
+        with phaseprof.Phase("config_reload"):
+            configfile = "%s/config/config.json"%(basedir)
+            config = {}
+            if os.path.exists(configfile):
+                text = myfunc.ReadFile(configfile)
+                config = json.loads(text)
+
+            if rootname_progname in config:
+                g_params.update(config[rootname_progname])
 
-        if rootname_progname in config:
-            g_params.update(config[rootname_progname])
+            if os.path.exists(black_iplist_file):
+                g_params['blackiplist'] = myfunc.ReadIDList(black_iplist_file)
+            avail_computenode = webcom.ReadComputeNode(computenodefile) # return value is a dict
+            wsdl_client.RefreshNodes(avail_computenode)
+            g_params['vip_user_list'] = myfunc.ReadIDList2(vip_email_file,  col=0)
+            num_avail_node = len(avail_computenode)
 
-        if os.path.exists(black_iplist_file):
-            g_params['blackiplist'] = myfunc.ReadIDList(black_iplist_file)
-        avail_computenode = webcom.ReadComputeNode(computenodefile) # return value is a dict
-        g_params['vip_user_list'] = myfunc.ReadIDList2(vip_email_file,  col=0)
-        num_avail_node = len(avail_computenode)
+        # the loop is profiled by cProfile every PROFILE_LOOP_INTERVAL loops
+        prof = None
+        if g_params['PROFILE_LOOP_INTERVAL'] > 0 and loop % g_params['PROFILE_LOOP_INTERVAL'] == 0:
+            prof = phaseprof.StartProfile()
 
         webcom.loginfo("loop %d"%(loop), gen_logfile)
 
-        isOldRstdirDeleted = False
-        if loop % g_params['STATUS_UPDATE_FREQUENCY'][0] == g_params['STATUS_UPDATE_FREQUENCY'][1]:
-            qdcom.RunStatistics(g_params)
-            isOldRstdirDeleted = webcom.DeleteOldResult(path_result, path_log,
-                    gen_logfile, MAX_KEEP_DAYS=g_params['MAX_KEEP_DAYS'])
-            webcom.CleanServerFile(path_static, gen_logfile, gen_errfile)
+        # the leader does the housekeeping shared by all workers
+        liveworkerlist = workerpool.GetLiveWorkerList(path_worker,
+                g_params['WORKER_TIMEOUT'])
+        if worker_name not in liveworkerlist:
+            liveworkerlist = sorted(liveworkerlist + [worker_name])
+        num_worker = len(liveworkerlist)
+        isLeader = workerpool.AcquireLease(leader_leasefile, worker_name,
+                g_params['LEASE_TIME'])
+        expiry.EnableReaper(isLeader)
 
-        webcom.ArchiveLogFile(path_log, threshold_logfilesize=threshold_logfilesize) 
+        # the housekeeping rewrites runjob_log, archives the log files and
+        # removes result folders, so it is not run while tasks left in the
+        # background by the previous loop may still write to them. They are
+        # waited for, and the housekeeping is skipped in this loop if some
+        # are still running after MAX_WAIT_TIME_PER_LOOP
+        isHousekeeping = isLeader
+        if isLeader:
+            bgFutureList = [f for f in (list(submitFutureDict.values()) +
+                list(retrieveFutureDict.values())) if not f.done()]
+            if len(bgFutureList) > 0:
+                with phaseprof.Phase("wait_background_task"):
+                    (done, not_done) = concurrent.futures.wait(bgFutureList,
+                            timeout=g_params['MAX_WAIT_TIME_PER_LOOP'])
+                if len(not_done) > 0:
+                    webcom.loginfo("%d background tasks still running, skip the "
+                            "housekeeping in this loop"%(len(not_done)), gen_logfile)
+                    isHousekeeping = False
 
-        qdcom.CreateRunJoblog(loop, isOldRstdirDeleted, g_params)
+        if isHousekeeping:
+            # statistics are updated incrementally from the jobs finished
+            # since the last loop, the full rebuild is run rarely for the
+            # statistics not covered by incstat
+            with phaseprof.Phase("incstat"):
+                num_added = UpdateIncStat(finishedjoblogfile)
+                isStatChanged = isStatChanged or num_added > 0
+                if (isStatChanged and
+                        time.time() - last_stat_epoch >= g_params['STAT_PLOT_INTERVAL']):
+                    WriteIncStatFile()
+                    last_stat_epoch = time.time()
+                    isStatChanged = False
+            if loop % g_params['FULL_STATISTICS_FREQUENCY'][0] == g_params['FULL_STATISTICS_FREQUENCY'][1]:
+                with phaseprof.Phase("run_statistics"):
+                    qdcom.RunStatistics(g_params)
 
-        # Get number of jobs submitted to the remote server based on the
-        # runjoblogfile
-        runjobidlist = myfunc.ReadIDList2(runjoblogfile,0)
-        remotequeueDict = {}
-        for node in avail_computenode:
-            remotequeueDict[node] = []
-        for jobid in runjobidlist:
-            rstdir = "%s/%s"%(path_result, jobid)
-            remotequeue_idx_file = "%s/remotequeue_seqindex.txt"%(rstdir)
-            if os.path.exists(remotequeue_idx_file):
-                content = myfunc.ReadFile(remotequeue_idx_file)
-                lines = content.split('\n')
-                for line in lines:
-                    strs = line.split('\t')
-                    if len(strs)>=5:
-                        node = strs[1]
-                        remotejobid = strs[2]
-                        if node in remotequeueDict:
-                            remotequeueDict[node].append(remotejobid)
-
-        cntSubmitJobDict = webcom.InitCounterSubmitJobDict(avail_computenode, remotequeueDict, g_params['MAX_SUBMIT_JOB_PER_NODE'])
+            # expired results are removed by the reaper thread from the
+            # expiry index, the full scan of the result folders is kept as
+            # a rare clean-up of what is not in the index
+            with phaseprof.Phase("expiry_update"):
+                try:
+                    expiry.UpdateFromFinishedLog(expiry_db, finishedjoblogfile, path_result)
+                except Exception as e:
+                    webcom.loginfo("expiry.UpdateFromFinishedLog failed with errmsg=%s"%(str(e)), gen_errfile)
+            isOldRstdirDeleted = expiry.IsAnyDeleted()
+            if loop % g_params['FULL_CLEAN_FREQUENCY'][0] == g_params['FULL_CLEAN_FREQUENCY'][1]:
+                with phaseprof.Phase("delete_old_result"):
+                    isOldRstdirDeleted = webcom.DeleteOldResult(path_result, path_log,
+                            gen_logfile, MAX_KEEP_DAYS=g_params['MAX_KEEP_DAYS']) or isOldRstdirDeleted
+                    webcom.CleanServerFile(path_static, gen_logfile, gen_errfile)
+                    try:
+                        jobcatalog.PruneMissing(jobcatalog_db, path_result)
+                    except Exception as e:
+                        webcom.loginfo("jobcatalog.PruneMissing failed with errmsg=%s"%(str(e)), gen_errfile)
+
+            with phaseprof.Phase("archive_log_file"):
+                webcom.ArchiveLogFile(path_log, threshold_logfilesize=threshold_logfilesize) 
+
+            with phaseprof.Phase("create_runjoblog"):
+                qdcom.CreateRunJoblog(loop, isOldRstdirDeleted, g_params)
+
+            # the job catalog read by the job list pages
+            with phaseprof.Phase("jobcatalog_update"):
+                try:
+                    jobcatalog.UpdateFromFinishedLog(jobcatalog_db, finishedjoblogfile, path_result)
+                    jobcatalog.SyncRunJobLog(jobcatalog_db, runjoblogfile)
+                except Exception as e:
+                    webcom.loginfo("jobcatalog update failed with errmsg=%s"%(str(e)), gen_errfile)
+
+            # the job counter shown on every page
+            with phaseprof.Phase("jobcounter_update"):
+                try:
+                    jobcounter.Refresh(jobcounter_file, jobcatalog_db)
+                except Exception as e:
+                    webcom.loginfo("jobcounter.Refresh failed with errmsg=%s"%(str(e)), gen_errfile)
 
 # entries in runjoblogfile includes jobs in queue or running
-        hdl = myfunc.ReadLineByBlock(runjoblogfile)
-        if not hdl.failure:
-            lines = hdl.readlines()
-            while lines != None:
-                for line in lines:
-                    strs = line.split("\t")
-                    if len(strs) >= 11:
-                        jobid = strs[0]
-                        email = strs[4]
-                        try:
-                            numseq = int(strs[5])
-                        except:
-                            numseq = 1
-                            pass
-                        try:
-                            numseq_this_user = int(strs[10])
-                        except:
-                            numseq_this_user = 1
-                            pass
-                        rstdir = "%s/%s"%(path_result, jobid)
-                        finishtagfile = "%s/%s"%(rstdir, "runjob.finish")
-                        status = strs[1]
-                        webcom.loginfo("CompNodeStatus: %s"%(str(cntSubmitJobDict)), gen_logfile)
-
-                        runjob_lockfile = "%s/%s/%s.lock"%(path_result, jobid, "runjob.lock")
-                        if os.path.exists(runjob_lockfile):
-                            msg = "runjob_lockfile %s exists, ignore the job %s" %(runjob_lockfile, jobid)
-                            webcom.loginfo(msg, gen_logfile)
-                            continue
-
-                        if webcom.IsHaveAvailNode(cntSubmitJobDict):
-                            if not g_params['DEBUG_NO_SUBMIT']:
-                                qdcom.SubmitJob(jobid, cntSubmitJobDict, numseq_this_user, g_params)
-                        qdcom.GetResult(jobid, g_params) # the start tagfile is written when got the first result
-                        qdcom.CheckIfJobFinished(jobid, numseq, email, g_params)
-
-                lines = hdl.readlines()
-            hdl.close()
+        runjobidlist = myfunc.ReadIDList2(runjoblogfile,0)
+        # jobs handed over to the submission thread of a web process that
+        # was recycled before submitting them
+        if isLeader:
+            with phaseprof.Phase("submit_pending"):
+                for jobid in runjobidlist:
+                    SubmitPendingJob(jobid, g_params)
+        alljoblist = []
+        for rd in ReadRunJobList(runjoblogfile):
+            jobid = rd[0]
+            runjob_lockfile = "%s/%s/%s.lock"%(path_result, jobid, "runjob.lock")
+            if os.path.exists(runjob_lockfile):
+                msg = "runjob_lockfile %s exists, ignore the job %s" %(runjob_lockfile, jobid)
+                webcom.loginfo(msg, gen_logfile)
+                continue
+            alljoblist.append(rd)
+
+        # jobs owned by this worker, the lease of a job moved to another
+        # worker is released once no task of this worker is running for it
+        myjoblist = []
+        for rd in alljoblist:
+            jobid = rd[0]
+            leasefile = "%s/%s/qd_fe.lease"%(path_result, jobid)
+            if workerpool.GetOwner(jobid, liveworkerlist) == worker_name:
+                if workerpool.AcquireLease(leasefile, worker_name, g_params['LEASE_TIME']):
+                    myjoblist.append(rd)
+            elif not (jobid in retrieveFutureDict and not retrieveFutureDict[jobid].done()):
+                workerpool.ReleaseLease(leasefile, worker_name)
+        # leases of the jobs finished or deleted are released as well, so
+        # that the heartbeat only renews the leases of jobs in the queue
+        runjobidset = set(runjobidlist)
+        for leasefile in workerpool.GetHeldLeaseList():
+            jobid = os.path.basename(os.path.dirname(leasefile))
+            if (leasefile != leader_leasefile and jobid not in runjobidset and
+                    not (jobid in retrieveFutureDict and not retrieveFutureDict[jobid].done())):
+                workerpool.ReleaseLease(leasefile, worker_name)
+        myjobidlist = [rd[0] for rd in myjoblist]
+
+        # Get number of jobs submitted to the remote server based on the
+        # runjoblogfile, the remote queue of each job is read from the indexed
+        # store, in which only jobs with changed remotequeue_seqindex.txt are
+        # updated
+        with phaseprof.Phase("remote_queue_scan"):
+            remotequeue_index.SyncJobList(remotequeue_db, myjobidlist, path_result,
+                    alljobidlist=runjobidlist)
+            remotequeueDict = remotequeue_index.GetRemoteQueueDict(remotequeue_db,
+                    list(avail_computenode.keys()))
+
+            cntSubmitJobDict = webcom.InitCounterSubmitJobDict(avail_computenode, remotequeueDict, g_params['MAX_SUBMIT_JOB_PER_NODE'])
+        # the static limit of each node is lowered to the limit adapted to the
+        # measured throughput and failure rate of the node
+        if isLeader:
+            for (node, old_limit, new_limit) in nodecontrol.UpdateDispatchLimit(
+                    nodecontrol_db, remotequeue_db, cntSubmitJobDict, g_params):
+                webcom.loginfo("dispatch limit of %s changed from %d to %d"%(node,
+                    old_limit, new_limit), gen_logfile)
+        else:
+            nodecontrol.ApplyDispatchLimit(nodecontrol_db, cntSubmitJobDict)
+        # the free slots of each node are shared by the live workers
+        if num_worker > 1:
+            for node in cntSubmitJobDict:
+                num_free = max(0, cntSubmitJobDict[node][1] - cntSubmitJobDict[node][0])
+                cntSubmitJobDict[node][1] = (cntSubmitJobDict[node][0] +
+                        int(math.ceil(num_free/float(num_worker))))
+
+        nodeStatDict = nodecontrol.ReadNodeStat(nodecontrol_db)
+        if isLeader:
+            UpdateFairShareState(alljoblist, g_params)
+            est_wait = UpdateServerLoad(alljoblist, cntSubmitJobDict, nodeStatDict, g_params)
+        else:
+            loadDict = admission.ReadServerLoad(loadfile)
+            est_wait = 0.0 if loadDict is None else loadDict['est_wait']
+        # large jobs deferred by the admission control are held back while
+        # the server is overloaded
+        joblist = []
+        for rd in myjoblist:
+            if admission.IsDeferred("%s/%s"%(path_result, rd[0]), est_wait, g_params):
+                continue
+            joblist.append(rd)
+        (joblist, shareDict) = OrderJobListByFairShare(joblist, g_params)
+        availNodeStatDict = dict([(node, nodeStatDict[node]) for node in
+            nodeStatDict if node in avail_computenode])
+        jobNodeCountDict = remotequeue_index.GetJobNodeCount(remotequeue_db)
+
+        webcom.loginfo("CompNodeStatus: %s"%(str(cntSubmitJobDict)), gen_logfile)
+
+        # Submission is run by one task per node, going through jobs in the
+        # fair-share order until the node is full. Result retrieval is
+        # run by one task per job. A task still running from the previous
+        # loop is not started again, so that a slow node does not stall the
+        # others. qdcom.SubmitJob and qdcom.GetResult are called concurrently
+        # only for different jobs, each call holds the lock of its job and
+        # writes the result folder of that job and appends to the log files.
+        # Set MAX_WORKER_THREAD to 1 to run them one at a time
+        futureList = []
+        if not g_params['DEBUG_NO_SUBMIT']:
+            for node in cntSubmitJobDict:
+                if node in submitFutureDict and not submitFutureDict[node].done():
+                    webcom.loginfo("submission to %s is still running, skip"%(node), gen_logfile)
+                    continue
+                if cntSubmitJobDict[node][0] < cntSubmitJobDict[node][1]:
+                    chunk_size = nodecontrol.GetChunkSize(nodeStatDict.get(node),
+                            g_params)
+                    submitFutureDict[node] = executor.submit(SubmitJobToNode,
+                            node, cntSubmitJobDict, joblist, shareDict,
+                            chunk_size, jobNodeCountDict, g_params)
+                    futureList.append(submitFutureDict[node])
+        for (jobid, numseq, email, numseq_this_user, user) in joblist:
+            if jobid in retrieveFutureDict and not retrieveFutureDict[jobid].done():
+                webcom.loginfo("retrieval of %s is still running, skip"%(jobid), gen_logfile)
+                continue
+            retrieveFutureDict[jobid] = executor.submit(RetrieveJobResult,
+                    jobid, numseq, email, availNodeStatDict, g_params)
+            futureList.append(retrieveFutureDict[jobid])
+
+        with phaseprof.Phase("wait_task"):
+            (done, not_done) = concurrent.futures.wait(futureList,
+                    timeout=g_params['MAX_WAIT_TIME_PER_LOOP'])
+        if len(not_done) > 0:
+            webcom.loginfo("%d tasks not finished in %d seconds, continue in the background"%(
+                len(not_done), g_params['MAX_WAIT_TIME_PER_LOOP']), gen_logfile)
+        for jobid in list(retrieveFutureDict.keys()):
+            if retrieveFutureDict[jobid].done():
+                del retrieveFutureDict[jobid]
+        CleanJobLock(set(runjobidlist))
+        # duplicates of jobs that are finished or deleted are not needed
+        if isLeader:
+            for rd in speculation.CleanSpeculative(speculation_db, set(runjobidlist)):
+                if not rd[7]:
+                    CancelRemoteJob(rd[4], rd[5], g_params)
+            try:
+                inflight.CleanDispatch(inflight_db, set(runjobidlist))
+            except Exception as e:
+                webcom.loginfo("inflight.CleanDispatch failed with errmsg=%s"%(str(e)), gen_errfile)
+
+        if prof is not None:
+            try:
+                phaseprof.StopProfile(prof, path_profile, loop, g_params['PROFILE_NUM_KEEP'])
+            except Exception as e:
+                webcom.loginfo("phaseprof.StopProfile failed with errmsg=%s"%(str(e)), gen_errfile)
+        try:
+            phaseprof.EndLoop(phase_statfile, loop, time.time() - loop_begin,
+                    g_params['PHASE_STAT_WINDOW'])
+        except Exception as e:
+            webcom.loginfo("phaseprof.EndLoop failed with errmsg=%s"%(str(e)), gen_errfile)
 
         webcom.loginfo("sleep for %d seconds"%(g_params['SLEEP_INTERVAL']), gen_logfile)
         time.sleep(g_params['SLEEP_INTERVAL'])
@@ -201,9 +1092,53 @@ def InitGlobalParameter():  # {{{
     g_params['SLEEP_INTERVAL'] = 5    # sleep interval in seconds
     g_params['MAX_TIME_IN_REMOTE_QUEUE'] = 3600*24 # one day in seconds
     g_params['MAX_CACHE_PROCESS'] = 200 # process at the maximum this cached sequences in one loop
+    g_params['MAX_WORKER_THREAD'] = 16 # number of threads for submitting and retrieving jobs
+    g_params['MAX_CONCURRENT_REQUEST_PER_NODE'] = 4
+    g_params['REMOTE_TIMEOUT'] = 60 # timeout in seconds for requests to the remote node
+    g_params['MAX_WAIT_TIME_PER_LOOP'] = 600 # tasks not finished after this are left in the background
+    g_params['VIP_WEIGHT'] = fairshare.VIP_WEIGHT # fair-share weight of users in vip_email.txt
+    g_params['FAIRSHARE_HALF_LIFE'] = fairshare.HALF_LIFE # half-life in seconds of past usage
+    g_params['AIMD_INTERVAL'] = 60 # interval in seconds to adjust the dispatch limit of nodes
+    g_params['AIMD_MIN_LIMIT'] = 2
+    g_params['AIMD_INCREASE'] = 2
+    g_params['AIMD_DECREASE'] = 0.5
+    g_params['AIMD_MAX_FAILURE_RATE'] = 0.1
+    g_params['AIMD_MAX_LATENCY'] = 3600 # maximal mean time in seconds in the remote queue
+    g_params['CHUNK_TIME'] = 600 # a node gets as many sequences of a job as it finishes in this time
+    g_params['MIN_CHUNK_SIZE'] = 10
+    g_params['SPECULATIVE_EXECUTION'] = True # re-submit straggler sequences to another node
+    g_params['SPEC_MIN_SAMPLE'] = 10 # number of observed runtimes needed for a prediction
+    g_params['SPEC_FACTOR'] = 3.0  # straggler if elapsed > SPEC_FACTOR*predicted
+    g_params['SPEC_NUM_STD'] = 3.0 # and elapsed > predicted + SPEC_NUM_STD*std
+    g_params['SPEC_MIN_TIME'] = 1800 # and elapsed > SPEC_MIN_TIME seconds
+    g_params['SPEC_MAX_INFLIGHT'] = 20 # maximal number of duplicates running
+    g_params['INFLIGHT_DISPATCH'] = True # a sequence in the remote queue for another job is not submitted again
+    g_params['AVERAGE_RUNTIME_PER_SEQ_IN_SEC'] = 60 # used before runtimes are observed
+    g_params['ADMISSION_DEFER_WAIT'] = admission.ADMISSION_DEFER_WAIT
+    g_params['ADMISSION_MAX_DEFER_TIME'] = admission.ADMISSION_MAX_DEFER_TIME
+    g_params['HEARTBEAT_INTERVAL'] = workerpool.HEARTBEAT_INTERVAL # set at start only
+    g_params['WORKER_TIMEOUT'] = workerpool.WORKER_TIMEOUT # a worker is dead without heartbeat for this
+    g_params['LEASE_TIME'] = workerpool.LEASE_TIME # a lease not renewed for this can be taken over
     g_params['FORMAT_DATETIME'] = webcom.FORMAT_DATETIME
     g_params['UPPER_WAIT_TIME_IN_SEC'] = 60 #maximum wait time in local queue
+    g_params['SUBMIT_PENDING_TIMEOUT'] = submit_job_to_queue.SUBMIT_PENDING_TIMEOUT # a job handed over to the web process not submitted after this is submitted by the leader
     g_params['STATUS_UPDATE_FREQUENCY'] = [500, 50]  # updated by if loop%$1 == $2
+    g_params['FULL_STATISTICS_MULTIPLIER'] = 10 # RunStatistics is run this many times more rarely than STATUS_UPDATE_FREQUENCY, the rest is updated by incstat each loop
+    g_params['FULL_CLEAN_MULTIPLIER'] = 100 # DeleteOldResult and CleanServerFile are run this many times more rarely than STATUS_UPDATE_FREQUENCY, expired results are removed by the reaper
+    g_params['FULL_STATISTICS_FREQUENCY'] = [  # full rebuild by RunStatistics
+            g_params['STATUS_UPDATE_FREQUENCY'][0]*g_params['FULL_STATISTICS_MULTIPLIER'],
+            g_params['STATUS_UPDATE_FREQUENCY'][1]]
+    g_params['STAT_PLOT_INTERVAL'] = 300 # minimal interval in seconds to redraw the stat plots
+    g_params['FULL_CLEAN_FREQUENCY'] = [  # full scan by DeleteOldResult and CleanServerFile
+            g_params['STATUS_UPDATE_FREQUENCY'][0]*g_params['FULL_CLEAN_MULTIPLIER'],
+            g_params['STATUS_UPDATE_FREQUENCY'][1]]
+    g_params['REAPER_INTERVAL'] = expiry.REAPER_INTERVAL # seconds between two runs of the reaper
+    g_params['REAPER_BATCH_SIZE'] = expiry.REAPER_BATCH_SIZE # maximal number of folders removed at once
+    g_params['REAPER_PAUSE'] = expiry.REAPER_PAUSE # seconds between two batches of the reaper
+    g_params['REAPER_RETRY_DELAY'] = expiry.REAPER_RETRY_DELAY # seconds before a folder not removed is tried again
+    g_params['PHASE_STAT_WINDOW'] = 100 # loops in a window of the phase histograms
+    g_params['PROFILE_LOOP_INTERVAL'] = 0 # profile one loop in this many by cProfile, 0 to disable
+    g_params['PROFILE_NUM_KEEP'] = 5 # number of profiles kept in static/log/qd_fe_profile
     g_params['name_server'] = "PRODRES"
     g_params['path_static'] = path_static
     g_params['path_result'] = path_result
@@ -212,6 +1147,18 @@ def InitGlobalParameter():  # {{{
     g_params['vip_email_file'] = vip_email_file
     g_params['gen_logfile'] = gen_logfile
     g_params['finished_date_db'] = finished_date_db
+    g_params['remotequeue_db'] = remotequeue_db
+    g_params['fairshare_db'] = fairshare_db
+    g_params['nodecontrol_db'] = nodecontrol_db
+    g_params['speculation_db'] = speculation_db
+    g_params['loadfile'] = loadfile
+    g_params['worker_name'] = worker_name
+    g_params['incstat_db'] = incstat_db
+    g_params['expiry_db'] = expiry_db
+    g_params['phase_statfile'] = phase_statfile
+    g_params['serverstate_db'] = serverstate_db
+    g_params['jobcatalog_db'] = jobcatalog_db
+    g_params['path_tmp'] = path_tmp
     g_params['gen_errfile'] = gen_errfile
     g_params['contact_email'] = contact_email
     g_params['webserver_root'] = webserver_root
@@ -223,6 +1170,6 @@ def InitGlobalParameter():  # {{{
 if __name__ == '__main__':
     g_params = InitGlobalParameter()
     date_str = time.strftime(g_params['FORMAT_DATETIME'])
-    print("\n#%s#\n[Date: %s] qd_fe.py restarted"%('='*80,date_str))
+    print("\n#%s#\n[Date: %s] qd_fe.py restarted as worker %s"%('='*80,date_str, worker_name))
     sys.stdout.flush()
     sys.exit(main(g_params))
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Indexed store of the sequences submitted to the remote compute nodes
+
+    The file remotequeue_seqindex.txt in the result folder of each job is
+    still the record owned by qd_fe_common, with the format
+        seqindex <tab> node <tab> remotejobid <tab> description <tab> seq
+    This module mirrors the (jobid, seqindex, node, remotejobid) part of these
+    files into a sqlite3 database so that the number of jobs per node can be
+    obtained by a single query. A job is only re-read when the mtime or the
+    size of its remotequeue_seqindex.txt has changed.
+
+    Sequences leaving the remote queue of a job are recorded in the table
+    finished together with the time spent in the remote queue. A sequence is
+    counted as successful if its result folder seq_<seqindex> exists. These
+    records are used by nodecontrol.py to measure the throughput of the nodes.
+"""
+import os
+import time
+import sqlite3
+
+MAX_KEEP_FINISHED = 86400   # keep records of finished sequences for one day
+
+def OpenDB(dbfile):#{{{
+    """Open the index database and create the tables if not exist"""
+    con = sqlite3.connect(dbfile, timeout=30)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS remotequeue(
+            jobid TEXT NOT NULL,
+            seqindex INTEGER NOT NULL,
+            node TEXT NOT NULL,
+            remotejobid TEXT NOT NULL,
+            submit_epoch REAL NOT NULL,
+            PRIMARY KEY (jobid, seqindex, node, remotejobid)
+        )""")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_remotequeue_node ON remotequeue(node)")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS finished(
+            jobid TEXT NOT NULL,
+            seqindex INTEGER NOT NULL,
+            node TEXT NOT NULL,
+            submit_epoch REAL NOT NULL,
+            finish_epoch REAL NOT NULL,
+            success INTEGER NOT NULL
+        )""")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_finished_epoch ON finished(finish_epoch)")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS indexfile(
+            jobid TEXT PRIMARY KEY,
+            mtime REAL NOT NULL,
+            size INTEGER NOT NULL
+        )""")
+    con.commit()
+    return con
+#}}}
+def ReadRemoteQueueFile(remotequeue_idx_file):#{{{
+    """Read remotequeue_seqindex.txt
+    return a list of tuples (seqindex, node, remotejobid)"""
+    li = []
+    try:
+        fpin = open(remotequeue_idx_file, "r")
+    except IOError:
+        return li
+    with fpin:
+        for line in fpin:
+            strs = line.split('\t')
+            if len(strs) >= 5:
+                try:
+                    seqindex = int(strs[0])
+                except ValueError:
+                    continue
+                li.append((seqindex, strs[1], strs[2]))
+    return li
+#}}}
+def _RecordFinished(con, jobid, outpath_result, oldDict, removedset, epoch,#{{{
+        isOnlySuccess):
+    finishedli = []
+    for tup in removedset:
+        success = int(os.path.exists("%s/seq_%d"%(outpath_result, tup[0])))
+        if success or not isOnlySuccess:
+            finishedli.append((jobid, tup[0], tup[1], oldDict[tup], epoch, success))
+    con.executemany("INSERT INTO finished(jobid, seqindex, node, submit_epoch, "
+            "finish_epoch, success) VALUES (?, ?, ?, ?, ?, ?)", finishedli)
+#}}}
+def _ReadJobEntry(con, jobid):#{{{
+    """return a dict {(seqindex, node, remotejobid): submit_epoch}"""
+    oldDict = {}
+    for (seqindex, node, remotejobid, submit_epoch) in con.execute(
+            "SELECT seqindex, node, remotejobid, submit_epoch FROM remotequeue "
+            "WHERE jobid = ?", (jobid,)):
+        oldDict[(seqindex, node, remotejobid)] = submit_epoch
+    return oldDict
+#}}}
+def _SyncJob(con, jobid, remotequeue_idx_file):#{{{
+    epoch = time.time()
+    outpath_result = "%s/%s"%(os.path.dirname(remotequeue_idx_file), jobid)
+    try:
+        st = os.stat(remotequeue_idx_file)
+    except OSError:
+        # the job is finished or deleted, only sequences with results are
+        # recorded as finished
+        oldDict = _ReadJobEntry(con, jobid)
+        _RecordFinished(con, jobid, outpath_result, oldDict, set(oldDict.keys()),
+                epoch, True)
+        con.execute("DELETE FROM remotequeue WHERE jobid = ?", (jobid,))
+        con.execute("DELETE FROM indexfile WHERE jobid = ?", (jobid,))
+        return
+
+    row = con.execute("SELECT mtime, size FROM indexfile WHERE jobid = ?",
+            (jobid,)).fetchone()
+    if row is not None and row[0] == st.st_mtime and row[1] == st.st_size:
+        return
+
+    oldDict = _ReadJobEntry(con, jobid)
+    oldset = set(oldDict.keys())
+    newset = set(ReadRemoteQueueFile(remotequeue_idx_file))
+    _RecordFinished(con, jobid, outpath_result, oldDict, oldset - newset, epoch, False)
+    # keep the submit_epoch of the entries that are still in the remote queue
+    con.executemany("DELETE FROM remotequeue WHERE jobid = ? AND seqindex = ? "
+            "AND node = ? AND remotejobid = ?",
+            [(jobid,) + tup for tup in oldset - newset])
+    con.executemany("INSERT OR IGNORE INTO remotequeue(jobid, seqindex, node, "
+            "remotejobid, submit_epoch) VALUES (?, ?, ?, ?, ?)",
+            [(jobid,) + tup + (epoch,) for tup in newset - oldset])
+    con.execute("INSERT OR REPLACE INTO indexfile(jobid, mtime, size) VALUES (?, ?, ?)",
+            (jobid, st.st_mtime, st.st_size))
+#}}}
+def SyncJob(dbfile, jobid, path_result):#{{{
+    """Update the index for one job, called after the remote queue of this job
+    has been changed by SubmitJob or GetResult"""
+    remotequeue_idx_file = "%s/%s/remotequeue_seqindex.txt"%(path_result, jobid)
+    con = OpenDB(dbfile)
+    try:
+        with con:
+            _SyncJob(con, jobid, remotequeue_idx_file)
+    finally:
+        con.close()
+#}}}
+def SyncJobList(dbfile, jobidlist, path_result, alljobidlist=None):#{{{
+    """Update the index for all jobs in jobidlist and remove the jobs that are
+    not in alljobidlist (i.e. finished, failed or deleted jobs), alljobidlist
+    is jobidlist if not given"""
+    con = OpenDB(dbfile)
+    try:
+        with con:
+            for jobid in jobidlist:
+                remotequeue_idx_file = "%s/%s/remotequeue_seqindex.txt"%(path_result, jobid)
+                _SyncJob(con, jobid, remotequeue_idx_file)
+            if alljobidlist is None:
+                alljobidlist = jobidlist
+            jobidset = set(alljobidlist)
+            staleli = [(row[0],) for row in
+                    con.execute("SELECT jobid FROM indexfile").fetchall()
+                    if row[0] not in jobidset]
+            con.executemany("DELETE FROM remotequeue WHERE jobid = ?", staleli)
+            con.executemany("DELETE FROM indexfile WHERE jobid = ?", staleli)
+            con.execute("DELETE FROM finished WHERE finish_epoch < ?",
+                    (time.time() - MAX_KEEP_FINISHED,))
+    finally:
+        con.close()
+#}}}
+def GetRemoteQueueDict(dbfile, nodelist):#{{{
+    """Return a dict {node: [remotejobid, ...]} for nodes in nodelist
+    obtained by a single query"""
+    remotequeueDict = {}
+    for node in nodelist:
+        remotequeueDict[node] = []
+    con = OpenDB(dbfile)
+    try:
+        for (node, remotejobid) in con.execute(
+                "SELECT node, remotejobid FROM remotequeue ORDER BY node"):
+            if node in remotequeueDict:
+                remotequeueDict[node].append(remotejobid)
+    finally:
+        con.close()
+    return remotequeueDict
+#}}}
+def GetNodeListOfJob(dbfile, jobid):#{{{
+    """Return the list of nodes on which the job has sequences"""
+    con = OpenDB(dbfile)
+    try:
+        return [row[0] for row in con.execute(
+            "SELECT DISTINCT node FROM remotequeue WHERE jobid = ?", (jobid,))]
+    finally:
+        con.close()
+#}}}
+def GetJobEntryDict(dbfile, jobid):#{{{
+    """Return a dict {(seqindex, node, remotejobid): submit_epoch} of the
+    sequences of the job in the remote queue"""
+    con = OpenDB(dbfile)
+    try:
+        return _ReadJobEntry(con, jobid)
+    finally:
+        con.close()
+#}}}
+def GetJobNodeCount(dbfile):#{{{
+    """Return a dict {jobid: {node: number of sequences in the remote queue}}"""
+    countDict = {}
+    con = OpenDB(dbfile)
+    try:
+        for (jobid, node, cnt) in con.execute(
+                "SELECT jobid, node, COUNT(*) FROM remotequeue GROUP BY jobid, node"):
+            if jobid not in countDict:
+                countDict[jobid] = {}
+            countDict[jobid][node] = cnt
+    finally:
+        con.close()
+    return countDict
+#}}}
+def GetFinishedStat(dbfile, begin_epoch):#{{{
+    """Return a dict {node: [num_success, num_failed, sum_of_latency]} for
+    sequences left the remote queue after begin_epoch, latency is the time in
+    seconds that successful sequences spent in the remote queue"""
+    statDict = {}
+    con = OpenDB(dbfile)
+    try:
+        for (node, success, cnt, sum_latency) in con.execute(
+                "SELECT node, success, COUNT(*), SUM(finish_epoch - submit_epoch) "
+                "FROM finished WHERE finish_epoch >= ? GROUP BY node, success",
+                (begin_epoch,)):
+            if node not in statDict:
+                statDict[node] = [0, 0, 0.0]
+            if success:
+                statDict[node][0] += cnt
+                statDict[node][2] += sum_latency
+            else:
+                statDict[node][1] += cnt
+    finally:
+        con.close()
+    return statDict
+#}}}
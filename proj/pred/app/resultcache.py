@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Access to the cache of results of single sequences
+
+    The result of a sequence computed with the parameters query_para is
+    stored under path_cache/<md5_key[:2]>/<md5_key> or as the zip file of
+    that folder, md5_key being the md5 of the sequence followed by
+    str(query_para), see GetCacheKey.
+
+    Used by run_job.py for each sequence and by the views to finish a
+    small job at once when all its sequences are cached (WriteCachedJob),
+    with the same result files as written by run_job.py.
+"""
+import os
+import json
+import shutil
+import hashlib
+import subprocess
+
+from libpredweb import myfunc
+from libpredweb import webserver_common as webcom
+
+def ReadQueryPara(para_str):#{{{
+    """Return query_para as read by run_job.py from query.para.txt"""
+    if para_str == "":
+        return ""
+    return json.loads(para_str)
+#}}}
+def GetCacheKey(seq, query_para):#{{{
+    return hashlib.md5((seq+str(query_para)).encode('utf-8')).hexdigest()
+#}}}
+def GetCacheDir(path_cache, md5_key):#{{{
+    return "%s/%s/%s"%(path_cache, md5_key[:2], md5_key)
+#}}}
+def IsCached(path_cache, md5_key):#{{{
+    cachedir = GetCacheDir(path_cache, md5_key)
+    return os.path.exists(cachedir) or os.path.exists(cachedir + ".zip")
+#}}}
+def CopyFromCache(path_cache, md5_key, outpath_result, outpath_this_seq,#{{{
+        logfile, errfile):
+    """Copy the cached result to outpath_this_seq, a sub folder of
+    outpath_result
+    return the source "dir" or "zip", or "" if not copied"""
+    cachedir = GetCacheDir(path_cache, md5_key)
+    zipfile_cache = cachedir + ".zip"
+    source = ""
+    if os.path.exists(cachedir):
+        try:
+            shutil.copytree(cachedir, outpath_this_seq)
+            source = "dir"
+        except Exception as e:
+            webcom.loginfo("Failed to copytree  %s -> %s with errmsg=%s"%(
+                cachedir, outpath_this_seq, str(e)), errfile)
+    elif os.path.exists(zipfile_cache):
+        cmd = ["unzip", zipfile_cache, "-d", outpath_result]
+        webcom.RunCmd(cmd, logfile, errfile)
+        try:
+            shutil.move("%s/%s"%(outpath_result, md5_key), outpath_this_seq)
+            source = "zip"
+        except (IOError, OSError) as e:
+            webcom.loginfo("Failed to move the unzipped %s with errmsg=%s"%(
+                zipfile_cache, str(e)), errfile)
+    if not os.path.exists(outpath_this_seq):
+        return ""
+    return source
+#}}}
+def ReadFastaRecord(content):#{{{
+    """Return a list of (description, seq) from the fasta content"""
+    recordlist = []
+    description = None
+    seqli = []
+    for line in content.split("\n"):
+        line = line.strip()
+        if line.startswith(">"):
+            if description is not None:
+                recordlist.append((description, "".join(seqli)))
+            description = line[1:].strip()
+            seqli = []
+        elif description is not None and line != "":
+            seqli.append(line)
+    if description is not None:
+        recordlist.append((description, "".join(seqli)))
+    return recordlist
+#}}}
+def GetCacheKeyList(recordlist, query_para, path_cache):#{{{
+    """Return the list of cache keys of the records, or None if any of them
+    is not cached"""
+    keylist = []
+    for (description, seq) in recordlist:
+        md5_key = GetCacheKey(seq, query_para)
+        if not IsCached(path_cache, md5_key):
+            return None
+        keylist.append(md5_key)
+    return keylist
+#}}}
+def WriteCachedJob(rstdir, jobid, recordlist, keylist, path_cache):#{{{
+    """Write the result of the job from the cache as run_job.py does, with
+    runjob.finish written last
+    return the list of sources of the sequences, or None on failure, in
+    which case the result folder is removed and the job is to be run
+    normally"""
+    runjob_logfile = "%s/runjob.log"%(rstdir)
+    runjob_errfile = "%s/runjob.err"%(rstdir)
+    outpath_result = "%s/%s"%(rstdir, jobid)
+    finished_seq_file = "%s/finished_seqs.txt"%(outpath_result)
+    mapfile = "%s/seqid_index_map.txt"%(outpath_result)
+    try:
+        os.makedirs(outpath_result)
+    except OSError:
+        return None
+
+    sourcelist = []
+    finishlist = []
+    maplist_simple = []
+    for cnt in range(len(recordlist)):
+        (description, seq) = recordlist[cnt]
+        outpath_this_seq = "%s/seq_%d"%(outpath_result, cnt)
+        source = CopyFromCache(path_cache, keylist[cnt], outpath_result,
+                outpath_this_seq, runjob_logfile, runjob_errfile)
+        if source == "":
+            shutil.rmtree(outpath_result, ignore_errors=True)
+            return None
+        sourcelist.append(source)
+        info_finish = webcom.GetInfoFinish_PRODRES(outpath_this_seq, cnt,
+                len(seq), description, source_result="cached", runtime=0.0)
+        finishlist.append("\t".join(info_finish)+"\n")
+        maplist_simple.append("seq_%d\t%d\t%s"%(cnt, len(seq), description))
+
+    webcom.WriteDateTimeTagFile("%s/runjob.start"%(rstdir), runjob_logfile, runjob_errfile)
+    myfunc.WriteFile("".join(finishlist), finished_seq_file, "w", isFlush=True)
+    myfunc.WriteFile("\n".join(maplist_simple)+"\n", mapfile)
+    # zip is run in rstdir without changing the cwd of the caller
+    cmd = ["zip", "-rq", "%s.zip"%(jobid), jobid]
+    try:
+        subprocess.check_call(cmd, cwd=rstdir, stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError) as e:
+        webcom.loginfo("Failed to zip %s with errmsg=%s"%(outpath_result, str(e)), runjob_errfile)
+    webcom.WriteDateTimeTagFile("%s/runjob.finish"%(rstdir), runjob_logfile, runjob_errfile)
+    return sourcelist
+#}}}
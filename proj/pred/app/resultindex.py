@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Parsed index of the finished sequences of a job for the result page
+
+    finished_seqs.txt is only appended to while the job is running, so the
+    lines added since the last request are parsed and stored with the
+    sizes of the output files of the sequences in the sidecar database
+    <rstdir>/resultindex.sqlite3 (Update). The file sizes are thus read
+    once per sequence, and a page of the result table is read by the rank
+    of the sequence (GetPage), so that the cost of a request does not grow
+    with the number of finished sequences. The index is rebuilt when
+    finished_seqs.txt has been replaced or truncated.
+
+    Format of finished_seqs.txt
+        subfolder, length, ..., source, runtime, description, finish_date
+"""
+import os
+import json
+import sqlite3
+
+from libpredweb import myfunc
+
+import logtail
+
+# output files of a sequence shown in the PSSM and HMM columns
+OUTPUT_FILE_DICT = {
+        "psiblast": (["psiOutput.txt", "psiPSSM.txt"], []),
+        "jackhmmer": ([], ["hmmOut.txt", "Alignment.txt", "tableOut.txt", "fullOut.txt"]),
+        }
+
+def GetDBFile(rstdir):#{{{
+    return "%s/resultindex.sqlite3"%(rstdir)
+#}}}
+def OpenDB(dbfile):#{{{
+    con = sqlite3.connect(dbfile, timeout=30, isolation_level=None)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS seqindex(
+            rank INTEGER PRIMARY KEY,
+            subfolder TEXT NOT NULL,
+            length TEXT NOT NULL,
+            pssm_files TEXT NOT NULL,
+            hmm_files TEXT NOT NULL,
+            runtime TEXT NOT NULL,
+            description TEXT NOT NULL,
+            source TEXT NOT NULL,
+            finish_date TEXT NOT NULL
+        )""")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_seqindex_source "
+            "ON seqindex(source, rank)")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS tailstate(
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            inode INTEGER NOT NULL,
+            offset INTEGER NOT NULL,
+            num_finished INTEGER NOT NULL,
+            cnt_newrun INTEGER NOT NULL,
+            cnt_cached INTEGER NOT NULL,
+            sum_run_time REAL NOT NULL
+        )""")
+    return con
+#}}}
+def _GetFileList(outpath_this_seq, namelist):#{{{
+    """Return a list of (filename, size_str) of the existing files"""
+    li = []
+    for name in namelist:
+        try:
+            fsize = os.path.getsize("%s/outputs/%s"%(outpath_this_seq, name))
+        except OSError:
+            continue
+        li.append((name, myfunc.Size_byte2human(fsize)))
+    return li
+#}}}
+def GetOutputFileList(outpath_this_seq, second_method):#{{{
+    """Return (pssm_files, hmm_files), the lists of (filename, size_str) of
+    the output files of the sequence"""
+    (pssm_namelist, hmm_namelist) = OUTPUT_FILE_DICT.get(second_method, ([], []))
+    return (_GetFileList(outpath_this_seq, pssm_namelist),
+            _GetFileList(outpath_this_seq, hmm_namelist))
+#}}}
+def ParseFinishedLine(line):#{{{
+    """Return the dict of a line of finished_seqs.txt, or None if the line
+    is not valid"""
+    strs = line.split("\t")
+    if len(strs) < 7:
+        return None
+    try:
+        finish_date = strs[7]
+    except IndexError:
+        finish_date = "N/A"
+    try:
+        runtime = float(strs[5])
+    except ValueError:
+        runtime = None
+    return {'subfolder': strs[0], 'length': strs[1], 'source': strs[4],
+            'runtime': runtime, 'description': strs[6],
+            'finish_date': finish_date}
+#}}}
+def Update(dbfile, outpath_result, second_method):#{{{
+    """Add the sequences appended to finished_seqs.txt in outpath_result
+    since the last update"""
+    finished_seq_file = "%s/finished_seqs.txt"%(outpath_result)
+    try:
+        st = os.stat(finished_seq_file)
+    except OSError:
+        return
+    con = OpenDB(dbfile)
+    try:
+        row = con.execute("SELECT inode, offset FROM tailstate").fetchone()
+        if row is not None and row[0] == st.st_ino and row[1] == st.st_size:
+            return  # nothing new, no need to lock the database
+        con.execute("BEGIN IMMEDIATE")
+        row = con.execute("SELECT inode, offset, num_finished, cnt_newrun, "
+                "cnt_cached, sum_run_time FROM tailstate").fetchone()
+        if row is None or row[0] != st.st_ino or row[1] > st.st_size:
+            con.execute("DELETE FROM seqindex")
+            row = (st.st_ino, 0, 0, 0, 0, 0.0)
+        (inode, offset, num_finished, cnt_newrun, cnt_cached, sum_run_time) = row
+        lines = []
+        while True:
+            (newlines, inode, offset) = logtail.ReadNewLines(finished_seq_file, inode, offset)
+            if len(newlines) == 0:
+                break
+            lines += newlines
+        for line in lines:
+            seqDict = ParseFinishedLine(line)
+            if seqDict is None:
+                continue
+            source = seqDict['source']
+            (pssm_files, hmm_files) = GetOutputFileList("%s/%s"%(outpath_result,
+                seqDict['subfolder']), second_method)
+            if seqDict['runtime'] is not None:
+                runtime_in_sec_str = "%.1f"%(seqDict['runtime'])
+                if source == "newrun":
+                    sum_run_time += seqDict['runtime']
+                    cnt_newrun += 1
+                elif source == "cached":
+                    cnt_cached += 1
+            else:
+                runtime_in_sec_str = ""
+            num_finished += 1
+            con.execute("INSERT OR REPLACE INTO seqindex(rank, subfolder, length, "
+                    "pssm_files, hmm_files, runtime, description, source, finish_date) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (num_finished,
+                        seqDict['subfolder'], seqDict['length'], json.dumps(pssm_files),
+                        json.dumps(hmm_files), runtime_in_sec_str,
+                        seqDict['description'], source, seqDict['finish_date']))
+        con.execute("INSERT OR REPLACE INTO tailstate(id, inode, offset, num_finished, "
+                "cnt_newrun, cnt_cached, sum_run_time) VALUES (0, ?, ?, ?, ?, ?, ?)",
+                (inode, offset, num_finished, cnt_newrun, cnt_cached, sum_run_time))
+        con.execute("COMMIT")
+    except sqlite3.Error:
+        if con.in_transaction:
+            con.execute("ROLLBACK")
+        raise
+    finally:
+        con.close()
+#}}}
+def GetSummary(dbfile):#{{{
+    """Return a dict with num_finished, cnt_newrun, cnt_cached, sum_run_time
+    and offset, the size of finished_seqs.txt indexed"""
+    con = OpenDB(dbfile)
+    try:
+        row = con.execute("SELECT num_finished, cnt_newrun, cnt_cached, "
+                "sum_run_time, offset FROM tailstate").fetchone()
+    finally:
+        con.close()
+    if row is None:
+        row = (0, 0, 0, 0.0, 0)
+    return {'num_finished': row[0], 'cnt_newrun': row[1],
+            'cnt_cached': row[2], 'sum_run_time': row[3], 'offset': row[4]}
+#}}}
+def GetPage(dbfile, offset, limit):#{{{
+    """Return the rows offset+1 to offset+limit of the result table as
+    [rank, length, pssm_files, hmm_files, runtime, description, subfolder,
+    source, finish_date]"""
+    con = OpenDB(dbfile)
+    try:
+        rows = con.execute("SELECT rank, length, pssm_files, hmm_files, runtime, "
+                "description, subfolder, source, finish_date FROM seqindex "
+                "WHERE rank > ? AND rank <= ? ORDER BY rank",
+                (offset, offset + limit)).fetchall()
+    finally:
+        con.close()
+    return [["%d"%(rank), length, json.loads(pssm_files), json.loads(hmm_files),
+        runtime, description[:30], subfolder, source, finish_date]
+        for (rank, length, pssm_files, hmm_files, runtime, description,
+            subfolder, source, finish_date) in rows]
+#}}}
+def GetNewRunSubfolder(dbfile, idx):#{{{
+    """Return the subfolder of the idx-th (from 0) newly run sequence, or
+    None"""
+    con = OpenDB(dbfile)
+    try:
+        row = con.execute("SELECT subfolder FROM seqindex WHERE source = 'newrun' "
+                "ORDER BY rank LIMIT 1 OFFSET ?", (idx,)).fetchone()
+    finally:
+        con.close()
+    if row is None:
+        return None
+    return row[0]
+#}}}
@@ -7,11 +7,15 @@ import time
 from libpredweb import myfunc
 from libpredweb import webserver_common as webcom
 import glob
-import hashlib
 import shutil
 import site
 import fcntl
 import json
+import expiry
+import jobcatalog
+import serverstate
+import resultcache
+import inflight
 progname =  os.path.basename(sys.argv[0])
 wspace = ''.join([" "]*len(progname))
 rundir = os.path.dirname(os.path.realpath(__file__))
@@ -37,6 +41,10 @@ path_cache = "%s/static/result/cache"%(basedir)
 path_result = "%s/static/result/"%(basedir)
 path_log = "%s/static/log"%(basedir)
 finished_date_db = "%s/cached_job_finished_date.sqlite3"%(path_log)
+expiry_db = "%s/expiry.sqlite3"%(path_log)
+serverstate_db = "%s/serverstate.sqlite3"%(path_log)
+jobcatalog_db = "%s/jobcatalog.sqlite3"%(path_log)
+path_inflight = "%s/inflight"%(path_log)
 
 
 gen_errfile = "%s/static/log/%s.err"%(basedir, progname)
@@ -126,11 +134,17 @@ def RunJob(infile, outpath, tmpdir, email, jobid, g_params):#{{{
     maplist = []
     maplist_simple = []
     toRunDict = {}
+    cacheCountDict = {} # {(name, label): count} for serverstate
+    runtimeli = []
     hdl = myfunc.ReadFastaByBlock(infile, method_seqid=0, method_seq=0)
     if hdl.failure:
         isOK = False
     else:
         webcom.WriteDateTimeTagFile(starttagfile, runjob_logfile, runjob_errfile)
+        try:
+            jobcatalog.UpdateFromTagFile(jobcatalog_db, jobid, outpath)
+        except Exception as e:
+            webcom.loginfo("Failed to update %s with error message: %s"%(jobcatalog_db, str(e)), runjob_logfile)
         recordList = hdl.readseq()
         cnt = 0
         origpath = os.getcwd()
@@ -153,31 +167,22 @@ def RunJob(infile, outpath, tmpdir, email, jobid, g_params):#{{{
                 maplist_simple.append("%s\t%d\t%s"%("seq_%d"%cnt, len(rd.seq),
                     rd.description))
                 if not g_params['isForceRun']:
-                    md5_key = hashlib.md5((rd.seq+str(query_para)).encode('utf-8')).hexdigest()
-                    subfoldername = md5_key[:2]
-                    cachedir = "%s/%s/%s"%(path_cache, subfoldername, md5_key)
-                    zipfile_cache = cachedir + ".zip"
-
-                    if os.path.exists(cachedir) or os.path.exists(zipfile_cache):
-                        if os.path.exists(cachedir):
-                            try:
-                                shutil.copytree(cachedir, outpath_this_seq)
-                            except Exception as e:
-                                msg = "Failed to copytree  %s -> %s"%(cachedir, outpath_this_seq)
-                                date_str = time.strftime(FORMAT_DATETIME)
-                                myfunc.WriteFile("[%s] %s with errmsg=%s\n"%(date_str, 
-                                    msg, str(e)), runjob_errfile, "a")
-                        elif os.path.exists(zipfile_cache):
-                            cmd = ["unzip", zipfile_cache, "-d", outpath_result]
-                            webcom.RunCmd(cmd, runjob_logfile, runjob_errfile)
-                            shutil.move("%s/%s"%(outpath_result, md5_key), outpath_this_seq)
-
-                        if os.path.exists(outpath_this_seq):
+                    md5_key = resultcache.GetCacheKey(rd.seq, query_para)
+                    if resultcache.IsCached(path_cache, md5_key):
+                        source = resultcache.CopyFromCache(path_cache, md5_key,
+                                outpath_result, outpath_this_seq, runjob_logfile,
+                                runjob_errfile)
+                        if source != "":
                             info_finish = webcom.GetInfoFinish_PRODRES(outpath_this_seq,
                                     cnt, len(rd.seq), rd.description, source_result="cached", runtime=0.0)
                             myfunc.WriteFile("\t".join(info_finish)+"\n",
                                     finished_seq_file, "a", isFlush=True)
                             isSkip = True
+                            key = ("cache_hits", 'source="%s"'%(source))
+                            cacheCountDict[key] = cacheCountDict.get(key, 0) + 1
+                    if not isSkip:
+                        key = ("cache_misses", "")
+                        cacheCountDict[key] = cacheCountDict.get(key, 0) + 1
 
                 if not isSkip:
                     # first try to delete the outfolder if exists
@@ -211,14 +216,62 @@ def RunJob(infile, outpath, tmpdir, email, jobid, g_params):#{{{
 
         # submit sequences one by one to the workflow according to orders in
         # sortedlist
-
-        for item in sortedlist:
+        # A sequence being computed by another job (see inflight.py) is put
+        # at the end of the list, and then its result is copied once the
+        # other job has finished it. The registration of a sequence is
+        # released at the start of the next one
+
+        runlist = [(item, None) for item in sortedlist] # (item, owner_path)
+        lockfp = None
+        idx = 0
+        while idx < len(runlist):
+            (item, owner_path) = runlist[idx]
+            idx += 1
+            inflight.Release(lockfp)
+            lockfp = None
             origIndex = item[0]
             seq = item[1][0]
             description = item[1][2]
 
             subfoldername_this_seq = "seq_%d"%(origIndex)
             outpath_this_seq = "%s/%s"%(outpath_result, subfoldername_this_seq)
+
+            if not g_params['isForceRun']:
+                md5_key = resultcache.GetCacheKey(seq, query_para)
+                if owner_path is None:
+                    (lockfp, path) = inflight.Acquire(path_inflight, md5_key, outpath_this_seq)
+                    if lockfp is None:
+                        runlist.append((item, path))
+                        continue
+                else:
+                    (lockfp, path) = inflight.Acquire(path_inflight, md5_key,
+                            outpath_this_seq, timeout=g_params['INFLIGHT_MAX_WAIT'])
+                    source = ""
+                    if resultcache.IsCached(path_cache, md5_key):
+                        source = resultcache.CopyFromCache(path_cache, md5_key,
+                                outpath_result, outpath_this_seq, runjob_logfile,
+                                runjob_errfile)
+                    elif (owner_path != "" and os.path.exists(owner_path) and
+                            inflight.IsSeqFinished(os.path.dirname(owner_path),
+                                os.path.basename(owner_path))):
+                        # only a result the other job has recorded as
+                        # finished is copied, a failed run is computed again
+                        try:
+                            shutil.copytree(owner_path, outpath_this_seq)
+                            source = "inflight"
+                        except Exception as e:
+                            webcom.loginfo("Failed to copytree %s -> %s with errmsg=%s"%(
+                                owner_path, outpath_this_seq, str(e)), runjob_logfile)
+                            shutil.rmtree(outpath_this_seq, ignore_errors=True)
+                    if source != "":
+                        info_finish = webcom.GetInfoFinish_PRODRES(outpath_this_seq,
+                                origIndex, len(seq), description, source_result="cached", runtime=0.0)
+                        myfunc.WriteFile("\t".join(info_finish)+"\n",
+                                finished_seq_file, "a", isFlush=True)
+                        key = ("cache_hits", 'source="%s"'%(source))
+                        cacheCountDict[key] = cacheCountDict.get(key, 0) + 1
+                        cacheCountDict[("cache_misses", "")] -= 1
+                        continue
             tmp_outpath_this_seq = "%s/%s"%(tmp_outpath_result, "seq_%d"%(0))
             if os.path.exists(tmp_outpath_this_seq):
                 try:
@@ -308,6 +361,7 @@ def RunJob(infile, outpath, tmpdir, email, jobid, g_params):#{{{
                 if isCmdSuccess:
                     timefile = "%s/time.txt"%(outpath_this_seq)
                     runtime = webcom.ReadRuntimeFromFile(timefile, default_runtime=0.0)
+                    runtimeli.append(runtime)
                     info_finish = webcom.GetInfoFinish_PRODRES(outpath_this_seq,
                             origIndex, len(seq), description, source_result="newrun", runtime=runtime)
                     myfunc.WriteFile("\t".join(info_finish)+"\n",
@@ -321,10 +375,9 @@ def RunJob(infile, outpath, tmpdir, email, jobid, g_params):#{{{
                     # create or update the md5 cache
                     # create cache only on the front-end
                     if webcom.IsFrontEndNode(g_params['base_www_url']):
-                        md5_key = hashlib.md5((seq+str(query_para)).encode('utf-8')).hexdigest()
-                        subfoldername = md5_key[:2]
-                        md5_subfolder = "%s/%s"%(path_cache, subfoldername)
-                        cachedir = "%s/%s/%s"%(path_cache, subfoldername, md5_key)
+                        md5_key = resultcache.GetCacheKey(seq, query_para)
+                        cachedir = resultcache.GetCacheDir(path_cache, md5_key)
+                        md5_subfolder = os.path.dirname(cachedir)
 
                         # copy the zipped folder to the cache path
                         origpath = os.getcwd()
@@ -341,8 +394,12 @@ def RunJob(infile, outpath, tmpdir, email, jobid, g_params):#{{{
                         # Add the finished date to the database
                         date_str = time.strftime(FORMAT_DATETIME)
                         webcom.InsertFinishDateToDB(date_str, md5_key, seq, finished_date_db)
+        inflight.Release(lockfp)
 
-
+    try:
+        serverstate.IncCounter(serverstate_db, cacheCountDict)
+    except Exception as e:
+        webcom.loginfo("Failed to update %s with error message: %s"%(serverstate_db, str(e)), runjob_logfile)
 
     all_end_time = time.time()
     all_runtime_in_sec = all_end_time - all_begin_time
@@ -371,6 +428,22 @@ def RunJob(infile, outpath, tmpdir, email, jobid, g_params):#{{{
             isSuccess = False
             webcom.WriteDateTimeTagFile(failedtagfile, runjob_logfile, runjob_errfile)
 
+        try:
+            serverstate.AddSample(serverstate_db, "seq_runtime:local", runtimeli)
+        except Exception as e:
+            webcom.loginfo("Failed to update %s with error message: %s"%(serverstate_db, str(e)), runjob_logfile)
+
+        # add the result folder to the expiry index, so that it is removed
+        # by qd_fe after MAX_KEEP_DAYS without scanning all result folders
+        try:
+            expiry.AddItem(expiry_db, outpath)
+        except Exception as e:
+            webcom.loginfo("Failed to add %s to the expiry index with error message: %s"%(outpath, str(e)), runjob_logfile)
+        try:
+            jobcatalog.UpdateFromTagFile(jobcatalog_db, jobid, outpath)
+        except Exception as e:
+            webcom.loginfo("Failed to update %s with error message: %s"%(jobcatalog_db, str(e)), runjob_logfile)
+
 
 # send the result to email
 # do not sendmail at the cloud VM
@@ -385,6 +458,11 @@ def RunJob(infile, outpath, tmpdir, email, jobid, g_params):#{{{
                     logfile=runjob_logfile, errfile=runjob_errfile)
 
     if os.path.exists(runjob_errfile) and os.path.getsize(runjob_errfile) > 1:
+        # the tmpdir is kept for debugging and expires with the result
+        try:
+            expiry.AddItem(expiry_db, tmpdir)
+        except Exception:
+            pass
         return 1
     else:
         try:
@@ -501,6 +579,7 @@ def InitGlobalParameter():#{{{
     g_params['base_www_url'] = ""
     g_params['lockfile'] = ""
     g_params['FORMAT_DATETIME'] = webcom.FORMAT_DATETIME
+    g_params['INFLIGHT_MAX_WAIT'] = 6*3600 # wait at most this for a sequence computed by another job
     return g_params
 #}}}
 if __name__ == '__main__' :
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Validation of an uploaded query file in one pass with bounded memory
+
+    The uploaded file is written to disk by chunks (SaveUploadedFile) and then
+    read by blocks of READ_SIZE bytes (ValidateSeqFile), the valid sequences
+    are written to the output file as soon as they are read. Only the current
+    record is kept in memory, and the residues of a sequence are no longer
+    stored once it exceeds MAX_LEN_SEQ.
+
+    The sequences are handled as bytes, the white spaces are deleted and the
+    letters checked by bytes.translate over whole pieces of the block, the
+    positions of the letters to report are searched for only in the
+    sequences having such letters. See script/bench_seqvalidate.py for the
+    comparison with webcom.ValidateSeq. The rules and messages are those of
+    webcom.ValidateSeq for a query given as a string
+      - empty sequences, sequences shorter than MIN_LEN_SEQ or longer than
+        MAX_LEN_SEQ and DNA sequences are removed with a warning
+      - letters other than ABCDEFGHIKLMNPQRSTUVWYZX*- make the query invalid
+      - B, Z are replaced by X, U by C, and * and - are deleted
+    At most MAX_NUM_MESSAGE warnings and errors are kept.
+"""
+import re
+
+try:
+    from libpredweb import myfunc
+except ImportError:     # only ValidateSeqFile needs it, see test_seqvalidate.py
+    myfunc = None
+
+READ_SIZE = 1024*1024       # bytes read at most at once
+MAX_LEN_ANNO = 64*1024      # bytes of an annotation line kept at most
+MAX_NUM_MESSAGE = 1000      # warnings and errors on sequences kept at most
+
+_RE_NON_ASCII = re.compile(r'[^\x00-\x7f]')
+_RE_BAD_LETTER = re.compile(rb'[^ABCDEFGHIKLMNPQRSTUVWYZX*-]')
+
+# bytes deleted from the sequence lines, white spaces and non-ASCII bytes,
+# which are replaced by white spaces in webcom.ValidateSeq
+_DELETE_BYTES = b" \t\n\r\x0b\x0c" + bytes(range(0x80, 0x100))
+_VALID_LETTERS = b"ABCDEFGHIKLMNPQRSTUVWYZX*-"
+_STANDARD_LETTERS = b"ACDEFGHIKLMNPQRSTVWYX"
+
+# (pattern, replacement, action in the warning) of the non-standard letters
+CONVERSION_LIST = [
+        (re.compile(rb'[BZ]'), b"X", "has been replaced by 'X'"),
+        (re.compile(rb'[U]'), b"C", "has been replaced by 'C'"),
+        (re.compile(rb'[*]'), b"", "has been deleted"),
+        (re.compile(rb'[-]'), b"", "has been deleted"),
+        ]
+
+def SaveUploadedFile(uploadfile, outfile):#{{{
+    """Write the uploaded file to outfile by chunks, return the size"""
+    size = 0
+    with open(outfile, "wb") as fpout:
+        for chunk in uploadfile.chunks():
+            fpout.write(chunk)
+            size += len(chunk)
+    return size
+#}}}
+def _AddMessage(msglist, msg, cntDict, key):#{{{
+    cntDict[key] += 1
+    if len(msglist) < MAX_NUM_MESSAGE:
+        msglist.append(msg)
+#}}}
+def _ReadRecord(fpin, max_len):#{{{
+    """Yield (anno, seq, seqlen) of the records of fpin, seq is the bytes of
+    the residues without white spaces, or None if seqlen is over max_len, in
+    which case the residues are not stored. Text before the first '>' is
+    skipped
+
+    The file is read by blocks, each block is cut at the starts of records,
+    and the sequence lines of a piece are cleaned by one bytes.translate"""
+    rd = None               # [annoli, isHeaderDone, seqli, seqlen]
+    isLineStart = True
+    while True:
+        block = fpin.read(READ_SIZE)
+        if block == b"":
+            break
+        poslist = []
+        if isLineStart and block.startswith(b">"):
+            poslist.append(0)
+        pos = block.find(b"\n>")
+        while pos != -1:
+            poslist.append(pos+1)
+            pos = block.find(b"\n>", pos+1)
+        isLineStart = block.endswith(b"\n")
+        begin = 0
+        for pos in poslist + [len(block)]:
+            piece = block[begin:pos]
+            if rd is not None and piece != b"":
+                if not rd[1]:
+                    idx = piece.find(b"\n")
+                    if idx == -1:
+                        idx = len(piece)
+                    else:
+                        rd[1] = True
+                    if sum(len(x) for x in rd[0]) < MAX_LEN_ANNO:
+                        rd[0].append(piece[:idx])
+                    piece = piece[idx:]
+                piece = piece.translate(None, _DELETE_BYTES)
+                rd[3] += len(piece)
+                if rd[3] <= max_len:
+                    rd[2].append(piece)
+            if pos < len(block):
+                if rd is not None:
+                    yield _GetRecord(rd, max_len)
+                rd = [[], False, [], 0]
+                begin = pos + 1     # skip the '>'
+    if rd is not None:
+        yield _GetRecord(rd, max_len)
+#}}}
+def _GetRecord(rd, max_len):#{{{
+    anno = _RE_NON_ASCII.sub(" ", b"".join(rd[0]).decode("utf-8", "replace"))
+    anno = anno.replace("\x0b", " ").strip()
+    seqlen = rd[3]
+    seq = b"".join(rd[2]) if seqlen <= max_len else None
+    return (anno, seq, seqlen)
+#}}}
+def ValidateSeqFile(infile, outfile, seqinfo, g_params):#{{{
+    """Validate the fasta file infile as webcom.ValidateSeq and write the
+    filtered sequences to outfile. seqinfo gets numseq, isValidSeq, warninfo,
+    errinfo_br, errinfo_content and errinfo
+    return True if the query is valid, outfile is then complete"""
+    for item in ['errinfo_br', 'errinfo', 'errinfo_content', 'warninfo']:
+        if item not in seqinfo:
+            seqinfo[item] = ""
+    li_warn_info = []
+    li_badseq_info = []
+    cntDict = {'empty': 0, 'short': 0, 'long': 0, 'dna': 0, 'warn': 0, 'bad': 0}
+    numseq_in = 0      # valid sequences before the removal of letters
+    numseq_out = 0     # sequences written to outfile
+    isStartWithAnno = None
+    with open(infile, "rb") as fpin:
+        head = fpin.read(READ_SIZE).lstrip()
+        if head != b"":
+            isStartWithAnno = head.startswith(b">")
+        fpin.seek(0)
+        with open(outfile, "w") as fpout:
+            cnt = 0
+            for (anno, seq, seqlen) in _ReadRecord(fpin,
+                    g_params['MAX_LEN_SEQ']):
+                cnt += 1
+                seqid = anno.split()[0] if anno.split() else ""
+                if seqlen == 0:
+                    _AddMessage(li_warn_info, "Empty sequence %s (SeqNo. %d) "
+                            "is removed."%(seqid, cnt), cntDict, 'empty')
+                    continue
+                elif seqlen < g_params['MIN_LEN_SEQ']:
+                    _AddMessage(li_warn_info, "Sequence %s (SeqNo. %d) is removed "
+                            "since its length is < %d."%(seqid, cnt,
+                                g_params['MIN_LEN_SEQ']), cntDict, 'short')
+                    continue
+                elif seq is None:
+                    _AddMessage(li_warn_info, "Sequence %s (SeqNo. %d) is removed "
+                            "since its length is > %d."%(seqid, cnt,
+                                g_params['MAX_LEN_SEQ']), cntDict, 'long')
+                    continue
+                elif myfunc.IsDNASeq(seq.decode("ascii")):
+                    _AddMessage(li_warn_info, "Sequence %s (SeqNo. %d) is removed "
+                            "since it looks like a DNA sequence."%(seqid, cnt),
+                            cntDict, 'dna')
+                    continue
+                numseq_in += 1
+                if numseq_in > g_params['MAX_NUMSEQ_PER_JOB']:
+                    continue    # the query is invalid, only counted
+                seq = seq.upper()
+                # the letters are scanned by the regular expressions only if
+                # there are letters to report
+                if seq.translate(None, _VALID_LETTERS) != b"":
+                    for m in _RE_BAD_LETTER.finditer(seq):
+                        _AddMessage(li_badseq_info, "Bad letter for amino acid in "
+                                "sequence %s (SeqNo. %d) at position %d (letter: '%s')"%(
+                                    seqid, numseq_in, m.start()+1, m.group().decode()),
+                                cntDict, 'bad')
+                if cntDict['bad'] > 0:
+                    continue
+                if seq.translate(None, _STANDARD_LETTERS) != b"":
+                    for (pattern, letter, action) in CONVERSION_LIST:
+                        for m in pattern.finditer(seq):
+                            _AddMessage(li_warn_info, "Amino acid in sequence %s "
+                                    "(SeqNo. %d) at position %d (letter: '%s') %s"%(
+                                        seqid, numseq_in, m.start()+1,
+                                        m.group().decode(), action), cntDict, 'warn')
+                        seq = pattern.sub(letter, seq)
+                if len(seq) < g_params['MIN_LEN_SEQ']:
+                    _AddMessage(li_warn_info, "Sequence %s (SeqNo. %d) is removed "
+                            "since its length is < %d (after removal of "
+                            "non-standard amino acids)."%(seqid, numseq_in,
+                                g_params['MIN_LEN_SEQ']), cntDict, 'short')
+                    continue
+                fpout.write(">%s\n%s\n"%(anno.replace('\t', ' '), seq.decode("ascii")))
+                numseq_out += 1
+
+    num_message = sum(cntDict.values()) - cntDict['bad']
+    if num_message > len(li_warn_info):
+        li_warn_info.append("... and %d more warnings"%(num_message - len(li_warn_info)))
+    seqinfo['isValidSeq'] = True
+    seqinfo['numseq'] = numseq_in
+    if numseq_in < 1:
+        seqinfo['errinfo_br'] += "Number of input sequences is 0!\n"
+        if isStartWithAnno is False:
+            seqinfo['errinfo_content'] += ("Bad input format. The FASTA format "
+                    "should have an annotation line start with '>'.\n")
+        if len(li_warn_info) > 0:
+            seqinfo['errinfo_content'] += "\n".join(li_warn_info) + "\n"
+        if (cntDict['empty'] + cntDict['short'] + cntDict['long'] +
+                cntDict['dna'] == 0):
+            seqinfo['errinfo_content'] += "Please input your sequence in FASTA format"
+        seqinfo['isValidSeq'] = False
+    elif numseq_in > g_params['MAX_NUMSEQ_PER_JOB']:
+        seqinfo['errinfo_br'] += "Number of input sequences exceeds the maximum (%d)!\n"%(
+                g_params['MAX_NUMSEQ_PER_JOB'])
+        seqinfo['errinfo_content'] += ("Your query has %d sequences. However, the "
+                "maximal allowed sequences per job is %d. Please split your "
+                "query into smaller files and submit again.\n"%(numseq_in,
+                    g_params['MAX_NUMSEQ_PER_JOB']))
+        seqinfo['isValidSeq'] = False
+    elif (seqinfo.get('isForceRun', False) and
+            numseq_in > g_params['MAX_NUMSEQ_FOR_FORCE_RUN']):
+        seqinfo['errinfo_br'] += "Invalid input!"
+        seqinfo['errinfo_content'] += ("You have chosen the \"Force Run\" mode. "
+                "The maximum allowable number of sequences of a job is %d. "
+                "However, your input has %d sequences."%(
+                    g_params['MAX_NUMSEQ_FOR_FORCE_RUN'], numseq_in))
+        seqinfo['isValidSeq'] = False
+    elif cntDict['bad'] > 0:
+        if cntDict['bad'] > len(li_badseq_info):
+            li_badseq_info.append("... and %d more bad letters"%(
+                cntDict['bad'] - len(li_badseq_info)))
+        seqinfo['errinfo_br'] += "There are bad letters for amino acids in your query!\n"
+        seqinfo['errinfo_content'] = "\n".join(li_badseq_info) + "\n"
+        seqinfo['isValidSeq'] = False
+    else:
+        seqinfo['numseq'] = numseq_out
+        seqinfo['warninfo'] = "\n".join(li_warn_info) + "\n"
+    seqinfo['errinfo'] = seqinfo['errinfo_br'] + seqinfo['errinfo_content']
+    return seqinfo['isValidSeq']
+#}}}
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Counters and runtime histograms shared by the daemons of the server
+
+    run_job.py and qd_fe.py add to a small sqlite3 database
+      - counter(name, label, value): e.g. the cache hits by source, label is
+        the set of labels in the Prometheus text format, e.g. source="zip"
+      - histogram(name, hour, ...): samples binned by the bounds
+        RUNTIME_BUCKET_BOUNDS per hour, so that quantiles are given for the
+        last hours, histograms older than MAX_KEEP_HOUR are deleted
+    The metrics view reads it with the load file of qd_fe, see
+    GetMetricsText.
+"""
+import time
+import json
+import sqlite3
+
+import phaseprof
+
+RUNTIME_BUCKET_BOUNDS = [1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600,
+        7200, 14400, 28800]
+MAX_KEEP_HOUR = 48
+
+def OpenDB(dbfile):#{{{
+    con = sqlite3.connect(dbfile, timeout=30)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS counter(
+            name TEXT NOT NULL,
+            label TEXT NOT NULL,
+            value REAL NOT NULL,
+            PRIMARY KEY (name, label)
+        )""")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS histogram(
+            name TEXT NOT NULL,
+            hour INTEGER NOT NULL,
+            hist TEXT NOT NULL,
+            PRIMARY KEY (name, hour)
+        )""")
+    con.commit()
+    return con
+#}}}
+def IncCounter(dbfile, counterDict):#{{{
+    """Add counterDict {(name, label): value} to the counters"""
+    if len(counterDict) == 0:
+        return
+    con = OpenDB(dbfile)
+    try:
+        with con:
+            for ((name, label), value) in counterDict.items():
+                con.execute("INSERT OR IGNORE INTO counter(name, label, value) "
+                        "VALUES (?, ?, 0)", (name, label))
+                con.execute("UPDATE counter SET value = value + ? WHERE name = ? "
+                        "AND label = ?", (value, name, label))
+    finally:
+        con.close()
+#}}}
+def AddSample(dbfile, name, valuelist):#{{{
+    """Add the samples in valuelist to the histogram of the current hour"""
+    if len(valuelist) == 0:
+        return
+    hour = int(time.time()//3600)
+    con = OpenDB(dbfile)
+    try:
+        with con:
+            row = con.execute("SELECT hist FROM histogram WHERE name = ? AND "
+                    "hour = ?", (name, hour)).fetchone()
+            if row is None:
+                hist = phaseprof.NewHistogram(RUNTIME_BUCKET_BOUNDS)
+            else:
+                hist = json.loads(row[0])
+            for value in valuelist:
+                phaseprof.AddToHistogram(hist, value, RUNTIME_BUCKET_BOUNDS)
+            con.execute("INSERT OR REPLACE INTO histogram(name, hour, hist) "
+                    "VALUES (?, ?, ?)", (name, hour, json.dumps(hist)))
+            con.execute("DELETE FROM histogram WHERE hour < ?",
+                    (hour - MAX_KEEP_HOUR,))
+    finally:
+        con.close()
+#}}}
+def ReadCounter(dbfile):#{{{
+    """Return a sorted list of (name, label, value)"""
+    con = OpenDB(dbfile)
+    try:
+        return con.execute("SELECT name, label, value FROM counter "
+                "ORDER BY name, label").fetchall()
+    finally:
+        con.close()
+#}}}
+def ReadHistogram(dbfile, num_hour):#{{{
+    """Return {name: histogram} merged over the last num_hour hours"""
+    histDict = {}
+    con = OpenDB(dbfile)
+    try:
+        for (name, text) in con.execute("SELECT name, hist FROM histogram "
+                "WHERE hour > ?", (int(time.time()//3600) - num_hour,)):
+            if name not in histDict:
+                histDict[name] = phaseprof.NewHistogram(RUNTIME_BUCKET_BOUNDS)
+            phaseprof.MergeHistogram(histDict[name], json.loads(text))
+    finally:
+        con.close()
+    return histDict
+#}}}
+def _FormatLabel(labelDict):#{{{
+    if len(labelDict) == 0:
+        return ""
+    li = []
+    for key in sorted(labelDict.keys()):
+        value = str(labelDict[key]).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        li.append('%s="%s"'%(key, value))
+    return "{%s}"%(",".join(li))
+#}}}
+def _AddMetric(lines, name, mtype, helpstr, samplelist):#{{{
+    """samplelist is a list of (labelDict, value), values of None are skipped"""
+    samplelist = [(labelDict, value) for (labelDict, value) in samplelist
+            if value is not None]
+    if len(samplelist) == 0:
+        return
+    lines.append("# HELP %s %s"%(name, helpstr))
+    lines.append("# TYPE %s %s"%(name, mtype))
+    for (labelDict, value) in samplelist:
+        lines.append("%s%s %s"%(name, _FormatLabel(labelDict), repr(float(value))))
+#}}}
+def _AddSummary(lines, name, helpstr, histDict, labelname, bounds):#{{{
+    """Add the quantiles 0.5 and 0.95, the sum and the count of the
+    histograms in histDict {labelvalue: histogram}"""
+    if len(histDict) == 0:
+        return
+    lines.append("# HELP %s %s"%(name, helpstr))
+    lines.append("# TYPE %s summary"%(name))
+    for key in sorted(histDict.keys()):
+        hist = histDict[key]
+        for q in [0.5, 0.95]:
+            value = phaseprof.GetQuantile(hist, q, bounds)
+            if value is not None:
+                lines.append("%s%s %s"%(name, _FormatLabel({labelname: key,
+                    'quantile': str(q)}), repr(float(value))))
+        lines.append("%s_sum%s %s"%(name, _FormatLabel({labelname: key}),
+            repr(float(hist['sum']))))
+        lines.append("%s_count%s %d"%(name, _FormatLabel({labelname: key}),
+            hist['count']))
+#}}}
+def GetMetricsText(dbfile, loadDict, phaseStatDict, num_hour=24):#{{{
+    """Return the metrics in the Prometheus text format
+    loadDict:      the load written by qd_fe (see admission.py) or None
+    phaseStatDict: {worker: the stats written by phaseprof.EndLoop}"""
+    lines = []
+    if loadDict is not None:
+        _AddMetric(lines, "prodres_queue_jobs", "gauge",
+                "Number of jobs queued or running", [({}, loadDict.get('num_job'))])
+        _AddMetric(lines, "prodres_queue_remaining_seqs", "gauge",
+                "Number of sequences of queued or running jobs not finished",
+                [({}, loadDict.get('remaining_numseq'))])
+        _AddMetric(lines, "prodres_node_running_seqs", "gauge",
+                "Number of sequences in the queue of the compute node",
+                [({'node': node}, value) for (node, value) in
+                    sorted(loadDict.get('numseq_in_node', {}).items())])
+        throughput = loadDict.get('throughput')
+        _AddMetric(lines, "prodres_completed_seqs_per_minute", "gauge",
+                "Measured number of sequences finished per minute",
+                [({}, None if throughput is None else throughput*60)])
+        _AddMetric(lines, "prodres_estimated_wait_seconds", "gauge",
+                "Estimated waiting time of a new job", [({}, loadDict.get('est_wait'))])
+        _AddMetric(lines, "prodres_load_age_seconds", "gauge",
+                "Time since the load was written by qd_fe",
+                [({}, time.time() - loadDict.get('update_epoch', 0))])
+
+    counterDict = {}
+    for (name, label, value) in ReadCounter(dbfile):
+        if name not in counterDict:
+            counterDict[name] = []
+        counterDict[name].append((label, value))
+    for (name, helpstr) in [
+            ("cache_hits", "Number of sequences with results found in the cache"),
+            ("cache_misses", "Number of sequences not found in the cache")]:
+        if name in counterDict:
+            lines.append("# HELP prodres_%s_total %s"%(name, helpstr))
+            lines.append("# TYPE prodres_%s_total counter"%(name))
+            for (label, value) in counterDict[name]:
+                lines.append("prodres_%s_total%s %s"%(name,
+                    "" if label == "" else "{%s}"%(label), repr(float(value))))
+
+    seqHistDict = ReadHistogram(dbfile, num_hour)
+    histDict = dict([(name.split(":", 1)[1], hist) for (name, hist) in
+        seqHistDict.items() if name.startswith("seq_runtime:")])
+    _AddSummary(lines, "prodres_seq_runtime_seconds",
+            "Runtime of a sequence in the last %d hours"%(num_hour), histDict,
+            "location", RUNTIME_BUCKET_BOUNDS)
+    histDict = dict([(name.split(":", 1)[1], hist) for (name, hist) in
+        seqHistDict.items() if name.startswith("seq_turnaround:")])
+    _AddSummary(lines, "prodres_seq_turnaround_seconds",
+            "Time from the submission of a sequence to a node to the retrieval "
+            "of its result in the last %d hours"%(num_hour), histDict,
+            "location", RUNTIME_BUCKET_BOUNDS)
+
+    loopHistDict = {}
+    lastLoopList = []
+    for worker in sorted(phaseStatDict.keys()):
+        statDict = phaseStatDict[worker]
+        hist = phaseprof.NewHistogram(statDict['bucket_bounds'])
+        for window in ['previous', 'current']:
+            if 'loop' in statDict[window]:
+                phaseprof.MergeHistogram(hist, statDict[window]['loop'])
+        loopHistDict[worker] = hist
+        lastLoopList.append(({'worker': worker}, statDict['last_loop'].get('loop')))
+    _AddMetric(lines, "prodres_qd_fe_last_loop_seconds", "gauge",
+            "Duration of the last loop of qd_fe", lastLoopList)
+    if len(loopHistDict) > 0:
+        _AddSummary(lines, "prodres_qd_fe_loop_seconds",
+                "Duration of the loops of qd_fe in the last two windows",
+                loopHistDict, "worker", phaseStatDict[sorted(phaseStatDict.keys())[0]]['bucket_bounds'])
+    return "\n".join(lines) + "\n"
+#}}}
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Speculative re-execution of straggler sequences in the remote queue
+
+    The run time of a sequence, as recorded by the remote node in
+    finished_seqs.txt, is learned by method (second_method of the job) and
+    sequence length bin. The time a sequence waits in the queue of a node
+    before it is started is learned per node, as the time from the
+    submission to the retrieval of the result less the run time. A sequence
+    whose elapsed time less the queue wait of its node exceeds the predicted
+    run time, see IsStraggler, is submitted again to another node. The pair
+    is kept in the table speculative until one of the two has finished
+      - if the duplicate finishes first, the entry of the sequence in
+        remotequeue_seqindex.txt is switched to the duplicate, so that
+        GetResult of qd_fe_common fetches its result, and the original is
+        discarded
+      - if the original finishes first, the duplicate is discarded
+    A discarded job is deleted on its node by the deletejob service, which
+    only removes its result folder, the node API cannot cancel the Slurm job,
+    so a job already running is not stopped and keeps its slot until it ends.
+"""
+import os
+import time
+import math
+import sqlite3
+
+QUEUEWAIT_WINDOW = 50   # the queue wait is averaged over about this many sequences
+
+def OpenDB(dbfile):#{{{
+    con = sqlite3.connect(dbfile, timeout=30)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS runtime(
+            method TEXT NOT NULL,
+            lenbin INTEGER NOT NULL,
+            num INTEGER NOT NULL,
+            mean REAL NOT NULL,
+            m2 REAL NOT NULL,
+            PRIMARY KEY (method, lenbin)
+        )""")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS queuewait(
+            node TEXT PRIMARY KEY,
+            num INTEGER NOT NULL,
+            mean REAL NOT NULL
+        )""")
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS speculative(
+            jobid TEXT NOT NULL,
+            seqindex INTEGER NOT NULL,
+            orig_node TEXT NOT NULL,
+            orig_remotejobid TEXT NOT NULL,
+            spec_node TEXT NOT NULL,
+            spec_remotejobid TEXT NOT NULL,
+            start_epoch REAL NOT NULL,
+            is_switched INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (jobid, seqindex)
+        )""")
+    con.commit()
+    return con
+#}}}
+def GetMethod(query_para):#{{{
+    """Return the method of the job used as the key of the runtime model"""
+    try:
+        method = query_para['second_method']
+    except (KeyError, TypeError):
+        method = ""
+    if method == "":
+        method = "default"
+    return method
+#}}}
+def GetLengthBin(length):#{{{
+    """Sequence lengths are binned by powers of two, <=64, 65-128, ..."""
+    return max(6, int(math.ceil(math.log(max(1, length), 2))))
+#}}}
+def AddRuntime(dbfile, method, length, runtime):#{{{
+    """Add an observed run time on a remote node to the model, the mean and
+    the variance are updated by the Welford algorithm"""
+    lenbin = GetLengthBin(length)
+    con = OpenDB(dbfile)
+    try:
+        with con:
+            row = con.execute("SELECT num, mean, m2 FROM runtime WHERE method = ? "
+                    "AND lenbin = ?", (method, lenbin)).fetchone()
+            if row is None:
+                (num, mean, m2) = (0, 0.0, 0.0)
+            else:
+                (num, mean, m2) = row
+            num += 1
+            delta = runtime - mean
+            mean += delta/num
+            m2 += delta*(runtime - mean)
+            con.execute("INSERT OR REPLACE INTO runtime(method, lenbin, num, mean, m2) "
+                    "VALUES (?, ?, ?, ?, ?)", (method, lenbin, num, mean, m2))
+    finally:
+        con.close()
+#}}}
+def PredictRuntime(dbfile, method, length, min_sample):#{{{
+    """Return (mean, std) of the run time for the method and the length, or
+    None if fewer than min_sample observations are available"""
+    lenbin = GetLengthBin(length)
+    con = OpenDB(dbfile)
+    try:
+        row = con.execute("SELECT num, mean, m2 FROM runtime WHERE method = ? "
+                "AND lenbin = ?", (method, lenbin)).fetchone()
+    finally:
+        con.close()
+    if row is None or row[0] < max(2, min_sample):
+        return None
+    (num, mean, m2) = row
+    return (mean, math.sqrt(m2/(num-1)))
+#}}}
+def GetMeanRuntime(dbfile, default):#{{{
+    """Return the mean run time over all methods and lengths, or default if
+    nothing has been observed"""
+    con = OpenDB(dbfile)
+    try:
+        row = con.execute("SELECT SUM(num), SUM(num*mean) FROM runtime").fetchone()
+    finally:
+        con.close()
+    if row is None or not row[0]:
+        return default
+    return row[1]/row[0]
+#}}}
+def AddQueueWait(dbfile, node, wait):#{{{
+    """Add an observed queue wait on the node, the mean follows the last
+    QUEUEWAIT_WINDOW observations"""
+    con = OpenDB(dbfile)
+    try:
+        with con:
+            row = con.execute("SELECT num, mean FROM queuewait WHERE node = ?",
+                    (node,)).fetchone()
+            (num, mean) = (0, 0.0) if row is None else row
+            num += 1
+            mean += (wait - mean)/min(num, QUEUEWAIT_WINDOW)
+            con.execute("INSERT OR REPLACE INTO queuewait(node, num, mean) "
+                    "VALUES (?, ?, ?)", (node, num, mean))
+    finally:
+        con.close()
+#}}}
+def GetQueueWait(dbfile, node):#{{{
+    """Return the mean queue wait on the node, 0 if nothing has been observed"""
+    con = OpenDB(dbfile)
+    try:
+        row = con.execute("SELECT mean FROM queuewait WHERE node = ?",
+                (node,)).fetchone()
+    finally:
+        con.close()
+    if row is None:
+        return 0.0
+    return row[0]
+#}}}
+def IsStraggler(elapsed, prediction, g_params):#{{{
+    """A sequence is a straggler if its elapsed run time exceeds SPEC_FACTOR
+    times the predicted mean, mean+SPEC_NUM_STD*std and SPEC_MIN_TIME"""
+    if prediction is None:
+        return False
+    (mean, std) = prediction
+    threshold = max(g_params['SPEC_MIN_TIME'], mean*g_params['SPEC_FACTOR'],
+            mean + g_params['SPEC_NUM_STD']*std)
+    return elapsed > threshold
+#}}}
+def ReadRemoteQueueEntry(remotequeue_idx_file):#{{{
+    """Read remotequeue_seqindex.txt
+    return a list of (seqindex, node, remotejobid, description, seq)"""
+    li = []
+    try:
+        fpin = open(remotequeue_idx_file, "r")
+    except IOError:
+        return li
+    with fpin:
+        for line in fpin:
+            strs = line.rstrip("\n").split('\t')
+            if len(strs) >= 5:
+                try:
+                    seqindex = int(strs[0])
+                except ValueError:
+                    continue
+                li.append((seqindex, strs[1], strs[2], strs[3], strs[4]))
+    return li
+#}}}
+def SwitchRemoteQueueEntry(remotequeue_idx_file, seqindex, orig, spec):#{{{
+    """Replace the (node, remotejobid) of the sequence from orig to spec in
+    remotequeue_seqindex.txt, the file is replaced atomically
+    return True if the entry was found"""
+    isFound = False
+    lines = []
+    try:
+        fpin = open(remotequeue_idx_file, "r")
+    except IOError:
+        return False
+    with fpin:
+        for line in fpin:
+            strs = line.split('\t')
+            if (len(strs) >= 5 and strs[0] == str(seqindex) and
+                    (strs[1], strs[2]) == orig):
+                strs[1] = spec[0]
+                strs[2] = spec[1]
+                line = "\t".join(strs)
+                isFound = True
+            lines.append(line)
+    if isFound:
+        tmpfile = "%s.tmp.%d"%(remotequeue_idx_file, os.getpid())
+        with open(tmpfile, "w") as fpout:
+            fpout.write("".join(lines))
+        os.rename(tmpfile, remotequeue_idx_file)
+    return isFound
+#}}}
+def GetSpeculativeList(dbfile, jobid=None):#{{{
+    """Return a list of (jobid, seqindex, orig_node, orig_remotejobid,
+    spec_node, spec_remotejobid, start_epoch, is_switched)"""
+    con = OpenDB(dbfile)
+    try:
+        if jobid is None:
+            return con.execute("SELECT * FROM speculative").fetchall()
+        else:
+            return con.execute("SELECT * FROM speculative WHERE jobid = ?",
+                    (jobid,)).fetchall()
+    finally:
+        con.close()
+#}}}
+def AddSpeculative(dbfile, jobid, seqindex, orig, spec):#{{{
+    con = OpenDB(dbfile)
+    try:
+        with con:
+            con.execute("INSERT OR REPLACE INTO speculative(jobid, seqindex, "
+                    "orig_node, orig_remotejobid, spec_node, spec_remotejobid, "
+                    "start_epoch) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (jobid, seqindex, orig[0], orig[1], spec[0], spec[1], time.time()))
+    finally:
+        con.close()
+#}}}
+def SetSwitched(dbfile, jobid, seqindex):#{{{
+    con = OpenDB(dbfile)
+    try:
+        with con:
+            con.execute("UPDATE speculative SET is_switched = 1 WHERE jobid = ? "
+                    "AND seqindex = ?", (jobid, seqindex))
+    finally:
+        con.close()
+#}}}
+def DeleteSpeculative(dbfile, jobid, seqindex=None):#{{{
+    con = OpenDB(dbfile)
+    try:
+        with con:
+            if seqindex is None:
+                con.execute("DELETE FROM speculative WHERE jobid = ?", (jobid,))
+            else:
+                con.execute("DELETE FROM speculative WHERE jobid = ? AND seqindex = ?",
+                        (jobid, seqindex))
+    finally:
+        con.close()
+#}}}
+def CleanSpeculative(dbfile, jobidset):#{{{
+    """Delete records of jobs that are no longer in the queue
+    return the deleted records"""
+    con = OpenDB(dbfile)
+    try:
+        with con:
+            staleli = [row for row in con.execute("SELECT * FROM speculative")
+                    if row[0] not in jobidset]
+            con.executemany("DELETE FROM speculative WHERE jobid = ? AND seqindex = ?",
+                    [(row[0], row[1]) for row in staleli])
+    finally:
+        con.close()
+    return staleli
+#}}}
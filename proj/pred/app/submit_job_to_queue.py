@@ -8,26 +8,49 @@
 # ChangeLog 2015-04-15 
 #   1. if suq submit failed, try MAX_TRY times, sleep 0.05 second for the next
 #   try
+# ChangeLog 2026-10-19
+#   1. priority is obtained from the weighted fair-share state kept by qd_fe,
+#   see fairshare.py, users in config/vip_email.txt have a higher weight. It is
+#   given to Slurm as the nice of the job (#SBATCH --nice in the script)
+#
+# The views import SubmitJobToQueue instead of running this script, and may
+# hand the submission over to the submission worker thread of the web process
+# (SubmitJobToQueueAsync), the script is kept for the command line
+#
+# A submission handed over to the worker thread is recorded in the file
+# submit.pending of the result folder until it is done, so that it is not
+# lost if the web process is recycled before. The leader of qd_fe submits
+# the jobs with a pending file older than SUBMIT_PENDING_TIMEOUT
+# (SubmitPending). The file is claimed by a rename before the submission,
+# so that a job is submitted either by the worker thread or by qd_fe
 import os
 import sys
 import subprocess
 import time
 import math
+import queue
+import threading
 from libpredweb import myfunc
 from libpredweb import webserver_common as webcom
 import json
+import fairshare
 progname =  os.path.basename(__file__)
 wspace = ''.join([" "]*len(progname))
 
-vip_user_list = [
-        "nanjiang.shu@scilifelab.se"
-        ]
-
 rundir = os.path.dirname(os.path.realpath(__file__))
 basedir = os.path.realpath("%s/../"%(rundir))
 python_exec = "python"
 virt_env_path = os.path.realpath("%s/../../env"%(basedir))   
 gen_errfile = "%s/static/log/%s.log"%(basedir, progname)
+vip_email_file = "%s/config/vip_email.txt"%(basedir)
+fairshare_db = "%s/static/log/fairshare.sqlite3"%(basedir)
+
+PENDING_FILE = "submit.pending"
+SUBMIT_PENDING_TIMEOUT = 300    # seconds before qd_fe takes over a pending submission
+
+g_submitqueue = queue.Queue()   # submissions waiting for the worker thread
+g_worker_lock = threading.Lock()
+g_worker = {'thread': None}
 
 usage_short="""
 Usage: %s -nseq INT -jobid STR -outpath DIR -datapath DIR
@@ -63,9 +86,11 @@ def PrintHelp(fpout=sys.stdout):#{{{
     print(usage_exp, file=fpout)#}}}
 
 def SubmitJobToQueue(jobid, datapath, outpath, numseq, numseq_this_user, email, #{{{
-        host_ip, base_www_url):
-    myfunc.WriteFile("Entering SubmitJobToQueue()\n", g_params['debugfile'],
-            "a", True)
+        host_ip, base_www_url, isForceRun=False, isOnlyGetCache=False):
+    """Write the script running the job and submit it to the local queue,
+    return 0 on success"""
+    debugfile = "%s/debug.log"%(outpath)
+    myfunc.WriteFile("Entering SubmitJobToQueue()\n", debugfile, "a", True)
     fafile = "%s/query.fa"%(datapath)
 
     if numseq == -1:
@@ -86,42 +111,134 @@ def SubmitJobToQueue(jobid, datapath, outpath, numseq, numseq_this_user, email,
     except KeyError:
         name_software = "prodres"
 
+    webcom.loginfo("Getting priority", debugfile)
+    user = fairshare.GetUserKey(email, host_ip)
+    weightDict = fairshare.ReadUserWeight(vip_email_file, fairshare.VIP_WEIGHT)
+    userlist = list(set(fairshare.GetActiveUserList(fairshare_db) + [user]))
+    factorDict = fairshare.GetFairShareFactor(fairshare_db, userlist,
+            weightDict, fairshare.HALF_LIFE)
+    (weight, factor) = factorDict[user]
+    priority = fairshare.GetPriority(weight, factor, numseq_this_user)
+
+    webcom.loginfo("priority=%d (user=%s, weight=%g, fairshare_factor=%g)"%(
+        priority, user, weight, factor), debugfile)
+    nice = fairshare.GetSlurmNice(priority)
+
     runjob = "%s %s/run_job.py"%(python_exec, rundir)
     scriptfile = "%s/runjob,%s,%s,%s,%s,%d.sh"%(outpath, name_software, jobid, host_ip, email, numseq)
     code_str_list = []
     code_str_list.append("#!/bin/bash")
+    code_str_list.append("#SBATCH --nice=%d"%(nice))
     code_str_list.append("source %s/bin/activate"%(virt_env_path))
     cmdline = "%s %s -outpath %s -tmpdir %s -jobid %s "%(runjob, fafile, outpath, datapath, jobid)
     if email != "":
         cmdline += "-email \"%s\" "%(email)
     if base_www_url != "":
         cmdline += "-baseurl \"%s\" "%(base_www_url)
-    if g_params['isForceRun']:
+    if isForceRun:
         cmdline += "-force "
-    if g_params['isOnlyGetCache']:
+    if isOnlyGetCache:
         cmdline += "-only-get-cache "
     code_str_list.append(cmdline)
 
     code = "\n".join(code_str_list)
 
     msg = "Writting scriptfile %s"%(scriptfile)
-    webcom.loginfo(msg, g_params['debugfile'])
+    webcom.loginfo(msg, debugfile)
 
     myfunc.WriteFile(code, scriptfile, mode="w", isFlush=True)
     os.chmod(scriptfile, 0o755)
 
-    webcom.loginfo("Getting priority", g_params['debugfile'])
-    priority = myfunc.GetSuqPriority(numseq_this_user)
-
-    if email in vip_user_list:
-        priority = 999999999.0
-
-    webcom.loginfo("priority=%d"%(priority), g_params['debugfile'])
-
-    st1 = webcom.SubmitSlurmJob(datapath, outpath, scriptfile, g_params['debugfile'])
+    st1 = webcom.SubmitSlurmJob(datapath, outpath, scriptfile, debugfile)
 
     return st1
 #}}}
+def WritePending(outpath, args, kwargs):#{{{
+    """Record the arguments of SubmitJobToQueue in the pending file of the
+    result folder outpath, return the pending file"""
+    pendingfile = "%s/%s"%(outpath, PENDING_FILE)
+    tmpfile = "%s.tmp"%(pendingfile)
+    with open(tmpfile, "w") as fpout:
+        json.dump({'args': list(args), 'kwargs': kwargs}, fpout)
+    os.rename(tmpfile, pendingfile)
+    return pendingfile
+#}}}
+def ClaimPending(pendingfile):#{{{
+    """Take the pending submission over by renaming the pending file
+    return (args, kwargs, claimedfile), or None if it has been claimed by
+    another process"""
+    claimedfile = "%s.claimed.%d.%d"%(pendingfile, os.getpid(),
+            threading.get_ident())
+    try:
+        os.rename(pendingfile, claimedfile)
+    except OSError:
+        return None
+    try:
+        with open(claimedfile, "r") as fpin:
+            content = json.load(fpin)
+    except (IOError, ValueError):
+        os.remove(claimedfile)
+        return None
+    return (tuple(content['args']), content['kwargs'], claimedfile)
+#}}}
+def SubmitPending(outpath, timeout=SUBMIT_PENDING_TIMEOUT):#{{{
+    """Submit the job of the result folder outpath if its submission has been
+    pending for longer than timeout, e.g. the web process was recycled
+    return the status of SubmitJobToQueue, or None if nothing was submitted"""
+    pendingfile = "%s/%s"%(outpath, PENDING_FILE)
+    try:
+        if time.time() - os.path.getmtime(pendingfile) <= timeout:
+            return None
+    except OSError:
+        return None
+    rd = ClaimPending(pendingfile)
+    if rd is None:
+        return None
+    (args, kwargs, claimedfile) = rd
+    try:
+        return SubmitJobToQueue(*args, **kwargs)
+    finally:
+        os.remove(claimedfile)
+#}}}
+def _RunWorker():#{{{
+    """Submit the jobs handed over by SubmitJobToQueueAsync one by one"""
+    while True:
+        (pendingfile, callback) = g_submitqueue.get()
+        jobid = os.path.basename(os.path.dirname(pendingfile))
+        try:
+            rd = ClaimPending(pendingfile)
+            if rd is None:
+                continue    # submitted by qd_fe
+            (args, kwargs, claimedfile) = rd
+            try:
+                status = SubmitJobToQueue(*args, **kwargs)
+            except Exception as e:
+                webcom.loginfo("SubmitJobToQueue(%s) failed with errmsg=%s"%(
+                    jobid, str(e)), gen_errfile)
+                status = 1
+            os.remove(claimedfile)
+            if callback is not None:
+                callback(status)
+        except Exception as e:
+            webcom.loginfo("callback of SubmitJobToQueue(%s) failed with errmsg=%s"%(
+                jobid, str(e)), gen_errfile)
+        finally:
+            g_submitqueue.task_done()
+#}}}
+def SubmitJobToQueueAsync(callback, *args, **kwargs):#{{{
+    """Hand the submission over to the worker thread of the process, which
+    runs SubmitJobToQueue(*args, **kwargs) and then callback(status) if
+    callback is not None. The worker is started at the first call. The
+    submission is recorded in the pending file of the result folder, args[2]"""
+    pendingfile = WritePending(args[2], args, kwargs)
+    with g_worker_lock:
+        if g_worker['thread'] is None or not g_worker['thread'].is_alive():
+            th = threading.Thread(target=_RunWorker, name="submit_job_to_queue")
+            th.daemon = True
+            th.start()
+            g_worker['thread'] = th
+    g_submitqueue.put((pendingfile, callback))
+#}}}
 def main(g_params):#{{{
     argv = sys.argv
     numArgv = len(argv)
@@ -211,11 +328,10 @@ def main(g_params):#{{{
         webcom.loginfo("%s: file %s/query.fa does not exist. exit"%(sys.argv[0], datapath), gen_errfile)
         return 1
 
-    g_params['debugfile'] = "%s/debug.log"%(outpath)
-
-    webcom.loginfo("Go to SubmitJobToQueue()", g_params['debugfile'])
+    webcom.loginfo("Go to SubmitJobToQueue()", "%s/debug.log"%(outpath))
     return SubmitJobToQueue(jobid, datapath, outpath, numseq, numseq_this_user,
-            email, host_ip, base_www_url)
+            email, host_ip, base_www_url, isForceRun=g_params['isForceRun'],
+            isOnlyGetCache=g_params['isOnlyGetCache'])
 
 #}}}
 
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Test the expiry index: the folders removed by ReapExpired, the retry of
+    a failed removal (DelayItem) and the backfill from the result folders
+
+Usage: python -m pytest test_expiry.py
+       python -m unittest test_expiry
+"""
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import expiry
+import jobcatalog
+
+MAX_KEEP_DAYS = 30
+
+class TestExpiry(unittest.TestCase):#{{{
+    def setUp(self):
+        self.tmpdir = os.path.realpath(tempfile.mkdtemp(prefix="test_expiry_"))
+        self.path_result = "%s/result"%(self.tmpdir)
+        self.path_tmp = "%s/tmp"%(self.tmpdir)
+        self.path_cache = "%s/cache"%(self.path_result)
+        for path in [self.path_result, self.path_tmp, self.path_cache]:
+            os.makedirs(path)
+        self.dbfile = "%s/expiry.sqlite3"%(self.tmpdir)
+        self.jobcatalog_db = "%s/jobcatalog.sqlite3"%(self.tmpdir)
+        self.g_params = {'path_result': self.path_result,
+                'path_tmp': self.path_tmp, 'path_cache': self.path_cache,
+                'jobcatalog_db': self.jobcatalog_db,
+                'MAX_KEEP_DAYS': MAX_KEEP_DAYS, 'REAPER_BATCH_SIZE': 100,
+                'REAPER_RETRY_DELAY': 3600}
+        self.old_epoch = time.time() - (MAX_KEEP_DAYS+1)*86400
+        expiry.IsAnyDeleted()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def MakeDir(self, path):
+        os.makedirs(path)
+        with open("%s/query.fa"%(path), "w") as fpout:
+            fpout.write(">a\nMKV\n")
+        return path
+
+    def test_reap_roots(self):
+        # only the folders under path_result or path_tmp are removed, never
+        # the roots themselves or path_cache
+        outside = self.MakeDir("%s/outside/rst_x"%(self.tmpdir))
+        inside = self.MakeDir("%s/rst_a"%(self.path_result))
+        tmpdir = self.MakeDir("%s/tmp_b"%(self.path_tmp))
+        prefix = self.MakeDir("%s_other/rst_c"%(self.path_result))
+        pathlist = [outside, inside, tmpdir, prefix, self.path_result,
+                self.path_tmp, self.path_cache]
+        for path in pathlist:
+            expiry.AddItem(self.dbfile, path, self.old_epoch)
+        jobcatalog.AddJob(self.jobcatalog_db, "rst_a", "2020-01-01 10:00:00",
+                1, "", "", "", "web")
+        self.assertEqual(expiry.ReapExpired(self.dbfile, self.g_params), len(pathlist))
+        self.assertFalse(os.path.exists(inside))
+        self.assertFalse(os.path.exists(tmpdir))
+        for path in [outside, prefix, self.path_result, self.path_tmp,
+                self.path_cache]:
+            self.assertTrue(os.path.isdir(path), path)
+        # the items are done, also those never to be removed
+        self.assertEqual(expiry.GetExpiredList(self.dbfile, MAX_KEEP_DAYS, 100), [])
+        self.assertEqual(jobcatalog.GetStatus(self.jobcatalog_db, ["rst_a"]), {})
+        self.assertTrue(expiry.IsAnyDeleted())
+        self.assertFalse(expiry.IsAnyDeleted())
+
+    def test_not_expired(self):
+        path = self.MakeDir("%s/rst_a"%(self.path_result))
+        expiry.AddItem(self.dbfile, path)
+        self.assertEqual(expiry.ReapExpired(self.dbfile, self.g_params), 0)
+        self.assertTrue(os.path.isdir(path))
+
+    def test_failed_removal(self):
+        # a folder not removed is kept and tried again REAPER_RETRY_DELAY
+        # seconds later, the other items are not held back
+        patha = self.MakeDir("%s/rst_a"%(self.path_result))
+        pathb = self.MakeDir("%s/rst_b"%(self.path_result))
+        expiry.AddItem(self.dbfile, patha, self.old_epoch - 1)
+        expiry.AddItem(self.dbfile, pathb, self.old_epoch)
+        with mock.patch("shutil.rmtree"):
+            self.assertEqual(expiry.ReapExpired(self.dbfile,
+                dict(self.g_params, REAPER_BATCH_SIZE=1)), 1)
+        self.assertTrue(os.path.isdir(patha))
+        self.assertEqual(expiry.GetExpiredList(self.dbfile, MAX_KEEP_DAYS, 100), [pathb])
+        self.assertEqual(expiry.GetExpiredList(self.dbfile,
+            MAX_KEEP_DAYS - 2.0/24, 100), [pathb, patha])
+        expiry.ReapExpired(self.dbfile, self.g_params)
+        self.assertFalse(os.path.exists(pathb))
+
+    def test_delay_item(self):
+        path = "%s/rst_a"%(self.path_result)
+        expiry.AddItem(self.dbfile, path, self.old_epoch)
+        expiry.DelayItem(self.dbfile, [path], MAX_KEEP_DAYS, 60)
+        self.assertEqual(expiry.GetExpiredList(self.dbfile, MAX_KEEP_DAYS, 100), [])
+        self.assertEqual(expiry.GetExpiredList(self.dbfile,
+            MAX_KEEP_DAYS - 120.0/86400, 100), [path])
+
+    def test_backfill(self):
+        # the finished and failed folders existing when the index is created
+        # are added once, the running ones are not
+        logfile = "%s/finished_job.log"%(self.tmpdir)
+        for (name, tag, content) in [
+                ("rst_a", "runjob.finish", "2020-01-01 10:00:00 CET"),
+                ("rst_b", "runjob.failed", ""),
+                ("rst_c", "runjob.start", "2020-01-01 10:00:00 CET")]:
+            self.MakeDir("%s/%s"%(self.path_result, name))
+            with open("%s/%s/%s"%(self.path_result, name, tag), "w") as fpout:
+                fpout.write(content)
+        self.assertEqual(expiry.UpdateFromFinishedLog(self.dbfile, logfile,
+            self.path_result), 2)
+        self.assertEqual(expiry.GetExpiredList(self.dbfile, MAX_KEEP_DAYS, 100),
+                ["%s/rst_a"%(self.path_result)])
+        self.assertEqual(expiry.GetExpiredList(self.dbfile, -1, 100),
+                ["%s/rst_a"%(self.path_result), "%s/rst_b"%(self.path_result)])
+        self.MakeDir("%s/rst_d"%(self.path_result))
+        with open("%s/rst_d/runjob.finish"%(self.path_result), "w") as fpout:
+            fpout.write("2020-01-01 10:00:00 CET")
+        self.assertEqual(expiry.UpdateFromFinishedLog(self.dbfile, logfile,
+            self.path_result), 0)
+#}}}
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Test the registry of the sequences being computed: Acquire and Release
+    by concurrent processes, as run_job.py runs them, and the claims of the
+    keys dispatched by qd_fe
+
+Usage: python -m pytest test_inflight.py
+       python -m unittest test_inflight
+"""
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+
+import inflight
+
+MD5_KEY = "0123456789abcdef0123456789abcdef"
+
+def _TryOnce(path_inflight, idx, startEvent, holdEvent, resultQueue):#{{{
+    startEvent.wait()
+    (fp, owner_path) = inflight.Acquire(path_inflight, MD5_KEY, "job_%d"%(idx))
+    resultQueue.put(fp is not None)
+    if fp is not None:
+        holdEvent.wait()
+        inflight.Release(fp)
+#}}}
+def _Compute(path_inflight, idx, num_round, tracefile):#{{{
+    """Acquire the key num_round times and write the entry and the exit to
+    tracefile while holding it"""
+    for i in range(num_round):
+        (fp, owner_path) = inflight.Acquire(path_inflight, MD5_KEY,
+                "job_%d"%(idx), timeout=60)
+        if fp is None:
+            continue
+        with open(tracefile, "a") as fpout:
+            fpout.write("enter %d\n"%(idx))
+        time.sleep(0.001)
+        with open(tracefile, "a") as fpout:
+            fpout.write("exit %d\n"%(idx))
+        inflight.Release(fp)
+#}}}
+def _Claim(dbfile, jobid, keyli, resultQueue):#{{{
+    resultQueue.put((jobid, inflight.Claim(dbfile, jobid, keyli)))
+#}}}
+
+class TestAcquireRelease(unittest.TestCase):#{{{
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="test_inflight_")
+        self.path_inflight = "%s/inflight"%(self.tmpdir)
+        self.ctx = multiprocessing.get_context("fork")
+        self.poll_interval = inflight.POLL_INTERVAL
+        inflight.POLL_INTERVAL = 0.01
+
+    def tearDown(self):
+        inflight.POLL_INTERVAL = self.poll_interval
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_one_holder(self):
+        # of the processes trying at the same time exactly one gets the key
+        num_proc = 8
+        startEvent = self.ctx.Event()
+        holdEvent = self.ctx.Event()
+        resultQueue = self.ctx.Queue()
+        proclist = [self.ctx.Process(target=_TryOnce, args=(self.path_inflight,
+            idx, startEvent, holdEvent, resultQueue)) for idx in range(num_proc)]
+        for proc in proclist:
+            proc.start()
+        startEvent.set()
+        resultli = [resultQueue.get(timeout=30) for idx in range(num_proc)]
+        holdEvent.set()
+        for proc in proclist:
+            proc.join(30)
+        self.assertEqual(resultli.count(True), 1)
+        self.assertFalse(os.path.exists("%s/%s.lock"%(self.path_inflight, MD5_KEY)))
+
+    def test_owner_path(self):
+        (fp, owner_path) = inflight.Acquire(self.path_inflight, MD5_KEY, "job_a")
+        self.assertIsNotNone(fp)
+        # another process waiting for the key sees the folder of the holder
+        resultQueue = self.ctx.Queue()
+        def Wait(queue):
+            queue.put(inflight.Acquire(self.path_inflight, MD5_KEY, "job_b",
+                timeout=0.2)[1])
+        proc = self.ctx.Process(target=Wait, args=(resultQueue,))
+        proc.start()
+        self.assertEqual(resultQueue.get(timeout=30), "job_a")
+        proc.join(30)
+        inflight.Release(fp)
+        (fp, owner_path) = inflight.Acquire(self.path_inflight, MD5_KEY, "job_b")
+        self.assertIsNotNone(fp)
+        inflight.Release(fp)
+        inflight.Release(None)
+
+    def test_mutual_exclusion(self):
+        # the lock file is removed at each release, a process having opened
+        # the removed file must not hold the key together with the process
+        # holding the new file
+        tracefile = "%s/trace.txt"%(self.tmpdir)
+        num_proc = 6
+        num_round = 30
+        proclist = [self.ctx.Process(target=_Compute, args=(self.path_inflight,
+            idx, num_round, tracefile)) for idx in range(num_proc)]
+        for proc in proclist:
+            proc.start()
+        for proc in proclist:
+            proc.join(120)
+            self.assertEqual(proc.exitcode, 0)
+        with open(tracefile, "r") as fpin:
+            lines = fpin.read().split("\n")[:-1]
+        self.assertEqual(len(lines), 2*num_proc*num_round)
+        for i in range(0, len(lines), 2):
+            self.assertTrue(lines[i].startswith("enter "), lines[i])
+            self.assertEqual(lines[i+1], "exit %s"%(lines[i].split()[1]))
+#}}}
+class TestDispatch(unittest.TestCase):#{{{
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="test_inflight_")
+        self.dbfile = "%s/inflight.sqlite3"%(self.tmpdir)
+        self.ctx = multiprocessing.get_context("fork")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_claim(self):
+        self.assertEqual(inflight.Claim(self.dbfile, "rst_a", [(0, "k0"), (1, "k1")]), {})
+        self.assertEqual(inflight.Claim(self.dbfile, "rst_b", [(0, "k1"), (1, "k2")]),
+                {0: ("rst_a", 1)})
+        # claiming again its own key is not a conflict
+        self.assertEqual(inflight.Claim(self.dbfile, "rst_a", [(1, "k1")]), {})
+        self.assertEqual(inflight.GetOwner(self.dbfile, ["k0", "k1", "k2", "k3"]),
+                {"k0": "rst_a", "k1": "rst_a", "k2": "rst_b"})
+
+    def test_claim_race(self):
+        # jobs claiming the same keys at the same time, each key is given to
+        # one of them and the others see it held by that job
+        num_proc = 8
+        keyli = [(i, "k%d"%(i)) for i in range(50)]
+        resultQueue = self.ctx.Queue()
+        proclist = [self.ctx.Process(target=_Claim, args=(self.dbfile,
+            "rst_%d"%(idx), keyli, resultQueue)) for idx in range(num_proc)]
+        for proc in proclist:
+            proc.start()
+        resultDict = dict([resultQueue.get(timeout=60) for idx in range(num_proc)])
+        for proc in proclist:
+            proc.join(30)
+        ownerDict = inflight.GetOwner(self.dbfile, [key for (i, key) in keyli])
+        self.assertEqual(len(ownerDict), len(keyli))
+        for (jobid, heldDict) in resultDict.items():
+            for (seqindex, md5_key) in keyli:
+                if ownerDict[md5_key] == jobid:
+                    self.assertNotIn(seqindex, heldDict)
+                else:
+                    self.assertEqual(heldDict[seqindex], (ownerDict[md5_key], seqindex))
+
+    def test_set_dispatched(self):
+        inflight.Claim(self.dbfile, "rst_a", [(0, "k0"), (1, "k1")])
+        inflight.Claim(self.dbfile, "rst_b", [(0, "k2")])
+        # k0 is retrieved, k2 of the other job is left to it
+        inflight.SetDispatched(self.dbfile, "rst_a", [(1, "node1", "rst_r1", "k1"),
+            (2, "node1", "rst_r1", "k2")])
+        self.assertEqual(inflight.GetOwner(self.dbfile, ["k0", "k1", "k2"]),
+                {"k1": "rst_a", "k2": "rst_b"})
+        inflight.CleanDispatch(self.dbfile, set(["rst_b"]))
+        self.assertEqual(inflight.GetOwner(self.dbfile, ["k0", "k1", "k2"]),
+                {"k2": "rst_b"})
+#}}}
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Test the reading of the lines appended to a log file by
+    logtail.ReadNewLines, when the file is appended to, rotated or truncated
+
+Usage: python -m pytest test_logtail.py
+       python -m unittest test_logtail
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import logtail
+
+class TestReadNewLines(unittest.TestCase):#{{{
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="test_logtail_")
+        self.logfile = "%s/finished_job.log"%(self.tmpdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def Append(self, content):
+        with open(self.logfile, "ab") as fpout:
+            fpout.write(content)
+
+    def test_missing_file(self):
+        self.assertEqual(logtail.ReadNewLines(self.logfile, 5, 10), ([], 5, 10))
+
+    def test_append(self):
+        self.Append(b"a\nb\n")
+        (lines, inode, offset) = logtail.ReadNewLines(self.logfile, -1, 0)
+        self.assertEqual(lines, ["a", "b"])
+        self.assertEqual(offset, 4)
+        self.assertEqual(logtail.ReadNewLines(self.logfile, inode, offset),
+                ([], inode, offset))
+        self.Append(b"c\n")
+        (lines, inode, offset) = logtail.ReadNewLines(self.logfile, inode, offset)
+        self.assertEqual(lines, ["c"])
+        self.assertEqual(offset, 6)
+
+    def test_partial_line(self):
+        # a line being written is read once it is complete
+        self.Append(b"a\nb")
+        (lines, inode, offset) = logtail.ReadNewLines(self.logfile, -1, 0)
+        self.assertEqual(lines, ["a"])
+        (lines, inode, offset) = logtail.ReadNewLines(self.logfile, inode, offset)
+        self.assertEqual(lines, [])
+        self.Append(b"c\n")
+        (lines, inode, offset) = logtail.ReadNewLines(self.logfile, inode, offset)
+        self.assertEqual(lines, ["bc"])
+
+    def test_rotation(self):
+        # the file is moved away and a new one is created, e.g. by
+        # ArchiveLogFile, reading restarts from the beginning of the new file
+        self.Append(b"a\nb\n")
+        (lines, inode, offset) = logtail.ReadNewLines(self.logfile, -1, 0)
+        os.rename(self.logfile, "%s.1"%(self.logfile))
+        self.Append(b"c\nd\ne\n")
+        (lines, inode2, offset) = logtail.ReadNewLines(self.logfile, inode, offset)
+        self.assertEqual(lines, ["c", "d", "e"])
+        self.assertNotEqual(inode2, inode)
+        self.assertEqual(offset, 6)
+
+    def test_truncation(self):
+        self.Append(b"a\nb\nc\n")
+        (lines, inode, offset) = logtail.ReadNewLines(self.logfile, -1, 0)
+        with open(self.logfile, "wb") as fpout:
+            fpout.write(b"d\n")
+        (lines, inode2, offset) = logtail.ReadNewLines(self.logfile, inode, offset)
+        self.assertEqual(lines, ["d"])
+        self.assertEqual(inode2, inode)
+        self.assertEqual(offset, 2)
+
+    def test_max_size(self):
+        self.Append(b"aa\nbb\ncc\n")
+        (lines, inode, offset) = logtail.ReadNewLines(self.logfile, -1, 0, max_size=7)
+        self.assertEqual(lines, ["aa", "bb"])
+        (lines, inode, offset) = logtail.ReadNewLines(self.logfile, inode, offset,
+                max_size=7)
+        self.assertEqual(lines, ["cc"])
+        self.assertEqual(offset, 9)
+
+    def test_invalid_utf8(self):
+        self.Append(b"a\xff\n")
+        (lines, inode, offset) = logtail.ReadNewLines(self.logfile, -1, 0)
+        self.assertEqual(lines, ["a�"])
+#}}}
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Compare the validation of a query file by seqvalidate.ValidateSeqFile
+    with webcom.ValidateSeq on edge cases of the FASTA input, and test the
+    reading of the records and the saving of uploaded files, which do not
+    need libpredweb
+
+Usage: python -m pytest test_seqvalidate.py
+       python -m unittest test_seqvalidate
+"""
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from libpredweb import webserver_common as webcom
+except ImportError:
+    webcom = None
+
+import seqvalidate
+
+G_PARAMS = {
+        'MIN_LEN_SEQ': 10,
+        'MAX_LEN_SEQ': 100,
+        'MAX_NUMSEQ_PER_JOB': 100,
+        'MAX_NUMSEQ_FOR_FORCE_RUN': 2,
+        }
+
+SEQ = "MKVLAAGIVGLLLAVSAQAATE"
+
+# (name, content of the query file as bytes)
+CASE_LIST = [
+        ("valid", (">sp|P1|A Protein A\n%s\n>sp|P2|B\n%s\n%s\n"%(SEQ, SEQ,
+            SEQ)).encode()),
+        ("empty_record", (">empty1\n>a\n%s\n>empty2\n\n>b\n%s\n>empty3\n"%(
+            SEQ, SEQ)).encode()),
+        ("text_before_first_record", ("some text\n\n>a\n%s\n"%(SEQ)).encode()),
+        ("no_annotation", ("%s\n%s\n"%(SEQ, SEQ)).encode()),
+        ("crlf", (">a desc\r\n%s\r\n%s\r\n>b\r\n%s\r\n"%(SEQ, SEQ,
+            SEQ)).encode()),
+        ("non_ascii_header", (">prötein ä åäö\n%s\n>b\t\xb5m\n%s\n"%(SEQ,
+            SEQ)).encode("utf-8")),
+        ("too_short", (">short\nMKV\n>a\n%s\n"%(SEQ)).encode()),
+        ("too_long", (">long\n%s\n>a\n%s\n"%("M"*(G_PARAMS['MAX_LEN_SEQ']+1),
+            SEQ)).encode()),
+        ("max_len", (">a\n%s\n"%("A"*G_PARAMS['MAX_LEN_SEQ'])).encode()),
+        ("dna", (">dna\n%s\n>a\n%s\n"%("ACGTTGCAACGTTGCAACGT", SEQ)).encode()),
+        ("only_removed", (">short\nMKV\n>dna\nACGTACGTACGTACGTAC\n").encode()),
+        ("bad_letters", (">a\n%sJO1\n>b\n%s\n"%(SEQ, SEQ)).encode()),
+        ("nonstandard_letters", (">a\nmkvB%sZU*-\n"%(SEQ)).encode()),
+        ("nonstandard_to_short", (">a\nMKV*****--ZZ\n").encode()),
+        ("empty", b""),
+        ("blank", b"  \n\n"),
+        ("too_many", "".join([">s%d\n%s\n"%(i, SEQ) for i in
+            range(G_PARAMS['MAX_NUMSEQ_PER_JOB']+1)]).encode()),
+        ]
+
+def ReadRecordList(content):#{{{
+    """Return the list of (annotation, sequence) of the filtered query, the
+    white spaces are not compared"""
+    recordlist = []
+    for record in content.split(">")[1:]:
+        lines = record.split("\n")
+        recordlist.append((" ".join(lines[0].split()), "".join(lines[1:]).strip()))
+    return recordlist
+#}}}
+
+@unittest.skipIf(webcom is None, "libpredweb is not installed")
+class TestValidateSeqFile(unittest.TestCase):#{{{
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="test_seqvalidate_")
+        self.read_size = seqvalidate.READ_SIZE
+
+    def tearDown(self):
+        seqvalidate.READ_SIZE = self.read_size
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def RunBoth(self, name, content, isForceRun=False):
+        seqinfo_w = {'isForceRun': isForceRun}
+        filtered_w = webcom.ValidateSeq(content.decode("utf-8", "replace"),
+                seqinfo_w, G_PARAMS)
+        infile = "%s/%s.fa"%(self.tmpdir, name)
+        outfile = "%s/%s.filtered.fa"%(self.tmpdir, name)
+        with open(infile, "wb") as fpout:
+            fpout.write(content)
+        seqinfo_s = {'isForceRun': isForceRun}
+        isValid = seqvalidate.ValidateSeqFile(infile, outfile, seqinfo_s, G_PARAMS)
+        with open(outfile, "r") as fpin:
+            filtered_s = fpin.read()
+        return (seqinfo_w, filtered_w, seqinfo_s, filtered_s, isValid)
+
+    def CheckCase(self, name, content, isForceRun=False):
+        (seqinfo_w, filtered_w, seqinfo_s, filtered_s, isValid) = self.RunBoth(
+                name, content, isForceRun)
+        self.assertEqual(seqinfo_w['isValidSeq'], seqinfo_s['isValidSeq'])
+        self.assertEqual(isValid, seqinfo_s['isValidSeq'])
+        self.assertEqual(seqinfo_w['numseq'], seqinfo_s['numseq'])
+        self.assertEqual(seqinfo_w['errinfo_br'], seqinfo_s['errinfo_br'])
+        if seqinfo_s['isValidSeq']:
+            self.assertEqual(ReadRecordList(filtered_w), ReadRecordList(filtered_s))
+
+    def test_cases(self):
+        for (name, content) in CASE_LIST:
+            with self.subTest(name=name):
+                self.CheckCase(name, content)
+
+    def test_force_run(self):
+        self.CheckCase("force_run", (">a\n%s\n>b\n%s\n>c\n%s\n"%(SEQ, SEQ,
+            SEQ)).encode(), isForceRun=True)
+
+    def test_small_blocks(self):
+        # records, CRLF and annotations cut at the border of the blocks
+        for read_size in [1, 2, 3, 7, 16]:
+            seqvalidate.READ_SIZE = read_size
+            for (name, content) in CASE_LIST:
+                with self.subTest(name=name, read_size=read_size):
+                    self.CheckCase(name, content)
+#}}}
+class TestReadRecord(unittest.TestCase):#{{{
+    def setUp(self):
+        self.read_size = seqvalidate.READ_SIZE
+
+    def tearDown(self):
+        seqvalidate.READ_SIZE = self.read_size
+
+    def ReadAll(self, content, max_len=1000):
+        return list(seqvalidate._ReadRecord(io.BytesIO(content), max_len))
+
+    def test_records(self):
+        content = ("text before\n>a desc\r\nMKV LA\r\nAGI\n>b\n\n>c\n%s\n"%(
+            SEQ)).encode()
+        expected = [("a desc", b"MKVLAAGI", 8), ("b", b"", 0),
+                ("c", SEQ.encode(), len(SEQ))]
+        for read_size in [1, 2, 3, 7, 16, 1024]:
+            seqvalidate.READ_SIZE = read_size
+            with self.subTest(read_size=read_size):
+                self.assertEqual(self.ReadAll(content), expected)
+
+    def test_too_long(self):
+        # the residues of a sequence over max_len are not kept
+        content = (">long\n%s\n%s\n>a\n%s\n"%(SEQ, SEQ, SEQ)).encode()
+        for read_size in [5, 1024]:
+            seqvalidate.READ_SIZE = read_size
+            with self.subTest(read_size=read_size):
+                self.assertEqual(self.ReadAll(content, max_len=len(SEQ)),
+                        [("long", None, 2*len(SEQ)), ("a", SEQ.encode(), len(SEQ))])
+
+    def test_no_record(self):
+        self.assertEqual(self.ReadAll(b""), [])
+        self.assertEqual(self.ReadAll(("%s\n"%(SEQ)).encode()), [])
+
+    def test_annotation(self):
+        content = (">pr\xf6tein\x0bA\n%s\n>%s\n%s\n"%(SEQ,
+            "x"*(2*seqvalidate.MAX_LEN_ANNO), SEQ)).encode("utf-8")
+        seqvalidate.READ_SIZE = 1000
+        li = self.ReadAll(content)
+        self.assertEqual(li[0][0], "pr tein A")
+        # the annotation is cut at the first block over MAX_LEN_ANNO
+        self.assertLess(len(li[1][0]), seqvalidate.MAX_LEN_ANNO + 1000)
+        self.assertEqual(li[1][1], SEQ.encode())
+#}}}
+class TestSaveUploadedFile(unittest.TestCase):#{{{
+    class UploadedFile(object):
+        def __init__(self, content, chunk_size):
+            self.content = content
+            self.chunk_size = chunk_size
+        def chunks(self):
+            for i in range(0, len(self.content), self.chunk_size):
+                yield self.content[i:i+self.chunk_size]
+
+    def test_save(self):
+        tmpdir = tempfile.mkdtemp(prefix="test_seqvalidate_")
+        try:
+            content = b"".join([b">s%d\n%s\n"%(i, SEQ.encode()) for i in range(100)])
+            outfile = "%s/query.fa"%(tmpdir)
+            size = seqvalidate.SaveUploadedFile(self.UploadedFile(content, 7), outfile)
+            self.assertEqual(size, len(content))
+            with open(outfile, "rb") as fpin:
+                self.assertEqual(fpin.read(), content)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+#}}}
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Test the leases of the qd_fe workers: the takeover of an expired lease,
+    the release, the renewal by the heartbeat and the ownership of the jobs
+
+Usage: python -m pytest test_workerpool.py
+       python -m unittest test_workerpool
+"""
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+
+import workerpool
+
+LEASE_TIME = 120
+
+def _TakeOver(leasefile, worker_name, startEvent, resultQueue):#{{{
+    startEvent.wait()
+    resultQueue.put((worker_name, workerpool.AcquireLease(leasefile,
+        worker_name, LEASE_TIME)))
+#}}}
+
+class TestLease(unittest.TestCase):#{{{
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="test_workerpool_")
+        self.path_worker = "%s/worker"%(self.tmpdir)
+        os.makedirs(self.path_worker)
+        self.jobdir = "%s/rst_a"%(self.tmpdir)
+        os.makedirs(self.jobdir)
+        self.leasefile = "%s/qd_fe.lease"%(self.jobdir)
+        self.ctx = multiprocessing.get_context("fork")
+        with workerpool.g_lock:
+            workerpool.g_leaseSet.clear()
+
+    def tearDown(self):
+        with workerpool.g_lock:
+            workerpool.g_leaseSet.clear()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def Expire(self, leasefile):
+        epoch = time.time() - LEASE_TIME - 10
+        os.utime(leasefile, (epoch, epoch))
+
+    def test_acquire(self):
+        self.assertTrue(workerpool.AcquireLease(self.leasefile, "w1", LEASE_TIME))
+        self.assertTrue(workerpool.AcquireLease(self.leasefile, "w1", LEASE_TIME))
+        self.assertFalse(workerpool.AcquireLease(self.leasefile, "w2", LEASE_TIME))
+        self.assertEqual(workerpool.ReadLeaseOwner(self.leasefile), "w1")
+        self.assertEqual(workerpool.GetHeldLeaseList(), [self.leasefile])
+
+    def test_takeover(self):
+        # an expired lease is taken over, the old owner does not get it back
+        # by renewing it
+        self.assertTrue(workerpool.AcquireLease(self.leasefile, "w1", LEASE_TIME))
+        self.Expire(self.leasefile)
+        self.assertTrue(workerpool.AcquireLease(self.leasefile, "w2", LEASE_TIME))
+        self.assertEqual(workerpool.ReadLeaseOwner(self.leasefile), "w2")
+        self.assertFalse(workerpool.AcquireLease(self.leasefile, "w1", LEASE_TIME))
+
+    def test_takeover_race(self):
+        # of the workers finding the lease expired at the same time exactly
+        # one takes it over
+        self.assertTrue(workerpool.AcquireLease(self.leasefile, "w0", LEASE_TIME))
+        self.Expire(self.leasefile)
+        num_proc = 8
+        startEvent = self.ctx.Event()
+        resultQueue = self.ctx.Queue()
+        proclist = [self.ctx.Process(target=_TakeOver, args=(self.leasefile,
+            "w%d"%(idx+1), startEvent, resultQueue)) for idx in range(num_proc)]
+        for proc in proclist:
+            proc.start()
+        startEvent.set()
+        resultli = [resultQueue.get(timeout=30) for idx in range(num_proc)]
+        for proc in proclist:
+            proc.join(30)
+        winnerli = [name for (name, isAcquired) in resultli if isAcquired]
+        self.assertEqual(len(winnerli), 1)
+        self.assertEqual(workerpool.ReadLeaseOwner(self.leasefile), winnerli[0])
+
+    def test_release(self):
+        self.assertTrue(workerpool.AcquireLease(self.leasefile, "w1", LEASE_TIME))
+        # only the owner releases the lease
+        workerpool.ReleaseLease(self.leasefile, "w2")
+        self.assertEqual(workerpool.ReadLeaseOwner(self.leasefile), "w1")
+        workerpool.ReleaseLease(self.leasefile, "w1")
+        self.assertFalse(os.path.exists(self.leasefile))
+        self.assertEqual(workerpool.GetHeldLeaseList(), [])
+        # the new owner does not wait for the expiry
+        self.assertTrue(workerpool.AcquireLease(self.leasefile, "w2", LEASE_TIME))
+
+    def test_heartbeat(self):
+        # the held leases are renewed, a lease taken over by another worker
+        # or whose job folder has been removed is forgotten
+        jobdir_b = "%s/rst_b"%(self.tmpdir)
+        jobdir_c = "%s/rst_c"%(self.tmpdir)
+        os.makedirs(jobdir_b)
+        os.makedirs(jobdir_c)
+        leasefile_b = "%s/qd_fe.lease"%(jobdir_b)
+        leasefile_c = "%s/qd_fe.lease"%(jobdir_c)
+        for leasefile in [self.leasefile, leasefile_b, leasefile_c]:
+            self.assertTrue(workerpool.AcquireLease(leasefile, "w1", LEASE_TIME))
+            self.Expire(leasefile)
+        self.assertTrue(workerpool.AcquireLease(leasefile_b, "w2", LEASE_TIME))
+        shutil.rmtree(jobdir_c)
+        workerpool.Heartbeat(self.path_worker, "w1")
+        self.assertEqual(workerpool.GetHeldLeaseList(), [self.leasefile])
+        self.assertLess(time.time() - os.path.getmtime(self.leasefile), LEASE_TIME)
+        self.assertFalse(workerpool.AcquireLease(self.leasefile, "w2", LEASE_TIME))
+        self.assertEqual(workerpool.GetLiveWorkerList(self.path_worker), ["w1"])
+#}}}
+class TestOwner(unittest.TestCase):#{{{
+    def test_owner(self):
+        jobidlist = ["rst_%d"%(i) for i in range(200)]
+        workerlist = ["w1", "w2", "w3"]
+        ownerDict = dict([(jobid, workerpool.GetOwner(jobid, workerlist))
+            for jobid in jobidlist])
+        self.assertEqual(set(ownerDict.values()), set(workerlist))
+        self.assertEqual(ownerDict, dict([(jobid, workerpool.GetOwner(jobid,
+            list(reversed(workerlist)))) for jobid in jobidlist]))
+        # only the jobs of the dead worker move
+        for jobid in jobidlist:
+            owner = workerpool.GetOwner(jobid, ["w1", "w3"])
+            if ownerDict[jobid] != "w2":
+                self.assertEqual(owner, ownerDict[jobid])
+            else:
+                self.assertIn(owner, ["w1", "w3"])
+        self.assertIsNone(workerpool.GetOwner("rst_0", []))
+#}}}
+
+if __name__ == '__main__':
+    unittest.main()
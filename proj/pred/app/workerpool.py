@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Sharded ownership of jobs among several qd_fe workers
+
+    Workers run on the same host sharing the static folder. Each worker
+      - writes a heartbeat file <path_worker>/<worker>.heartbeat every
+        HEARTBEAT_INTERVAL seconds from a background thread, a worker is alive
+        if its heartbeat is younger than WORKER_TIMEOUT
+      - handles only the jobs it owns by rendezvous hashing of the jobid over
+        the live workers (GetOwner), so that only the jobs of a dead or a new
+        worker move
+      - holds a lease file for each job it handles, a job is handled only
+        with the lease, so that two workers never handle the same job even if
+        their views of the live workers differ for a while. Leases are renewed
+        by the heartbeat thread and a lease older than LEASE_TIME can be taken
+        over by another worker
+    The leader, i.e. the holder of the lease <path_worker>/leader.lease, does
+    the housekeeping shared by all workers.
+
+    A lease is read, renewed, taken over and released only with the flock of
+    <leasefile>.lock, so that the check of the owner and the expiry and the
+    write of the new owner are done as one step.
+
+    Limitation: the workers must run on a single host. flock, as the fcntl
+    locks of the sqlite databases in static/log shared by the workers, is
+    not reliable on NFS, so the static folder must be on a local file system.
+    StartHeartbeat refuses to start a worker if a live worker of another host
+    is found (GetOtherHostList).
+"""
+import os
+import time
+import fcntl
+import socket
+import hashlib
+import threading
+
+HEARTBEAT_INTERVAL = 30
+WORKER_TIMEOUT = 120
+LEASE_TIME = 120
+
+g_lock = threading.Lock()
+g_leaseSet = set()      # lease files held by this worker
+g_heartbeatThread = None
+
+def GetDefaultWorkerName():#{{{
+    return socket.gethostname()
+#}}}
+def _Touch(filename, content):#{{{
+    tmpfile = "%s.tmp.%s.%d"%(filename, socket.gethostname(), os.getpid())
+    with open(tmpfile, "w") as fpout:
+        fpout.write(content)
+    os.rename(tmpfile, filename)
+#}}}
+def Heartbeat(path_worker, worker_name):#{{{
+    """Write the heartbeat of the worker and renew its leases, a lease that
+    is no longer held or whose folder has been removed is forgotten"""
+    _Touch("%s/%s.heartbeat"%(path_worker, worker_name), "%s\t%d\t%f\n"%(
+        socket.gethostname(), os.getpid(), time.time()))
+    for leasefile in GetHeldLeaseList():
+        try:
+            with _LeaseLock(leasefile):
+                isOwner = (ReadLeaseOwner(leasefile) == worker_name)
+                if isOwner:
+                    os.utime(leasefile, None)
+        except (IOError, OSError):
+            isOwner = False
+        if not isOwner:
+            with g_lock:
+                g_leaseSet.discard(leasefile)
+#}}}
+def GetHeldLeaseList():#{{{
+    """Return the list of lease files held by this worker"""
+    with g_lock:
+        return list(g_leaseSet)
+#}}}
+def _HeartbeatLoop(path_worker, worker_name, interval):#{{{
+    while True:
+        try:
+            Heartbeat(path_worker, worker_name)
+        except (IOError, OSError):
+            pass
+        time.sleep(interval)
+#}}}
+def GetOtherHostList(path_worker, timeout=WORKER_TIMEOUT):#{{{
+    """Return the sorted list of hosts other than this one with a live worker"""
+    hostset = set()
+    hostname = socket.gethostname()
+    for worker in GetLiveWorkerList(path_worker, timeout):
+        try:
+            with open("%s/%s.heartbeat"%(path_worker, worker), "r") as fpin:
+                host = fpin.read().split("\t")[0].strip()
+        except IOError:
+            continue
+        if host not in ["", hostname]:
+            hostset.add(host)
+    return sorted(hostset)
+#}}}
+def StartHeartbeat(path_worker, worker_name, interval=HEARTBEAT_INTERVAL):#{{{
+    """Start the heartbeat thread of the worker, raise RuntimeError if a live
+    worker runs on another host"""
+    global g_heartbeatThread
+    if not os.path.exists(path_worker):
+        os.makedirs(path_worker, exist_ok=True)
+    hostli = GetOtherHostList(path_worker)
+    if len(hostli) > 0:
+        raise RuntimeError("workers are running on other hosts (%s), all "
+                "workers must run on the same host"%(", ".join(hostli)))
+    Heartbeat(path_worker, worker_name)
+    if g_heartbeatThread is None:
+        g_heartbeatThread = threading.Thread(target=_HeartbeatLoop,
+                args=(path_worker, worker_name, interval))
+        g_heartbeatThread.daemon = True
+        g_heartbeatThread.start()
+#}}}
+def GetLiveWorkerList(path_worker, timeout=WORKER_TIMEOUT):#{{{
+    """Return the sorted list of workers with a recent heartbeat"""
+    liveli = []
+    epoch = time.time()
+    try:
+        namelist = os.listdir(path_worker)
+    except OSError:
+        return liveli
+    for name in namelist:
+        if not name.endswith(".heartbeat"):
+            continue
+        try:
+            mtime = os.path.getmtime("%s/%s"%(path_worker, name))
+        except OSError:
+            continue
+        if epoch - mtime <= timeout:
+            liveli.append(name[:-len(".heartbeat")])
+    return sorted(liveli)
+#}}}
+def GetOwner(jobid, workerlist):#{{{
+    """Return the worker owning the job by rendezvous hashing"""
+    owner = None
+    max_weight = None
+    for worker in workerlist:
+        weight = hashlib.md5(("%s:%s"%(worker, jobid)).encode('utf-8')).hexdigest()
+        if max_weight is None or weight > max_weight:
+            (owner, max_weight) = (worker, weight)
+    return owner
+#}}}
+class _LeaseLock(object):#{{{
+    """Exclusive flock of <leasefile>.lock, taken by the threads of this and
+    the other workers of the host around every access to the lease"""
+    def __init__(self, leasefile):
+        self.lockfile = "%s.lock"%(leasefile)
+        self.fp = None
+    def __enter__(self):
+        self.fp = open(self.lockfile, "a")
+        fcntl.flock(self.fp, fcntl.LOCK_EX)
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        fcntl.flock(self.fp, fcntl.LOCK_UN)
+        self.fp.close()
+        return False
+#}}}
+def ReadLeaseOwner(leasefile):#{{{
+    try:
+        with open(leasefile, "r") as fpin:
+            return fpin.read().strip()
+    except IOError:
+        return ""
+#}}}
+def AcquireLease(leasefile, worker_name, lease_time=LEASE_TIME):#{{{
+    """Acquire or renew the lease, return True if the worker holds the lease
+    the owner and the expiry are checked and the lease written under the
+    lock of the lease, so that an expired lease is taken over by one worker"""
+    try:
+        with _LeaseLock(leasefile):
+            owner = ReadLeaseOwner(leasefile)
+            if owner == worker_name:
+                os.utime(leasefile, None)
+            else:
+                if (owner != "" and
+                        time.time() - os.path.getmtime(leasefile) <= lease_time):
+                    return False
+                _Touch(leasefile, worker_name)
+    except (IOError, OSError):
+        return False
+    with g_lock:
+        g_leaseSet.add(leasefile)
+    return True
+#}}}
+def ReleaseLease(leasefile, worker_name):#{{{
+    """Release the lease if held by the worker, so that the new owner of the
+    job can take it without waiting for the expiry"""
+    with g_lock:
+        g_leaseSet.discard(leasefile)
+    try:
+        with _LeaseLock(leasefile):
+            if ReadLeaseOwner(leasefile) == worker_name:
+                os.remove(leasefile)
+    except (IOError, OSError):
+        pass
+#}}}
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Description:
+    Cached and pooled suds clients for the communication with the compute
+    nodes
+
+    Creating a suds Client downloads and parses the remote WSDL. Here the
+    parsed client for each WSDL url is created once and a lightweight clone
+    of it is returned for each call. All clients send their requests through
+    one requests.Session, i.e. a keep-alive HTTP connection pool.
+
+    A cached client is re-created when it is older than MAX_CLIENT_AGE, when
+    the entry of its node in computenode.txt has changed (see RefreshNodes) or
+    after a failed call (see InvalidateNode).
+"""
+import io
+import time
+import threading
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from suds.client import Client, ServiceSelector
+from suds.options import Options
+from suds.transport import Transport, Reply, TransportError
+
+MAX_CLIENT_AGE = 3600   # re-create the cached client after this many seconds
+POOL_MAXSIZE = 16       # number of keep-alive connections kept per node
+
+g_lock = threading.Lock()
+g_clientDict = {}    # {wsdl_url: (Client, create_epoch)}
+g_nodeInfoDict = {}  # {node: str(entry in computenode.txt)}
+g_session = None
+
+class RequestsTransport(Transport):#{{{
+    """suds transport using a shared requests.Session"""
+    def __init__(self, session, timeout=60):
+        Transport.__init__(self)
+        self.session = session
+        self.options.timeout = timeout
+
+    def open(self, request):
+        try:
+            resp = self.session.get(request.url, headers=request.headers,
+                    timeout=self.options.timeout)
+        except requests.RequestException as e:
+            raise TransportError(str(e), None)
+        if resp.status_code >= 400:
+            raise TransportError(resp.reason, resp.status_code,
+                    io.BytesIO(resp.content))
+        return io.BytesIO(resp.content)
+
+    def send(self, request):
+        try:
+            resp = self.session.post(request.url, data=request.message,
+                    headers=request.headers, timeout=self.options.timeout)
+        except requests.RequestException as e:
+            raise TransportError(str(e), None)
+        if resp.status_code >= 300:
+            raise TransportError(resp.reason, resp.status_code,
+                    io.BytesIO(resp.content))
+        return Reply(resp.status_code, resp.headers, resp.content)
+#}}}
+
+class ClonedClient(Client):#{{{
+    """Client sharing the parsed WSDL of a cached client, with its own options
+
+    Client.clone() of suds deep-copies the options, which fails for the
+    linked option objects on recent Python versions and would copy the
+    transport with its connection pool"""
+    def __init__(self, client, transport, timeout):
+        self.options = Options()
+        self.set_options(cache=None, transport=transport, timeout=timeout)
+        self.wsdl = client.wsdl
+        self.factory = client.factory
+        self.service = ServiceSelector(self, client.wsdl.services)
+        self.sd = client.sd
+        self.messages = dict(tx=None, rx=None)
+#}}}
+
+def GetSession():#{{{
+    """Return the shared requests.Session with the keep-alive pool"""
+    global g_session
+    with g_lock:
+        if g_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_MAXSIZE,
+                    pool_maxsize=POOL_MAXSIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            g_session = session
+        return g_session
+#}}}
+def GetClient(wsdl_url, timeout=60):#{{{
+    """Return a client for wsdl_url, the WSDL is parsed only when the url is
+    not in the cache or the cached client is outdated"""
+    session = GetSession()
+    client = None
+    with g_lock:
+        if wsdl_url in g_clientDict:
+            (client, create_epoch) = g_clientDict[wsdl_url]
+            if time.time() - create_epoch >= MAX_CLIENT_AGE:
+                client = None
+    if client is None:
+        # parse the WSDL outside of the lock, other urls are not blocked
+        client = Client(wsdl_url, cache=None, timeout=timeout,
+                transport=RequestsTransport(session, timeout))
+        with g_lock:
+            g_clientDict[wsdl_url] = (client, time.time())
+    return ClonedClient(client, RequestsTransport(session, timeout), timeout)
+#}}}
+def InvalidateClient(wsdl_url):#{{{
+    """Delete the cached client for wsdl_url, e.g. after a failed call"""
+    with g_lock:
+        g_clientDict.pop(wsdl_url, None)
+#}}}
+def InvalidateNode(node):#{{{
+    """Delete all cached clients of the node, e.g. after a failed call"""
+    with g_lock:
+        for wsdl_url in list(g_clientDict.keys()):
+            if urlparse(wsdl_url).hostname == node:
+                del g_clientDict[wsdl_url]
+#}}}
+def RefreshNodes(avail_computenode):#{{{
+    """Delete cached clients of nodes that are removed from or changed in
+    avail_computenode, which is read from computenode.txt"""
+    with g_lock:
+        changed_nodeset = set()
+        for node in list(g_nodeInfoDict.keys()):
+            if (node not in avail_computenode or
+                    str(avail_computenode[node]) != g_nodeInfoDict[node]):
+                changed_nodeset.add(node)
+                del g_nodeInfoDict[node]
+        for node in avail_computenode:
+            g_nodeInfoDict[node] = str(avail_computenode[node])
+        for wsdl_url in list(g_clientDict.keys()):
+            if urlparse(wsdl_url).hostname in changed_nodeset:
+                del g_clientDict[wsdl_url]
+#}}}
+def CachedClient(url, **kwargs):#{{{
+    """Drop-in replacement of suds.client.Client(url, ...)
+    the cache option is ignored since the parsed client is cached here"""
+    timeout = kwargs.get('timeout', 60)
+    try:
+        return GetClient(url, timeout=timeout)
+    except Exception:
+        InvalidateClient(url)
+        raise
+#}}}
+def InstallToModule(module):#{{{
+    """Make the module, e.g. qd_fe_common, create its suds clients via
+    CachedClient, the module must have imported Client from suds.client
+    return False if the module has no attribute Client, nothing is then
+    installed and the caller should report it"""
+    if not hasattr(module, 'Client'):
+        return False
+    module.Client = CachedClient
+    return True
+#}}}
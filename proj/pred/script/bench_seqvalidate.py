@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# Description: benchmark the validation of a query file on synthetic proteomes
+#
+#   webcom  - the file is read into a string and validated by
+#             webcom.ValidateSeq, as for a query pasted in the form
+#   stream  - the file is validated by app/seqvalidate.py, which reads it by
+#             blocks and writes the valid sequences to a file
+#
+# The number of sequences and the filtered sequences of the two are compared
+
+import os
+import sys
+import time
+import random
+import tempfile
+
+rundir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append("%s/../app"%(rundir))
+
+from libpredweb import webserver_common as webcom
+import seqvalidate
+
+progname =  os.path.basename(sys.argv[0])
+
+usage_short="""
+Usage: %s [-nseq INT [INT ...]] [-nonstd FLOAT] [-seed INT]
+"""%(progname)
+
+usage_ext="""
+OPTIONS:
+  -nseq   INT  Number of sequences of the proteomes, (default: 1000 10000 50000)
+  -nonstd FLOAT
+               Fraction of sequences with non-standard letters (B, Z, U, *),
+               which are reported and converted, (default: 0.01)
+  -seed   INT  Seed of the random generator, (default: 0)
+  -h, --help   Print this help message and exit
+"""
+
+# amino acid frequencies of UniProtKB/Swiss-Prot in percent
+AA_FREQ = [("A", 8.25), ("R", 5.53), ("N", 4.06), ("D", 5.45), ("C", 1.37),
+        ("Q", 3.93), ("E", 6.75), ("G", 7.07), ("H", 2.27), ("I", 5.96),
+        ("L", 9.66), ("K", 5.84), ("M", 2.42), ("F", 3.86), ("P", 4.70),
+        ("S", 6.56), ("T", 5.34), ("W", 1.08), ("Y", 2.92), ("V", 6.87)]
+
+g_params = {
+        'MIN_LEN_SEQ': 10,
+        'MAX_LEN_SEQ': 10000,
+        'MAX_NUMSEQ_PER_JOB': 1000000,
+        'MAX_NUMSEQ_FOR_FORCE_RUN': 2,
+        }
+
+def WriteProteome(outfile, numseq, frac_nonstd, rand):#{{{
+    """Write numseq sequences with log-normal lengths (median about 350) in
+    lines of 60 residues, including a few too short and too long ones"""
+    letters = "".join([aa for (aa, freq) in AA_FREQ])
+    weights = [freq for (aa, freq) in AA_FREQ]
+    with open(outfile, "w") as fpout:
+        for i in range(numseq):
+            length = int(rand.lognormvariate(5.85, 0.6))
+            seq = rand.choices(letters, weights, k=length)
+            if rand.random() < frac_nonstd and length > 0:
+                seq[rand.randrange(length)] = rand.choice("BZU*")
+            seq = "".join(seq)
+            fpout.write(">sp|P%05d|SYN%d_HUMAN Synthetic protein %d\n"%(i, i, i))
+            for j in range(0, len(seq), 60):
+                fpout.write(seq[j:j+60] + "\n")
+#}}}
+def RunWebcom(infile):#{{{
+    with open(infile, "r") as fpin:
+        rawseq = fpin.read()
+    seqinfo = {}
+    filtered_seq = webcom.ValidateSeq(rawseq, seqinfo, g_params)
+    return (seqinfo.get('numseq', 0), filtered_seq)
+#}}}
+def RunStream(infile):#{{{
+    outfile = "%s.filtered"%(infile)
+    seqinfo = {}
+    seqvalidate.ValidateSeqFile(infile, outfile, seqinfo, g_params)
+    with open(outfile, "r") as fpin:
+        filtered_seq = fpin.read()
+    os.remove(outfile)
+    return (seqinfo.get('numseq', 0), filtered_seq)
+#}}}
+def main():#{{{
+    argv = sys.argv
+    numArgv = len(argv)
+    numseqlist = [1000, 10000, 50000]
+    frac_nonstd = 0.01
+    seed = 0
+    i = 1
+    while i < numArgv:
+        if argv[i] in ["-h", "--help"]:
+            print(usage_short)
+            print(usage_ext)
+            return 0
+        elif argv[i] in ["-nseq", "--nseq"]:
+            numseqlist = []
+            i += 1
+            while i < numArgv and argv[i][0] != "-":
+                numseqlist.append(int(argv[i]))
+                i += 1
+        elif argv[i] in ["-nonstd", "--nonstd"] and i+1 < numArgv:
+            frac_nonstd = float(argv[i+1])
+            i += 2
+        elif argv[i] in ["-seed", "--seed"] and i+1 < numArgv:
+            seed = int(argv[i+1])
+            i += 2
+        else:
+            print("Error! Wrong argument:", argv[i], file=sys.stderr)
+            return 1
+
+    rand = random.Random(seed)
+    tmpdir = tempfile.mkdtemp(prefix="bench_seqvalidate_")
+    print("%8s %10s %10s %10s %8s %s"%("numseq", "size", "webcom_s",
+        "stream_s", "speedup", "same"))
+    for numseq in numseqlist:
+        infile = "%s/proteome_%d.fa"%(tmpdir, numseq)
+        WriteProteome(infile, numseq, frac_nonstd, rand)
+        timeDict = {}
+        resultDict = {}
+        for (name, func) in [("webcom", RunWebcom), ("stream", RunStream)]:
+            begin = time.time()
+            resultDict[name] = func(infile)
+            timeDict[name] = time.time() - begin
+        (numseq_w, seq_w) = resultDict['webcom']
+        (numseq_s, seq_s) = resultDict['stream']
+        isSame = (numseq_w == numseq_s and seq_w.split() == seq_s.split())
+        print("%8d %10s %10.3f %10.3f %7.1fx %s"%(numseq,
+            "%.1fM"%(os.path.getsize(infile)/1024.0/1024.0), timeDict['webcom'],
+            timeDict['stream'], timeDict['webcom']/max(timeDict['stream'], 1e-6),
+            "yes" if isSame else "no"))
+        os.remove(infile)
+    os.rmdir(tmpdir)
+    return 0
+#}}}
+if __name__ == '__main__' :
+    sys.exit(main())
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# Description: benchmark the suds clients used by qd_fe for the communication
+#              with compute nodes, against a local stand-in SOAP server
+#
+#   new     - a new suds Client is created for each call, i.e. the WSDL is
+#             downloaded and parsed each time (the old behavior)
+#   cached  - clients are obtained from app/wsdl_client.py, i.e. the WSDL is
+#             parsed once and requests go through a keep-alive pool
+
+import os
+import sys
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+rundir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append("%s/../app"%(rundir))
+
+from suds.client import Client
+import wsdl_client
+
+progname =  os.path.basename(sys.argv[0])
+
+usage_short="""
+Usage: %s [-n INT] [-mode new|cached|both] [-latency FLOAT]
+"""%(progname)
+
+usage_ext="""
+OPTIONS:
+  -n     INT   Number of calls for each mode, (default: 200)
+  -mode  STR   Mode to benchmark, (default: both)
+  -latency FLOAT
+               Simulated network latency in ms added to each request
+               served by the stand-in server, (default: 0)
+  -h, --help   Print this help message and exit
+"""
+
+WSDL_TEMPLATE = """<?xml version='1.0' encoding='UTF-8'?>
+<wsdl:definitions xmlns:wsdl="http://schemas.xmlsoap.org/wsdl/"
+    xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/"
+    xmlns:xs="http://www.w3.org/2001/XMLSchema"
+    xmlns:tns="prodres.bioinfo.se" targetNamespace="prodres.bioinfo.se"
+    name="Application">
+  <wsdl:types>
+    <xs:schema targetNamespace="prodres.bioinfo.se" elementFormDefault="qualified">
+      <xs:complexType name="stringArray">
+        <xs:sequence>
+          <xs:element name="string" type="xs:string" minOccurs="0"
+              maxOccurs="unbounded" nillable="true"/>
+        </xs:sequence>
+      </xs:complexType>
+      <xs:element name="checkjob">
+        <xs:complexType><xs:sequence>
+          <xs:element name="jobid" type="xs:string" minOccurs="0" nillable="true"/>
+        </xs:sequence></xs:complexType>
+      </xs:element>
+      <xs:element name="checkjobResponse">
+        <xs:complexType><xs:sequence>
+          <xs:element name="checkjobResult" type="tns:stringArray" minOccurs="0" nillable="true"/>
+        </xs:sequence></xs:complexType>
+      </xs:element>
+    </xs:schema>
+  </wsdl:types>
+  <wsdl:message name="checkjob">
+    <wsdl:part name="checkjob" element="tns:checkjob"/>
+  </wsdl:message>
+  <wsdl:message name="checkjobResponse">
+    <wsdl:part name="checkjobResponse" element="tns:checkjobResponse"/>
+  </wsdl:message>
+  <wsdl:portType name="Application">
+    <wsdl:operation name="checkjob">
+      <wsdl:input name="checkjob" message="tns:checkjob"/>
+      <wsdl:output name="checkjobResponse" message="tns:checkjobResponse"/>
+    </wsdl:operation>
+  </wsdl:portType>
+  <wsdl:binding name="Application" type="tns:Application">
+    <soap:binding style="document" transport="http://schemas.xmlsoap.org/soap/http"/>
+    <wsdl:operation name="checkjob">
+      <soap:operation soapAction="checkjob" style="document"/>
+      <wsdl:input name="checkjob"><soap:body use="literal"/></wsdl:input>
+      <wsdl:output name="checkjobResponse"><soap:body use="literal"/></wsdl:output>
+    </wsdl:operation>
+  </wsdl:binding>
+  <wsdl:service name="Service_submitseq">
+    <wsdl:port name="Application" binding="tns:Application">
+      <soap:address location="http://127.0.0.1:%d/pred/api_submitseq/"/>
+    </wsdl:port>
+  </wsdl:service>
+</wsdl:definitions>
+"""
+
+RESPONSE = """<?xml version='1.0' encoding='UTF-8'?>
+<soap11env:Envelope xmlns:soap11env="http://schemas.xmlsoap.org/soap/envelope/"
+    xmlns:tns="prodres.bioinfo.se"><soap11env:Body><tns:checkjobResponse>
+<tns:checkjobResult><tns:string>Finished</tns:string>
+<tns:string>http://127.0.0.1/static/result/rst_bench/rst_bench.zip</tns:string>
+<tns:string></tns:string></tns:checkjobResult>
+</tns:checkjobResponse></soap11env:Body></soap11env:Envelope>
+""".encode('utf-8')
+
+class StandInHandler(BaseHTTPRequestHandler):#{{{
+    protocol_version = "HTTP/1.1"   # keep-alive as served by Apache
+    disable_nagle_algorithm = True  # headers and body are written separately
+    def _reply(self, content):
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+    def do_GET(self):
+        self._reply(self.server.wsdl)
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        self._reply(RESPONSE)
+    def log_message(self, format, *args):
+        pass
+#}}}
+def StartServer(latency=0.0):#{{{
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.latency = latency
+    server.wsdl = (WSDL_TEMPLATE%(server.server_address[1])).encode('utf-8')
+    th = threading.Thread(target=server.serve_forever)
+    th.daemon = True
+    th.start()
+    return server
+#}}}
+def RunBench(mode, wsdl_url, numcall):#{{{
+    begin = time.time()
+    for i in range(numcall):
+        if mode == "new":
+            myclient = Client(wsdl_url, cache=None, timeout=30)
+        else:
+            myclient = wsdl_client.GetClient(wsdl_url, timeout=30)
+        rtValue = myclient.service.checkjob("rst_bench")
+        if rtValue[0][0] != "Finished":
+            print("Unexpected return value %s"%(str(rtValue)), file=sys.stderr)
+            return -1
+    return numcall/(time.time()-begin)
+#}}}
+def main():#{{{
+    argv = sys.argv
+    numArgv = len(argv)
+    numcall = 200
+    modelist = ["new", "cached"]
+    latency = 0.0
+    i = 1
+    while i < numArgv:
+        if argv[i] in ["-h", "--help"]:
+            print(usage_short)
+            print(usage_ext)
+            return 0
+        elif argv[i] in ["-n", "--n"] and i+1 < numArgv:
+            numcall = int(argv[i+1])
+            i += 2
+        elif argv[i] in ["-mode", "--mode"] and i+1 < numArgv:
+            if argv[i+1] != "both":
+                modelist = [argv[i+1]]
+            i += 2
+        elif argv[i] in ["-latency", "--latency"] and i+1 < numArgv:
+            latency = float(argv[i+1])/1000.0
+            i += 2
+        else:
+            print("Error! Wrong argument:", argv[i], file=sys.stderr)
+            return 1
+
+    server = StartServer(latency)
+    wsdl_url = "http://127.0.0.1:%d/pred/api_submitseq/?wsdl"%(server.server_address[1])
+    for mode in modelist:
+        RunBench(mode, wsdl_url, 5) # warm up
+        rate = RunBench(mode, wsdl_url, numcall)
+        print("%-8s %8.1f calls/s (%d calls)"%(mode, rate, numcall))
+    server.shutdown()
+    return 0
+#}}}
+if __name__ == '__main__' :
+    sys.exit(main())
@@ -23,14 +23,25 @@ urlpatterns = [
     url(r'^help/$', views.get_help, name='pred.get_help'),
     url(r'^news/$', views.get_news, name='pred.get_news'),
     url(r'^serverstatus/$', views.get_serverstatus, name='pred.get_serverstatus'),
+    url(r'^metrics/$', views.get_metrics, name='pred.get_metrics'),
+    url(r'^checkjobs/$', views.check_jobs, name='pred.check_jobs'),
     url(r'^countjobcountry/$', views.get_countjob_country, name='pred.get_countjob_country'),
     url(r'^reference/$', views.get_reference, name='pred.get_reference'),
     url(r'^example/$', views.get_example, name='pred.get_example'),
     url(r'^result/(?P<jobid>[^\/]+)/$', views.get_results, name='pred.get_results'),
+    url(r'^result/(?P<jobid>[^\/]+)/progress/$', views.get_progress,
+        name='pred.get_progress'),
+    url(r'^result/(?P<jobid>[^\/]+)/stream/$', views.stream_progress,
+        name='pred.stream_progress'),
     url(r'^result/(?P<jobid>[^\/]+)/(?P<seqindex>seq_[0-9]+)/$',
         views.get_results_eachseq, name='pred.get_results_eachseq'),
     url(r'^login/', login_required(views.login), name="pred.login"),
 
+# JSON API with the same operations as the wsdl api
+    url(r'^api/submitjob/$', views.api_submitjob, name='pred.api_submitjob'),
+    url(r'^api/checkjob/(?P<jobid>[^\/]+)/$', views.api_checkjob, name='pred.api_checkjob'),
+    url(r'^api/deletejob/(?P<jobid>[^\/]+)/$', views.api_deletejob, name='pred.api_deletejob'),
+
 # for spyne wsdl
     url(r'^api_submitseq/', DjangoView.as_view(application=views.app_submitseq)),
 
@@ -3,13 +3,16 @@ import sys
 import tempfile
 import re
 import subprocess
-from datetime import datetime
+from datetime import datetime, timedelta
 from dateutil import parser as dtparser
 from pytz import timezone
 import time
 import math
 import shutil
 import json
+import glob
+import urllib.parse
+import sqlite3
 import logging
 
 SITE_ROOT = os.path.dirname(os.path.realpath(__file__))
@@ -19,6 +22,19 @@ path_app = "%s/app"%(SITE_ROOT)
 sys.path.append(path_app)
 from libpredweb import myfunc
 from libpredweb import webserver_common as webcom
+import fairshare
+import admission
+import serverstate
+import phaseprof
+import resultcache
+import expiry
+import resultindex
+import logtail
+import jobcatalog
+import incstat
+import jobcounter
+import submit_job_to_queue
+import seqvalidate
 
 logger = logging.getLogger(__name__)
 
@@ -37,7 +53,7 @@ from django.views.decorators.csrf import csrf_exempt
 from spyne.error import ResourceNotFoundError, ResourceAlreadyExistsError
 from spyne.server.django import DjangoApplication
 from spyne.model.primitive import Unicode, Integer
-from spyne.model.complex import Iterable
+from spyne.model.complex import Iterable, Array
 from spyne.service import ServiceBase
 from spyne.protocol.soap import Soap11
 from spyne.application import Application
@@ -57,6 +73,14 @@ path_stat = "%s/stat"%(path_log)
 path_result = "%s/static/result"%(SITE_ROOT)
 path_tmp = "%s/static/tmp"%(SITE_ROOT)
 path_md5 = "%s/static/md5"%(SITE_ROOT)
+fairshare_db = "%s/fairshare.sqlite3"%(path_log)
+loadfile = "%s/qd_fe_load.json"%(path_log)
+serverstate_db = "%s/serverstate.sqlite3"%(path_log)
+expiry_db = "%s/expiry.sqlite3"%(path_log)
+jobcatalog_db = "%s/jobcatalog.sqlite3"%(path_log)
+incstat_db = "%s/incstat.sqlite3"%(path_log)
+jobcounter_file = "%s/jobcounter.json"%(path_log)
+path_cache = "%s/static/result/cache"%(SITE_ROOT)
 python_exec = "python"
 
 
@@ -69,12 +93,31 @@ g_params['BIG_NUMBER']  = 100000
 g_params['MAX_NUMSEQ_FOR_FORCE_RUN']  = 2
 g_params['AVERAGE_RUNTIME_PER_SEQ_IN_SEC']  = 60
 g_params['MAX_ROWS_TO_SHOW_IN_TABLE']  = 2000
+g_params['NUM_JOBS_PER_PAGE']  = 500 # rows per page of the queue, running, finished and failed jobs
 g_params['MIN_LEN_SEQ']  = 10      # minimum length of the query sequence
 g_params['MAX_LEN_SEQ']  = 10000   # maximum length of the query sequence
 g_params['MAXSIZE_UPLOAD_FILE_IN_BYTE']  = g_params['MAXSIZE_UPLOAD_FILE_IN_MB'] * 1024*1024
 g_params['MAX_NUMSEQ_PER_JOB'] = 50000
 g_params['MAX_ALLOWD_NUMSEQ'] = 50000
 g_params['MAX_ACTIVE_USER'] = 10
+g_params['ADMISSION_LARGE_NUMSEQ'] = admission.ADMISSION_LARGE_NUMSEQ
+g_params['ADMISSION_DEFER_WAIT'] = admission.ADMISSION_DEFER_WAIT
+g_params['ADMISSION_REJECT_WAIT'] = admission.ADMISSION_REJECT_WAIT
+g_params['ADMISSION_MAX_DEFER_TIME'] = admission.ADMISSION_MAX_DEFER_TIME
+g_params['ADMISSION_MAX_STATE_AGE'] = admission.ADMISSION_MAX_STATE_AGE
+g_params['MIN_WAIT_TO_NOTIFY'] = 600 # show the estimated start time if the wait is longer
+g_params['METRICS_MAX_STATE_AGE'] = 600 # loop stats of qd_fe workers not updated for this are not exported
+g_params['FAST_PATH_MAX_NUMSEQ'] = 20 # jobs up to this size are finished at once if all cached
+g_params['PROGRESS_MAX_READ_SIZE'] = 1024*1024 # bytes of finished_seqs.txt returned per progress request
+g_params['MAX_JOBID_PER_CHECK'] = 1000 # maximal number of jobs in one checkjobs request
+g_params['PROGRESS_POLL_INTERVAL'] = 5 # seconds between two progress requests of the result page
+g_params['PROGRESS_SSE'] = False # push the progress by server-sent events, only for async deployments
+g_params['SSE_POLL_INTERVAL'] = 2 # seconds between two reads of the progress of a job by a stream
+g_params['SSE_MAX_DURATION'] = 120 # seconds after which a progress stream is closed and reopened by the browser
+g_params['SSE_RETRY_INTERVAL'] = 3 # seconds before the browser reopens a closed progress stream
+g_params['SSE_KEEPALIVE_INTERVAL'] = 15 # seconds of silence before a comment is sent on a progress stream
+g_params['JOBCOUNTER_MAX_AGE'] = jobcounter.JOBCOUNTER_MAX_AGE # job counter older than this is refreshed from the job catalog
+g_params['SUBMIT_ASYNC'] = False # submit jobs to the local queue by a worker thread after the response, qd_fe submits those left pending
 g_params['FORMAT_DATETIME'] = webcom.FORMAT_DATETIME
 g_params['STATIC_URL'] = settings.STATIC_URL
 g_params['SUPER_USER_LIST'] = settings.SUPER_USER_LIST
@@ -83,13 +126,16 @@ g_params['path_stat'] = path_stat
 g_params['SITE_ROOT'] = SITE_ROOT
 
 qd_fe_scriptfile = "%s/qd_fe.py"%(path_app)
+qd_fe_launch_lockfile = "%s/qd_fe.launch.lock"%(path_log)
 gen_errfile = "%s/static/log/%s.err"%(SITE_ROOT, progname)
 
 # Create your views here.
 from django.shortcuts import render
 from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django.http import HttpRequest
 from django.http import HttpResponseRedirect
+from django.http import QueryDict
 from django.views.static import serve
 
 
@@ -127,6 +173,7 @@ def login(request):#{{{
     #logout(request)
     info = {}
     webcom.set_basic_config(request, info, g_params)
+    # the login page lists the jobids, which are read from the logs
     info['jobcounter'] = webcom.GetJobCounter(info)
     return render(request, 'pred/login.html', info)
 #}}}
@@ -228,16 +275,24 @@ def submit_seq(request):#{{{
 
             is_valid_query = False
             if is_valid_parameter:
-                is_valid_query = webcom.ValidateQuery(request, query, g_params)
+                if seqfile != "" and rawseq.strip() == "":
+                    is_valid_query = ValidateUploadedQuery(query)
+                else:
+                    is_valid_query = webcom.ValidateQuery(request, query, g_params)
+                    query['size_rawseq'] = len(query['rawseq'])
 
+            is_admitted = False
             if is_valid_parameter and is_valid_query:
+                is_admitted = ApplyAdmission(query)
+
+            if is_valid_parameter and is_valid_query and is_admitted:
                 jobid = RunQuery(request, query)
 
                 # type of method_submission can be web or wsdl
                 #date, jobid, IP, numseq, size, jobname, email, method_submission
                 log_record = "%s\t%s\t%s\t%s\t%d\t%s\t%s\t%s\n"%(query['date'], jobid,
                         query['client_ip'], query['numseq'],
-                        len(query['rawseq']),query['jobname'], query['email'],
+                        query['size_rawseq'],query['jobname'], query['email'],
                         query['method_submission'])
                 main_logfile_query = "%s/%s/%s"%(SITE_ROOT, "static/log", "submitted_seq.log")
                 myfunc.WriteFile(log_record, main_logfile_query, "a")
@@ -264,34 +319,287 @@ def submit_seq(request):#{{{
                 # start the qd_fe if not, in the background
                 base_www_url = "http://" + request.META['HTTP_HOST']
                 if webcom.IsFrontEndNode(base_www_url): #run the daemon only at the frontend
-                    cmd = "nohup %s %s &"%(python_exec, qd_fe_scriptfile)
-                    os.system(cmd)
+                    admission.LaunchDaemon([python_exec, qd_fe_scriptfile],
+                            qd_fe_scriptfile, qd_fe_launch_lockfile)
 
 
                 if query['numseq'] < 0: #go to result page anyway
-                    query['jobcounter'] = webcom.GetJobCounter(info)
+                    query['jobcounter'] = GetJobCounter(info)
                     return render(request, 'pred/thanks.html', query)
                 else:
                     return get_results(request, jobid)
 
             else:
-                query['jobcounter'] = webcom.GetJobCounter(info)
+                if 'tmpdir' in query:
+                    shutil.rmtree(query['tmpdir'], ignore_errors=True)
+                query['jobcounter'] = GetJobCounter(info)
                 return render(request, 'pred/badquery.html', query)
 
     # if a GET (or any other method) we'll create a blank form
     else:
         form = SubmissionForm()
 
-    jobcounter = webcom.GetJobCounter(info)
+    jobcounter = GetJobCounter(info)
     info['form'] = form
     info['jobcounter'] = jobcounter
     info['MAX_ALLOWD_NUMSEQ'] = g_params['MAX_ALLOWD_NUMSEQ']
     return render(request, 'pred/submit_seq.html', info)
 #}}}
 
+def GetJobCounter(info):#{{{
+    """Return the job counter of the user shown on the pages, from the
+    counter file written by qd_fe, which is refreshed from the job catalog if
+    it is outdated, or from the logs if there is no counter file"""
+    if info.get('isSuperUser', False):
+        key = jobcounter.KEY_ALL
+    else:
+        key = info.get('client_ip', "")
+    try:
+        jobcounter.RefreshIfOutdated(jobcounter_file, jobcatalog_db,
+                g_params['JOBCOUNTER_MAX_AGE'])
+    except Exception as e:
+        webcom.loginfo("Failed to refresh %s with errmsg=%s"%(jobcounter_file,
+            str(e)), gen_errfile)
+    counter = jobcounter.GetJobCounter(jobcounter_file, key)
+    if counter is None:
+        counter = webcom.GetJobCounter(info)
+    return counter
+#}}}
+def ApplyAdmission(query):#{{{
+    """Admission control of the job according to the load of the server
+    return False if the job is rejected, in which case query['errinfo_br'] is
+    set, otherwise query['isDeferred'] is set and a notice on the estimated
+    start time is added to query['warninfo']"""
+    (decision, est_wait) = admission.CheckAdmission(loadfile, query['numseq'], g_params)
+    query['isDeferred'] = False
+    if decision == admission.REJECT:
+        query['errinfo_br'] = ("The server is overloaded, the estimated waiting "
+                "time is %s. Please submit your job later."%(admission.FormatWait(est_wait)))
+        query['errinfo_content'] = ""
+        query['errinfo'] = query['errinfo_br']
+        return False
+    notice = ""
+    if decision == admission.DEFER:
+        query['isDeferred'] = True
+        notice = ("The server is busy, your job with %d sequences is deferred "
+                "until the load decreases, at the latest for %s.\n"%(query['numseq'],
+                    admission.FormatWait(g_params['ADMISSION_MAX_DEFER_TIME'])))
+    elif est_wait is not None and est_wait >= g_params['MIN_WAIT_TO_NOTIFY']:
+        notice = "Your job is estimated to start in about %s.\n"%(
+                admission.FormatWait(est_wait))
+    if notice != "":
+        query['warninfo'] = query.get('warninfo', "") + notice
+    return True
+#}}}
+def AddToJobCatalog(jobid, query):#{{{
+    try:
+        jobcatalog.AddJob(jobcatalog_db, jobid, query['date'], query['numseq'],
+                query['jobname'], query['email'], query['client_ip'],
+                query['method_submission'])
+    except Exception as e:
+        webcom.loginfo("Failed to add %s to the job catalog with errmsg=%s"%(jobid, str(e)), gen_errfile)
+#}}}
+def UpdateJobCatalog(jobid, rstdir):#{{{
+    try:
+        jobcatalog.UpdateFromTagFile(jobcatalog_db, jobid, rstdir)
+    except Exception as e:
+        webcom.loginfo("Failed to update %s in the job catalog with errmsg=%s"%(jobid, str(e)), gen_errfile)
+#}}}
+def SubmitJob_API(seq, para_str, jobname, email, client_ip, hostname):#{{{
+    """Submit a job by the API, shared by the submitjob rpc and the JSON API
+    return [jobid, url, numseq_str, errinfo, warninfo], numseq_str is "0" if
+    para_str is not valid"""
+    seq = seq + "\n" #force add a new line for correct parsing the fasta file
+
+    jobid = "None"
+    url = "None"
+    try:
+        query_para = json.loads(para_str)
+    except ValueError as e:
+        return [jobid, url, "0", "Invalid para_str: %s\n"%(str(e)), ""]
+    if not isinstance(query_para, dict):
+        return [jobid, url, "0", "Invalid para_str: a JSON object is expected\n", ""]
+    if not webcom.ValidateParameter_PRODRES(query_para):
+        errinfo = query_para.get('errinfo', "")
+        if errinfo == "":
+            errinfo = (query_para.get('errinfo_br', "") +
+                    query_para.get('errinfo_content', ""))
+        if errinfo == "":
+            errinfo = "Invalid parameters in para_str\n"
+        return [jobid, url, "0", errinfo, ""]
+
+    seqinfo = dict(query_para)
+    filtered_seq = webcom.ValidateSeq(seq, seqinfo, g_params)
+    numseq_str = "%d"%(seqinfo['numseq'])
+    warninfo = seqinfo['warninfo']
+    errinfo = ""
+    if filtered_seq == "":
+        errinfo = seqinfo['errinfo']
+    else:
+        seqinfo['jobname'] = jobname
+        seqinfo['email'] = email
+        seqinfo['para_str'] = para_str
+        seqinfo['date'] = time.strftime(g_params['FORMAT_DATETIME'])
+        seqinfo['client_ip'] = client_ip
+        seqinfo['hostname'] = hostname
+        seqinfo['method_submission'] = "wsdl"
+        seqinfo['isForceRun'] = False  # disable isForceRun if submitted by WSDL
+        if not ApplyAdmission(seqinfo):
+            errinfo = seqinfo['errinfo']
+        else:
+            warninfo = seqinfo['warninfo']
+            jobid = RunQuery_wsdl(seq, filtered_seq, seqinfo)
+            if jobid == "":
+                errinfo = "Failed to submit your job to the queue\n"+seqinfo['errinfo']
+            else:
+                log_record = "%s\t%s\t%s\t%s\t%d\t%s\t%s\t%s\n"%(seqinfo['date'], jobid,
+                        seqinfo['client_ip'], seqinfo['numseq'],
+                        len(seq),seqinfo['jobname'], seqinfo['email'],
+                        seqinfo['method_submission'])
+                main_logfile_query = "%s/%s/%s"%(SITE_ROOT, "static/log", "submitted_seq.log")
+                myfunc.WriteFile(log_record, main_logfile_query, "a")
+
+                divided_logfile_query =  "%s/%s/%s"%(SITE_ROOT, "static/log/divided",
+                        "%s_submitted_seq.log"%(seqinfo['client_ip']))
+                if seqinfo['client_ip'] != "":
+                    myfunc.WriteFile(log_record, divided_logfile_query, "a")
+
+                url = "http://" + hostname + g_params['BASEURL'] + "result/%s"%(jobid)
+
+                file_seq_warning = "%s/%s/%s/%s"%(SITE_ROOT, "static/result", jobid, "query.warn.txt")
+                if seqinfo['warninfo'] != "":
+                    myfunc.WriteFile(seqinfo['warninfo'], file_seq_warning, "a")
+                errinfo = seqinfo['errinfo']
+
+    return [jobid, url, numseq_str, errinfo, warninfo]
+#}}}
+
+def DeleteJob_API(jobid):#{{{
+    """Delete the result folder of the job
+    return [status, errinfo]"""
+    if re.match(r"^[\w\-]+$", jobid) is None:
+        return ["Failed", "Invalid jobid %s"%(jobid)]
+    rstdir = "%s/%s"%(path_result, jobid)
+    status = "None"
+    errinfo = ""
+    try: 
+        shutil.rmtree(rstdir)
+        status = "Succeeded"
+        jobcatalog.DeleteJob(jobcatalog_db, [jobid])
+    except (OSError, sqlite3.Error) as e:
+        errinfo = str(e)
+        status = "Failed"
+    return [status, errinfo]
+#}}}
+def GetJobStatusList(jobidlist, hostname):#{{{
+    """Return a list of (jobid, status, url, errinfo) of the jobs, the status
+    is read from the job catalog, or from the tag files for jobs not in it"""
+    statusDict = {}
+    try:
+        statusDict = jobcatalog.GetStatus(jobcatalog_db, jobidlist)
+    except Exception as e:
+        webcom.loginfo("Failed to read the job catalog with errmsg=%s"%(str(e)), gen_errfile)
+    li = []
+    for jobid in jobidlist:
+        rstdir = "%s/%s"%(path_result, jobid)
+        status = statusDict.get(jobid)
+        if status is None and re.match(r"^[\w\-]+$", jobid) is not None:
+            status = jobcatalog.GetStatusFromTagFile(rstdir)
+        url = ""
+        errinfo = ""
+        if status is None:
+            status = "None"
+            errinfo = "Error! jobid %s does not exist."%(jobid)
+        elif status == "Failed":
+            errinfo = myfunc.ReadFile("%s/runjob.err"%(rstdir))
+        elif status == "Finished":
+            url = "http://" + hostname + "/static/" + "result/%s/%s.zip"%(jobid, jobid)
+        li.append((jobid, status, url, errinfo))
+    return li
+#}}}
+def RunCachedQuery(jobid, rstdir, tmpdir, filtered_seq, para_str, numseq):#{{{
+    """Finish a small job at once, without the queue, if the results of all
+    its sequences are in the cache
+    return True if the job is finished"""
+    if numseq < 1 or numseq > g_params['FAST_PATH_MAX_NUMSEQ']:
+        return False
+    try:
+        query_para = resultcache.ReadQueryPara(para_str)
+    except ValueError:
+        return False
+    recordlist = resultcache.ReadFastaRecord(filtered_seq)
+    if len(recordlist) != numseq:
+        return False
+    keylist = resultcache.GetCacheKeyList(recordlist, query_para, path_cache)
+    if keylist is None:
+        return False
+    sourcelist = resultcache.WriteCachedJob(rstdir, jobid, recordlist, keylist, path_cache)
+    if sourcelist is None:
+        return False
+    try:
+        cacheCountDict = {}
+        for source in sourcelist:
+            key = ("cache_hits", 'source="%s"'%(source))
+            cacheCountDict[key] = cacheCountDict.get(key, 0) + 1
+        serverstate.IncCounter(serverstate_db, cacheCountDict)
+        expiry.AddItem(expiry_db, rstdir)
+    except Exception as e:
+        webcom.loginfo("Failed to record the cached job %s with errmsg=%s"%(jobid, str(e)), gen_errfile)
+    UpdateJobCatalog(jobid, rstdir)
+    shutil.rmtree(tmpdir, ignore_errors=True)
+    return True
+#}}}
+def LinkOrCopyFile(srcfile, dstfile):#{{{
+    """Make dstfile a hard link of srcfile, or a copy if the link fails, e.g.
+    on another file system"""
+    try:
+        os.link(srcfile, dstfile)
+    except OSError:
+        shutil.copyfile(srcfile, dstfile)
+#}}}
+def ValidateUploadedQuery(query):#{{{
+    """Validate the uploaded file of the query as webcom.ValidateQuery does,
+    without reading it into memory. The file is written by chunks to
+    query.raw.fa and the valid sequences to query.fa in query['tmpdir'],
+    which is removed if the query is not valid"""
+    seqfile = query['seqfile']
+    for item in ['errinfo_br', 'errinfo_content', 'warninfo']:
+        query[item] = ""
+    if seqfile.size > g_params['MAXSIZE_UPLOAD_FILE_IN_BYTE']:
+        query['errinfo_br'] += "Size of uploaded file exceeds limit!"
+        query['errinfo_content'] += ("The file you uploaded exceeds the upper "
+                "limit %g Mb. Please split your file and upload again."%(
+                    g_params['MAXSIZE_UPLOAD_FILE_IN_MB']))
+        query['errinfo'] = query['errinfo_br'] + query['errinfo_content']
+        return False
+    tmpdir = tempfile.mkdtemp(prefix="%s/static/tmp/tmp_"%(SITE_ROOT))
+    rawseqfile = "%s/query.raw.fa"%(tmpdir)
+    try:
+        query['size_rawseq'] = seqvalidate.SaveUploadedFile(seqfile, rawseqfile)
+        isValid = seqvalidate.ValidateSeqFile(rawseqfile,
+                "%s/query.fa"%(tmpdir), query, g_params)
+    except (IOError, OSError) as e:
+        webcom.loginfo("Failed to read the uploaded file %s with errmsg=%s"%(
+            seqfile.name, str(e)), gen_errfile)
+        query['errinfo_content'] += ("Failed to read uploaded file \"%s\""%(
+            seqfile.name))
+        query['errinfo'] = query['errinfo_br'] + query['errinfo_content']
+        isValid = False
+    if isValid:
+        query['tmpdir'] = tmpdir
+    else:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return isValid
+#}}}
 def RunQuery(request, query):#{{{
     errmsg = []
-    tmpdir = tempfile.mkdtemp(prefix="%s/static/tmp/tmp_"%(SITE_ROOT))
+    # an uploaded query has been validated to query.raw.fa and query.fa in
+    # query['tmpdir'] (ValidateUploadedQuery)
+    isUploaded = 'tmpdir' in query
+    if isUploaded:
+        tmpdir = query['tmpdir']
+    else:
+        tmpdir = tempfile.mkdtemp(prefix="%s/static/tmp/tmp_"%(SITE_ROOT))
     rstdir = tempfile.mkdtemp(prefix="%s/static/result/rst_"%(SITE_ROOT))
     os.chmod(tmpdir, 0o755)
     os.chmod(rstdir, 0o755)
@@ -318,25 +626,47 @@ def RunQuery(request, query):#{{{
 
     jobinfo_str = "%s\t%s\t%s\t%s\t%d\t%s\t%s\t%s\n"%(query['date'], jobid,
             query['client_ip'], query['numseq'],
-            len(query['rawseq']),query['jobname'], query['email'],
+            query['size_rawseq'],query['jobname'], query['email'],
             query['method_submission'])
     errmsg.append(myfunc.WriteFile(jobinfo_str, jobinfofile, "w"))
-    errmsg.append(myfunc.WriteFile(query['rawseq'], rawseqfile, "w"))
-    errmsg.append(myfunc.WriteFile(query['filtered_seq'], seqfile_t, "w"))
-    errmsg.append(myfunc.WriteFile(query['filtered_seq'], seqfile_r, "w"))
+    if isUploaded:
+        shutil.move("%s/query.raw.fa"%(tmpdir), rawseqfile)
+        if query['numseq'] <= g_params['FAST_PATH_MAX_NUMSEQ']:
+            query['filtered_seq'] = myfunc.ReadFile(seqfile_t)
+        else:
+            query['filtered_seq'] = ""  # not needed, the job is too large for the fast path
+    else:
+        errmsg.append(myfunc.WriteFile(query['rawseq'], rawseqfile, "w"))
+        errmsg.append(myfunc.WriteFile(query['filtered_seq'], seqfile_t, "w"))
+    LinkOrCopyFile(seqfile_t, seqfile_r)
 
-    errmsg.append(myfunc.WriteFile(json.dumps(query_para, sort_keys=True), query_parafile, "w"))
+    para_str = json.dumps(query_para, sort_keys=True)
+    errmsg.append(myfunc.WriteFile(para_str, query_parafile, "w"))
+    AddToJobCatalog(jobid, query)
 
     base_www_url = "http://" + request.META['HTTP_HOST']
     query['base_www_url'] = base_www_url
 
+    # small jobs with all sequences cached are finished without the queue
+    if (not query['isForceRun'] and not query.get('isDeferred', False) and
+            RunCachedQuery(jobid, rstdir, tmpdir, query['filtered_seq'],
+                para_str, query['numseq'])):
+        return jobid
 
+
+    if query.get('isDeferred', False):
+        myfunc.WriteFile(query['date'], "%s/runjob.deferred"%(rstdir), "w")
+
+    # sequences of this user already in the queue plus this job, as recorded
+    # by the fair-share scheduler of qd_fe
+    user = fairshare.GetUserKey(query['email'], query['client_ip'])
+    query['numseq_this_user'] = fairshare.GetNumSeqThisUser(fairshare_db, user) + max(1, query['numseq'])
     if query['numseq'] < 0: #  do not submit job to the local queue
-        query['numseq_this_user'] = 1
-        SubmitQueryToLocalQueue(query, tmpdir, rstdir, isOnlyGetCache=False)
+        SubmitQueryToLocalQueue(query, tmpdir, rstdir, isOnlyGetCache=False,
+                isAsync=True)
     else: #all other jobs are submitted to the frontend with isOnlyGetCache=True
-        query['numseq_this_user'] = 1
-        SubmitQueryToLocalQueue(query, tmpdir, rstdir, isOnlyGetCache=True)
+        SubmitQueryToLocalQueue(query, tmpdir, rstdir, isOnlyGetCache=True,
+                isAsync=True)
 
 
     forceruntagfile = "%s/forcerun"%(rstdir)
@@ -370,12 +700,21 @@ def RunQuery_wsdl(rawseq, filtered_seq, seqinfo):#{{{
     errmsg.append(myfunc.WriteFile(rawseq, rawseqfile, "w"))
     errmsg.append(myfunc.WriteFile(para_str, query_parafile, "w"))
     errmsg.append(myfunc.WriteFile(filtered_seq, seqfile_t, "w"))
-    errmsg.append(myfunc.WriteFile(filtered_seq, seqfile_r, "w"))
+    LinkOrCopyFile(seqfile_t, seqfile_r)
+    AddToJobCatalog(jobid, seqinfo)
     base_www_url = "http://" + seqinfo['hostname']
     seqinfo['base_www_url'] = base_www_url
 
-    seqinfo['numseq_this_user'] = 1
-    SubmitQueryToLocalQueue(seqinfo, tmpdir, rstdir, isOnlyGetCache=True)
+    if (not seqinfo['isForceRun'] and not seqinfo.get('isDeferred', False) and
+            RunCachedQuery(jobid, rstdir, tmpdir, filtered_seq, para_str, numseq)):
+        return jobid
+
+    if seqinfo.get('isDeferred', False):
+        myfunc.WriteFile(seqinfo['date'], "%s/runjob.deferred"%(rstdir), "w")
+    user = fairshare.GetUserKey(seqinfo['email'], seqinfo['client_ip'])
+    seqinfo['numseq_this_user'] = fairshare.GetNumSeqThisUser(fairshare_db, user) + max(1, numseq)
+    SubmitQueryToLocalQueue(seqinfo, tmpdir, rstdir, isOnlyGetCache=True,
+            isAsync=True)
 
     # changed 2015-03-26, any jobs submitted via wsdl is hadndel
     return jobid
@@ -407,7 +746,8 @@ def RunQuery_wsdl_local(rawseq, filtered_seq, seqinfo):#{{{
     errmsg.append(myfunc.WriteFile(rawseq, rawseqfile, "w"))
     errmsg.append(myfunc.WriteFile(para_str, query_parafile, "w"))
     errmsg.append(myfunc.WriteFile(filtered_seq, seqfile_t, "w"))
-    errmsg.append(myfunc.WriteFile(filtered_seq, seqfile_r, "w"))
+    LinkOrCopyFile(seqfile_t, seqfile_r)
+    AddToJobCatalog(jobid, seqinfo)
     base_www_url = "http://" + seqinfo['hostname']
     seqinfo['base_www_url'] = base_www_url
 
@@ -417,36 +757,39 @@ def RunQuery_wsdl_local(rawseq, filtered_seq, seqinfo):#{{{
     else:
         return jobid
 #}}}
-def SubmitQueryToLocalQueue(query, tmpdir, rstdir, isOnlyGetCache=False):#{{{
-    scriptfile = "%s/app/submit_job_to_queue.py"%(SITE_ROOT)
+def SubmitQueryToLocalQueue(query, tmpdir, rstdir, isOnlyGetCache=False,#{{{
+        isAsync=False):
+    """Submit the job to the local queue in the process, by the submission
+    worker thread if isAsync and SUBMIT_ASYNC are set, in which case 0 is
+    returned at once. Return 0 on success, the job is tagged as failed
+    otherwise"""
     rstdir = "%s/%s"%(path_result, query['jobid'])
     runjob_errfile = "%s/runjob.err"%(rstdir)
     runjob_logfile = "%s/%s"%(rstdir, "runjob.log")
     failedtagfile = "%s/%s"%(rstdir, "runjob.failed")
-    debugfile = "%s/debug.log"%(rstdir) #this log only for debugging
-    logfile = "%s/runjob.log"%(rstdir)
-    rmsg = ""
-
-    cmd = [python_exec, scriptfile, "-nseq", "%d"%query['numseq'], "-nseq-this-user",
-            "%d"%query['numseq_this_user'], "-jobid", query['jobid'],
-            "-outpath", rstdir, "-datapath", tmpdir, "-baseurl",
-            query['base_www_url'] ]
-    if query['email'] != "":
-        cmd += ["-email", query['email']]
-    if query['client_ip'] != "":
-        cmd += ["-host", query['client_ip']]
-    if query['isForceRun']:
-        cmd += ["-force"]
-    if isOnlyGetCache:
-        cmd += ["-only-get-cache"]
-
-    (isSuccess, t_runtime) = webcom.RunCmd(cmd, runjob_logfile, runjob_errfile)
-    if not isSuccess:
-        webcom.WriteDateTimeTagFile(failedtagfile, runjob_logfile, runjob_errfile)
-        return 1
-    else:
+    jobid = query['jobid']
+
+    args = (jobid, tmpdir, rstdir, query['numseq'],
+            query.get('numseq_this_user', -1), query['email'],
+            query['client_ip'], query['base_www_url'])
+    kwargs = {'isForceRun': query['isForceRun'], 'isOnlyGetCache': isOnlyGetCache}
+
+    def OnSubmitted(status):
+        if status != 0:
+            webcom.WriteDateTimeTagFile(failedtagfile, runjob_logfile, runjob_errfile)
+            UpdateJobCatalog(jobid, rstdir)
+            return 1
         return 0
 
+    if isAsync and g_params['SUBMIT_ASYNC']:
+        submit_job_to_queue.SubmitJobToQueueAsync(OnSubmitted, *args, **kwargs)
+        return 0
+    try:
+        status = submit_job_to_queue.SubmitJobToQueue(*args, **kwargs)
+    except Exception as e:
+        webcom.loginfo("SubmitJobToQueue failed with errmsg=%s"%(str(e)), runjob_errfile)
+        status = 1
+    return OnSubmitted(status)
 #}}}
 
 def thanks(request):#{{{
@@ -454,25 +797,140 @@ def thanks(request):#{{{
     return HttpResponse("Thanks")
 #}}}
 
+def DateDiff(begin_date_str, end_date_str):#{{{
+    """Return the time between two dates as shown in the job lists, or "" """
+    try:
+        begin_date = webcom.datetime_str_to_time(begin_date_str)
+        if end_date_str == "":
+            end_date = datetime.now(timezone(TZ))
+        else:
+            end_date = webcom.datetime_str_to_time(end_date_str)
+    except ValueError:
+        return ""
+    return myfunc.date_diff(begin_date, end_date)
+#}}}
+def GetJobListInfo(request, status):#{{{
+    """Info of the job list page of the jobs with the status, read by page
+    ?page= from the job catalog. Super users see all jobs, other users the
+    jobs submitted from their IP. Finished and failed jobs are shown within
+    MAX_DAYS_TO_SHOW days, the newest first, waiting and running jobs the
+    oldest first. Super users can select the jobs by ?ip= and ?email="""
+    info = {}
+    webcom.set_basic_config(request, info, g_params)
+    isSuperUser = info.get('isSuperUser', False)
+    client_ip = None if isSuperUser else info.get('client_ip', "")
+    email = None
+    if isSuperUser:
+        # super users can select the jobs of an IP or an email
+        client_ip = request.GET.get('ip') or None
+        email = request.GET.get('email') or None
+    isFinished = status in ["Finished", "Failed"]
+    min_submit_date = ""
+    if isFinished and g_params['MAX_DAYS_TO_SHOW'] < 36500:
+        min_submit_date = (datetime.now(timezone(TZ)) -
+                timedelta(days=g_params['MAX_DAYS_TO_SHOW'])).strftime("%Y-%m-%d %H:%M:%S")
+    num_job_per_page = g_params['NUM_JOBS_PER_PAGE']
+    try:
+        page = max(1, int(request.GET.get('page', '1')))
+    except ValueError:
+        page = 1
+
+    joblist = []
+    num_job = 0
+    try:
+        num_job = jobcatalog.CountJob(jobcatalog_db, status, client_ip, email,
+                min_submit_date)
+        num_page = max(1, (num_job + num_job_per_page - 1)//num_job_per_page)
+        page = min(page, num_page)
+        joblist = jobcatalog.GetJobList(jobcatalog_db, status,
+                (page-1)*num_job_per_page, num_job_per_page, client_ip, email,
+                min_submit_date, isNewestFirst=isFinished)
+    except sqlite3.Error as e:
+        webcom.loginfo("Failed to read the job catalog with errmsg=%s"%(str(e)), gen_errfile)
+        info['errmsg'] = "Failed to read the list of jobs, please try again later"
+    num_page = max(1, (num_job + num_job_per_page - 1)//num_job_per_page)
+
+    header = ["No.", "JobID", "JobName", "NumSeq", "Email"]
+    if isSuperUser:
+        header.append("Host")
+    header += ["QueueTime", "RunTime", "SubmitDate"]
+    if isFinished:
+        header.append("FinishDate")
+    header.append("Source")
+    content = []
+    for i in range(len(joblist)):
+        job = joblist[i]
+        row = ["%d"%((page-1)*num_job_per_page + i + 1), job['jobid'],
+                job['jobname'], job['numseq'], job['email']]
+        if isSuperUser:
+            row.append(job['client_ip'])
+        if status == "Wait":
+            row += [DateDiff(job['submit_date'], ""), ""]
+        elif status == "Running":
+            row += [DateDiff(job['submit_date'], job['start_date']),
+                    DateDiff(job['start_date'], "")]
+        else:
+            row += [DateDiff(job['submit_date'], job['start_date']),
+                    DateDiff(job['start_date'], job['finish_date'])]
+        row.append(job['submit_date'])
+        if isFinished:
+            row.append(job['finish_date'])
+        row.append(job['method_submission'])
+        content.append(row)
+
+    info['header'] = header
+    info['content'] = content
+    info['num_job'] = num_job
+    info['page'] = page
+    info['num_page'] = num_page
+    info['prev_page'] = page - 1 if page > 1 else 0
+    info['next_page'] = page + 1 if page < num_page else 0
+    info['query_filter'] = "".join(["&%s=%s"%(key, urllib.parse.quote(value))
+        for (key, value) in [('ip', client_ip), ('email', email)]
+        if isSuperUser and value is not None])
+    info['MAX_DAYS_TO_SHOW'] = g_params['MAX_DAYS_TO_SHOW']
+    info['BASEURL'] = g_params['BASEURL']
+    info['jobcounter'] = GetJobCounter(info)
+    return info
+#}}}
 def get_queue(request):# {{{
-    info = webcom.get_queue(request, g_params)
+    info = GetJobListInfo(request, "Wait")
     return render(request, 'pred/queue.html', info)
 # }}}
 def get_running(request):# {{{
-    info = webcom.get_running(request, g_params)
+    info = GetJobListInfo(request, "Running")
     return render(request, 'pred/running.html', info)
 # }}}
 def get_finished_job(request):# {{{
-    info = webcom.get_finished_job(request, g_params)
+    info = GetJobListInfo(request, "Finished")
     return render(request, 'pred/finished_job.html', info)
 # }}}
 def get_failed_job(request):# {{{
-    info = webcom.get_finished_job(request, g_params)
+    info = GetJobListInfo(request, "Failed")
     return render(request, 'pred/failed_job.html', info)
 # }}}
 
 def get_countjob_country(request):# {{{
-    info = webcom.get_countjob_country(request, g_params)
+    """Finished jobs by country, from the per-IP rollups of incstat, or from
+    the job logs by webcom until qd_fe has added the existing logs to the
+    rollups"""
+    try:
+        isPopulated = incstat.IsPopulated(incstat_db)
+    except sqlite3.Error as e:
+        webcom.loginfo("Failed to read %s with errmsg=%s"%(incstat_db, str(e)), gen_errfile)
+        isPopulated = False
+    if not isPopulated:
+        info = webcom.get_countjob_country(request, g_params)
+        return render(request, 'pred/countjob_country.html', info)
+    info = {}
+    webcom.set_basic_config(request, info, g_params)
+    info['li_countjob_country_header'] = ["Country", "Numjob", "NumSeq", "NumIP"]
+    info['li_countjob_country'] = []
+    try:
+        info['li_countjob_country'] = incstat.GetCountryStat(incstat_db)
+    except sqlite3.Error as e:
+        webcom.loginfo("Failed to read %s with errmsg=%s"%(incstat_db, str(e)), gen_errfile)
+    info['jobcounter'] = GetJobCounter(info)
     return render(request, 'pred/countjob_country.html', info)
 # }}}
 def get_help(request):# {{{
@@ -492,20 +950,47 @@ def help_wsdl_api(request):# {{{
 def get_serverstatus(request):# {{{
     g_params['isShowLocalQueue'] = False
     info = webcom.get_serverstatus(request, g_params)
+    # the totals of the finished jobs are read from the rollups of incstat,
+    # which cover the archived logs as well, once they have been added
+    try:
+        if incstat.IsPopulated(incstat_db):
+            summary = incstat.GetSummary(incstat_db)
+            for key in ['num_finished_seqs', 'num_finished_jobs',
+                    'num_finished_jobs_web', 'num_finished_jobs_wsdl',
+                    'num_unique_ip', 'num_unique_country']:
+                info['%s_str'%(key)] = "{:,}".format(summary[key])
+            if summary['startdate'] != "":
+                info['startdate'] = summary['startdate']
+    except sqlite3.Error as e:
+        webcom.loginfo("Failed to read %s with errmsg=%s"%(incstat_db, str(e)), gen_errfile)
     return render(request, 'pred/serverstatus.html', info)
 # }}}
+def get_metrics(request):# {{{
+    """Metrics in the Prometheus text format, read from the state written by
+    qd_fe and run_job, see app/serverstate.py"""
+    loadDict = admission.ReadServerLoad(loadfile, max_age=float('inf'))
+    phaseStatDict = {}
+    for statfile in glob.glob("%s/qd_fe_phase.*.json"%(path_log)):
+        statDict = phaseprof.ReadStatFile(statfile)
+        if (statDict is not None and
+                time.time() - statDict['update_epoch'] <= g_params['METRICS_MAX_STATE_AGE']):
+            worker = os.path.basename(statfile)[len("qd_fe_phase."):-len(".json")]
+            phaseStatDict[worker] = statDict
+    content = serverstate.GetMetricsText(serverstate_db, loadDict, phaseStatDict)
+    return HttpResponse(content, content_type="text/plain; version=0.0.4; charset=utf-8")
+# }}}
 
 
 def get_reference(request):#{{{
     info = {}
     webcom.set_basic_config(request, info, g_params)
-    info['jobcounter'] = webcom.GetJobCounter(info)
+    info['jobcounter'] = GetJobCounter(info)
     return render(request, 'pred/reference.html', info)
 #}}}
 def get_example(request):#{{{
     info = {}
     webcom.set_basic_config(request, info, g_params)
-    info['jobcounter'] = webcom.GetJobCounter(info)
+    info['jobcounter'] = GetJobCounter(info)
     return render(request, 'pred/example.html', info)
 #}}}
 def oldserver(request):#{{{
@@ -534,13 +1019,13 @@ def download(request):#{{{
         size_database_str = myfunc.Size_byte2human(size_database)
         info['size_database'] = size_database_str
 
-    info['jobcounter'] = webcom.GetJobCounter(info)
+    info['jobcounter'] = GetJobCounter(info)
     return render(request, 'pred/download.html', info)
 #}}}
 def privacy(request):#{{{
     info = {}
     webcom.set_basic_config(request, info, g_params)
-    info['jobcounter'] = webcom.GetJobCounter(info)
+    info['jobcounter'] = GetJobCounter(info)
     return render(request, 'pred/privacy.html', info)
 #}}}
 
@@ -724,78 +1209,47 @@ def get_results(request, jobid="1"):#{{{
     num_finished = 0
     cntnewrun = 0
     cntcached = 0
-    newrun_table_list = [] # this is used for calculating the remaining time
+    resultindex_db = resultindex.GetDBFile(rstdir)
+    progress_cursor = 0
+    num_row_per_page = g_params['MAX_ROWS_TO_SHOW_IN_TABLE']
+    try:
+        page = max(1, int(request.GET.get('page', '1')))
+    except ValueError:
+        page = 1
+    num_page = 1
 # get seqid_index_map
     if os.path.exists(finished_seq_file):
         resultdict['index_table_header'] = ["No.", "Length", "PSSM", "HMM",
                 "RunTime(s)", "SequenceName", "Source", "FinishDate" ]
+        if not 'second_method' in query_para:
+            date_str = time.strftime(g_params['FORMAT_DATETIME'])
+            myfunc.WriteFile("[%s] second_method does not find in query_parafile %s\n"%(
+                date_str, query_parafile), gen_errfile, "a", True)
         index_table_content_list = []
-        indexmap_content = myfunc.ReadFile(finished_seq_file).split("\n")
-        cnt = 0
-        for line in indexmap_content:
-            pssm_resultfile_list = []
-            hmm_resultfile_list = []
-            strs = line.split("\t")
-            if len(strs)>=7:
-                subfolder = strs[0]
-                length_str = strs[1]
-                source = strs[4]
-                try:
-                    finishdate = strs[7]
-                except IndexError:
-                    finishdate = "N/A"
-                try:
-                    if query_para['second_method'] == "psiblast":
-                        filelist = [
-                                "%s/%s/%s/outputs/%s"%(rstdir, jobid, subfolder, "psiOutput.txt"),
-                                "%s/%s/%s/outputs/%s"%(rstdir, jobid, subfolder, "psiPSSM.txt")]
-                        for f in filelist:
-                            if os.path.exists(f):
-                                fsize = os.path.getsize(f)
-                                fsize_str = myfunc.Size_byte2human(fsize)
-                                pssm_resultfile_list.append((os.path.basename(f), fsize_str))
-                    elif query_para['second_method'] == "jackhmmer":
-                        filelist = [
-                                "%s/%s/%s/outputs/%s"%(rstdir, jobid, subfolder, "hmmOut.txt"),
-                                "%s/%s/%s/outputs/%s"%(rstdir, jobid, subfolder, "Alignment.txt"),
-                                "%s/%s/%s/outputs/%s"%(rstdir, jobid, subfolder, "tableOut.txt"),
-                                "%s/%s/%s/outputs/%s"%(rstdir, jobid, subfolder, "fullOut.txt")]
-                        for f in filelist:
-                            if os.path.exists(f):
-                                fsize = os.path.getsize(f)
-                                fsize_str = myfunc.Size_byte2human(fsize)
-                                hmm_resultfile_list.append((os.path.basename(f), fsize_str))
-                except KeyError:
-                    date_str = time.strftime(g_params['FORMAT_DATETIME'])
-                    myfunc.WriteFile("[%s] second_method does not find in query_parafile %s\n"%(
-                        date_str, query_parafile), gen_errfile, "a", True)
-                    pass
-
-                try:
-                    runtime_in_sec_str = "%.1f"%(float(strs[5]))
-                    if source == "newrun":
-                        sum_run_time += float(strs[5])
-                        cntnewrun += 1
-                    elif source == "cached":
-                        cntcached += 1
-                except:
-                    runtime_in_sec_str = ""
-                desp = strs[6]
-                rank = "%d"%(cnt+1)
-                if cnt < g_params['MAX_ROWS_TO_SHOW_IN_TABLE']:
-                    index_table_content_list.append([rank, length_str, pssm_resultfile_list,
-                        hmm_resultfile_list, runtime_in_sec_str, desp[:30], subfolder, source, finishdate])
-                if source == "newrun":
-                    newrun_table_list.append([rank, subfolder])
-                cnt += 1
+        try:
+            resultindex.Update(resultindex_db, "%s/%s"%(rstdir, jobid),
+                    query_para.get('second_method'))
+            summaryDict = resultindex.GetSummary(resultindex_db)
+            num_finished = summaryDict['num_finished']
+            cntnewrun = summaryDict['cnt_newrun']
+            cntcached = summaryDict['cnt_cached']
+            sum_run_time = summaryDict['sum_run_time']
+            progress_cursor = summaryDict['offset']
+            num_page = max(1, (num_finished + num_row_per_page - 1)//num_row_per_page)
+            page = min(page, num_page)
+            index_table_content_list = resultindex.GetPage(resultindex_db,
+                    (page-1)*num_row_per_page, num_row_per_page)
+        except (sqlite3.Error, OSError) as e:
+            date_str = time.strftime(g_params['FORMAT_DATETIME'])
+            myfunc.WriteFile("[%s] Failed to read the result index of %s with errmsg=%s\n"%(
+                date_str, jobid, str(e)), gen_errfile, "a", True)
         if cntnewrun > 0:
             average_run_time = sum_run_time / cntnewrun
 
         resultdict['index_table_content_list'] = index_table_content_list
         resultdict['indexfiletype'] = "finishedfile"
-        resultdict['num_finished'] = cnt
-        num_finished = cnt
-        resultdict['percent_finished'] = "%.1f"%(float(cnt)/numseq*100)
+        resultdict['num_finished'] = num_finished
+        resultdict['percent_finished'] = "%.1f"%(float(num_finished)/numseq*100)
     else:
         resultdict['index_table_header'] = []
         resultdict['index_table_content_list'] = []
@@ -803,6 +1257,18 @@ def get_results(request, jobid="1"):#{{{
         resultdict['num_finished'] = 0
         resultdict['percent_finished'] = "%.1f"%(0.0)
 
+    page = min(page, num_page)
+    resultdict['page'] = page
+    resultdict['num_page'] = num_page
+    resultdict['first_row_in_page'] = min(num_finished, (page-1)*num_row_per_page+1)
+    resultdict['last_row_in_page'] = min(num_finished, page*num_row_per_page)
+    resultdict['prev_page'] = page - 1 if page > 1 else 0
+    resultdict['next_page'] = page + 1 if page < num_page else 0
+    resultdict['progress_cursor'] = progress_cursor
+    resultdict['isProgressSSE'] = g_params['PROGRESS_SSE']
+    resultdict['progress_poll_interval'] = g_params['PROGRESS_POLL_INTERVAL']
+    resultdict['num_row_per_page'] = num_row_per_page
+
     num_remain = numseq - num_finished
 
     time_remain_in_sec = numseq * 5 # set default value
@@ -830,9 +1296,13 @@ def get_results(request, jobid="1"):#{{{
                     idx_firstinwindow = 0
                     numjob_in_window = cntnewrun
 
-                jobid_firstinwindow = newrun_table_list[idx_firstinwindow][1]
+                try:
+                    jobid_firstinwindow = resultindex.GetNewRunSubfolder(resultindex_db,
+                            idx_firstinwindow)
+                except sqlite3.Error:
+                    jobid_firstinwindow = None
                 seqfile_firstinwindow = "%s/%s/%s/%s"%(rstdir, jobid, jobid_firstinwindow, "seq.fa")
-                if os.path.exists(seqfile_firstinwindow):
+                if jobid_firstinwindow is not None and os.path.exists(seqfile_firstinwindow):
                     modtime_first = os.path.getmtime(seqfile_firstinwindow)
                     avg_newrun_time = (time_now - modtime_first)/numjob_in_window
 
@@ -861,7 +1331,7 @@ def get_results(request, jobid="1"):#{{{
 
     resultdict['MAX_ROWS_TO_SHOW_IN_TABLE'] = g_params['MAX_ROWS_TO_SHOW_IN_TABLE']
 
-    resultdict['jobcounter'] = webcom.GetJobCounter(resultdict)
+    resultdict['jobcounter'] = GetJobCounter(resultdict)
     return render(request, 'pred/get_results.html', resultdict)
 #}}}
 def get_results_eachseq(request, jobid="1", seqindex="1"):#{{{
@@ -911,10 +1381,231 @@ def get_results_eachseq(request, jobid="1", seqindex="1"):#{{{
     else:
         resultdict['resultfile'] = ""
 
-    resultdict['jobcounter'] = webcom.GetJobCounter(resultdict)
+    resultdict['jobcounter'] = GetJobCounter(resultdict)
     return render(request, 'pred/get_results_eachseq.html', resultdict)
 #}}}
 
+def ReadSecondMethod(rstdir):#{{{
+    query_parafile = "%s/query.para.txt"%(rstdir)
+    try:
+        return json.loads(myfunc.ReadFile(query_parafile)).get('second_method')
+    except (ValueError, AttributeError):
+        return None
+#}}}
+def ReadFinishedSeq(jobid, cursor, second_method, base_www_url):#{{{
+    """Read the sequences appended to finished_seqs.txt of the job after the
+    byte offset cursor, at most PROGRESS_MAX_READ_SIZE bytes
+    return (seqlist, cursor, isReset, file_size), each item of seqlist is
+    the dict of resultindex.ParseFinishedLine with the output files, their
+    urls and the cursor after the sequence"""
+    outpath_result = "%s/%s/%s"%(path_result, jobid, jobid)
+    finished_seq_file = "%s/finished_seqs.txt"%(outpath_result)
+    url_result = "%s/static/result/%s/%s"%(base_www_url, jobid, jobid)
+    seqlist = []
+    isReset = False
+    try:
+        st = os.stat(finished_seq_file)
+    except OSError:
+        return (seqlist, cursor, isReset, 0)
+    if cursor > st.st_size:
+        # not a cursor of this file, start again from the beginning
+        cursor = 0
+        isReset = True
+    (lines, inode, end) = logtail.ReadNewLines(finished_seq_file,
+            st.st_ino, cursor, max_size=g_params['PROGRESS_MAX_READ_SIZE'])
+    for line in lines:
+        cursor += len(line.encode('utf-8')) + 1
+        seqDict = resultindex.ParseFinishedLine(line)
+        if seqDict is None:
+            continue
+        subfolder = seqDict['subfolder']
+        url_seq = "%s/%s"%(url_result, subfolder)
+        (pssm_files, hmm_files) = resultindex.GetOutputFileList(
+                "%s/%s"%(outpath_result, subfolder), second_method)
+        seqDict['pssm_files'] = pssm_files
+        seqDict['hmm_files'] = hmm_files
+        seqDict['url_seq'] = "%s/seq.fa"%(url_seq)
+        seqDict['url_files'] = ["%s/outputs/%s"%(url_seq, name) for (name, size_str)
+                in pssm_files + hmm_files]
+        seqDict['cursor'] = cursor
+        seqlist.append(seqDict)
+    return (seqlist, end, isReset, st.st_size)
+#}}}
+def get_progress(request, jobid="1"):#{{{
+    """Sequences of the job finished since the byte offset ?cursor= in
+    finished_seqs.txt, in JSON. The returned cursor is to be given in the
+    next request, at most PROGRESS_MAX_READ_SIZE bytes are read per request
+    """
+    if re.match(r"^[\w\-]+$", jobid) is None:
+        return HttpResponse(json.dumps({'errinfo': "Invalid jobid %s"%(jobid)}),
+                content_type="application/json", status=400)
+    try:
+        cursor = max(0, int(request.GET.get('cursor', '0')))
+    except ValueError:
+        return HttpResponse(json.dumps({'errinfo': "Invalid cursor"}),
+                content_type="application/json", status=400)
+    rstdir = "%s/%s"%(path_result, jobid)
+    base_www_url = "http://" + request.META['HTTP_HOST']
+
+    status = jobcatalog.GetStatusFromTagFile(rstdir)
+    if status is None:
+        return HttpResponse(json.dumps({'jobid': jobid, 'status': "None",
+            'errinfo': "Error! jobid %s does not exist."%(jobid)}),
+            content_type="application/json", status=404)
+
+    (seqlist, cursor, isReset, file_size) = ReadFinishedSeq(jobid, cursor,
+            ReadSecondMethod(rstdir), base_www_url)
+
+    resultdict = {}
+    resultdict['jobid'] = jobid
+    resultdict['status'] = status
+    resultdict['cursor'] = cursor
+    resultdict['isReset'] = isReset
+    resultdict['isComplete'] = (status in ["Finished", "Failed"] and cursor >= file_size)
+    resultdict['seqlist'] = seqlist
+    if status == "Finished":
+        resultdict['url_zip'] = "%s/static/result/%s/%s.zip"%(base_www_url, jobid, jobid)
+    return HttpResponse(json.dumps(resultdict), content_type="application/json")
+#}}}
+def stream_progress(request, jobid="1"):#{{{
+    """Server-sent events of the progress of the job, as get_progress
+      - event "status" when the status of the job changes
+      - event "seq" for each newly finished sequence, with the cursor after
+        the sequence as the event id, so that the browser resumes from it
+        when reconnecting (Last-Event-ID)
+      - event "end" when the job is finished or failed and all its
+        sequences have been sent
+    The stream is closed after SSE_MAX_DURATION seconds, the browser then
+    reconnects. A stream holds a web worker while it is open, so it is
+    served only if PROGRESS_SSE is set, for async deployments. Otherwise the
+    result page polls get_progress"""
+    if not g_params['PROGRESS_SSE']:
+        return HttpResponse("Progress stream is not enabled", status=404)
+    if re.match(r"^[\w\-]+$", jobid) is None:
+        return HttpResponse("Invalid jobid %s"%(jobid), status=400)
+    try:
+        cursor = max(0, int(request.META.get('HTTP_LAST_EVENT_ID',
+            request.GET.get('cursor', '0'))))
+    except ValueError:
+        return HttpResponse("Invalid cursor", status=400)
+    rstdir = "%s/%s"%(path_result, jobid)
+    base_www_url = "http://" + request.META['HTTP_HOST']
+    second_method = ReadSecondMethod(rstdir)
+
+    def EventStream(cursor):
+        begin = time.time()
+        last_send = begin
+        last_status = ""
+        yield "retry: %d\n\n"%(g_params['SSE_RETRY_INTERVAL']*1000)
+        while True:
+            status = jobcatalog.GetStatusFromTagFile(rstdir)
+            if status is None:
+                status = "None"
+            (seqlist, cursor, isReset, file_size) = ReadFinishedSeq(jobid, cursor,
+                    second_method, base_www_url)
+            eventlist = []
+            if status != last_status:
+                eventlist.append("event: status\ndata: %s\n\n"%(json.dumps(
+                    {'status': status, 'isReset': isReset})))
+                last_status = status
+            for seqDict in seqlist:
+                eventlist.append("event: seq\nid: %d\ndata: %s\n\n"%(
+                    seqDict['cursor'], json.dumps(seqDict)))
+            if status in ["Finished", "Failed", "None"] and cursor >= file_size:
+                eventlist.append("event: end\ndata: %s\n\n"%(json.dumps({'status': status})))
+            if len(eventlist) > 0:
+                last_send = time.time()
+                yield "".join(eventlist)
+                if eventlist[-1].startswith("event: end"):
+                    return
+            elif time.time() - last_send >= g_params['SSE_KEEPALIVE_INTERVAL']:
+                last_send = time.time()
+                yield ": keepalive\n\n"
+            if time.time() - begin >= g_params['SSE_MAX_DURATION']:
+                return
+            time.sleep(g_params['SSE_POLL_INTERVAL'])
+
+    response = StreamingHttpResponse(EventStream(cursor), content_type="text/event-stream")
+    response['Cache-Control'] = "no-cache"
+    response['X-Accel-Buffering'] = "no"
+    return response
+#}}}
+
+@csrf_exempt
+def check_jobs(request):#{{{
+    """Status of the jobs given by jobid=<jobid>, repeated or separated by
+    commas, in JSON, the same as the checkjobs rpc"""
+    jobidlist = []
+    for item in request.GET.getlist('jobid') + request.POST.getlist('jobid'):
+        jobidlist += [jobid for jobid in item.split(",") if jobid != ""]
+    jobidlist = jobidlist[:g_params['MAX_JOBID_PER_CHECK']]
+    joblist = []
+    for (jobid, status, url, errinfo) in GetJobStatusList(jobidlist,
+            request.META['HTTP_HOST']):
+        joblist.append({'jobid': jobid, 'status': status, 'url': url,
+            'errinfo': errinfo})
+    return HttpResponse(json.dumps({'joblist': joblist}), content_type="application/json")
+#}}}
+
+def ApiResponse(resultdict, status=200):#{{{
+    return HttpResponse(json.dumps(resultdict), content_type="application/json",
+            status=status)
+#}}}
+@csrf_exempt
+def api_submitjob(request):#{{{
+    """JSON API of the submitjob rpc, POST with seq, para_str, jobname and
+    email"""
+    if request.method != 'POST':
+        return ApiResponse({'errinfo': "Use POST to submit a job"}, status=405)
+    (jobid, url, numseq_str, errinfo, warninfo) = SubmitJob_API(
+            request.POST.get('seq', ""), request.POST.get('para_str', "{}"),
+            request.POST.get('jobname', ""), request.POST.get('email', ""),
+            request.META.get('REMOTE_ADDR', ""), request.META.get('HTTP_HOST', ""))
+    return ApiResponse({'jobid': jobid, 'url': url, 'numseq': numseq_str,
+        'errinfo': errinfo, 'warninfo': warninfo})
+#}}}
+def api_checkjob(request, jobid="1"):#{{{
+    """JSON API of the checkjob rpc"""
+    (jobid, status, url, errinfo) = GetJobStatusList([jobid],
+            request.META.get('HTTP_HOST', ""))[0]
+    return ApiResponse({'jobid': jobid, 'status': status, 'url': url,
+        'errinfo': errinfo})
+#}}}
+@csrf_exempt
+def api_deletejob(request, jobid="1"):#{{{
+    """JSON API of the deletejob rpc, POST or DELETE with the email given at
+    the submission. A job submitted without email may only be deleted from
+    the IP address it was submitted from. The deletejob rpc of the SOAP api,
+    called by the front-end on the compute nodes, is not restricted"""
+    if request.method not in ['POST', 'DELETE']:
+        return ApiResponse({'errinfo': "Use POST or DELETE to delete a job"}, status=405)
+    if request.method == 'POST':
+        email = request.POST.get('email', "")
+    else:
+        email = QueryDict(request.body).get('email', request.GET.get('email', ""))
+    try:
+        submitter = jobcatalog.GetSubmitter(jobcatalog_db, jobid)
+    except sqlite3.Error as e:
+        webcom.loginfo("Failed to read the job catalog with errmsg=%s"%(str(e)), gen_errfile)
+        return ApiResponse({'jobid': jobid, 'status': "Failed",
+            'errinfo': "Failed to read the job catalog"}, status=503)
+    if submitter is None:
+        return ApiResponse({'jobid': jobid, 'status': "Failed",
+            'errinfo': "Error! jobid %s does not exist."%(jobid)}, status=404)
+    (submit_email, submit_ip) = submitter
+    if submit_email != "":
+        isAllowed = (email.strip().lower() == submit_email.strip().lower())
+    else:
+        isAllowed = (submit_ip != "" and
+                request.META.get('REMOTE_ADDR', "") == submit_ip)
+    if not isAllowed:
+        return ApiResponse({'jobid': jobid, 'status': "Failed",
+            'errinfo': "Give the email used at the submission to delete the job"},
+            status=403)
+    (status, errinfo) = DeleteJob_API(jobid)
+    return ApiResponse({'jobid': jobid, 'status': status, 'errinfo': errinfo})
+#}}}
+
 
 # enabling wsdl service
 
@@ -929,68 +1620,10 @@ class Service_submitseq(ServiceBase):
     @rpc(Unicode,  Unicode, Unicode, Unicode,  _returns=Iterable(Unicode))
 # submit job to the front-end
     def submitjob(ctx, seq="", para_str="", jobname="", email=""):#{{{
-        seq = seq + "\n" #force add a new line for correct parsing the fasta file
-
-        seqinfo = {}
-        query_para = json.loads(para_str)
-        is_valid_parameter = webcom.ValidateParameter_PRODRES(query_para)
-        seqinfo.update(query_para)
-
-        filtered_seq = ""
-        if is_valid_parameter:
-            filtered_seq = webcom.ValidateSeq(seq, seqinfo, g_params)
-        jobid = "None"
-        url = "None"
-        numseq_str = "%d"%(seqinfo['numseq'])
-        warninfo = seqinfo['warninfo']
-        errinfo = ""
-        if filtered_seq == "":
-            errinfo = seqinfo['errinfo']
-        else:
-            soap_req = ctx.transport.req
-            try:
-                client_ip = soap_req.META['REMOTE_ADDR']
-            except:
-                client_ip = ""
-
-            try:
-                hostname = soap_req.META['HTTP_HOST']
-            except:
-                hostname = ""
-#             print client_ip
-#             print hostname
-            seqinfo['jobname'] = jobname
-            seqinfo['email'] = email
-            seqinfo['para_str'] = para_str
-            seqinfo['date'] = time.strftime(g_params['FORMAT_DATETIME'])
-            seqinfo['client_ip'] = client_ip
-            seqinfo['hostname'] = hostname
-            seqinfo['method_submission'] = "wsdl"
-            seqinfo['isForceRun'] = False  # disable isForceRun if submitted by WSDL
-            jobid = RunQuery_wsdl(seq, filtered_seq, seqinfo)
-            if jobid == "":
-                errinfo = "Failed to submit your job to the queue\n"+seqinfo['errinfo']
-            else:
-                log_record = "%s\t%s\t%s\t%s\t%d\t%s\t%s\t%s\n"%(seqinfo['date'], jobid,
-                        seqinfo['client_ip'], seqinfo['numseq'],
-                        len(seq),seqinfo['jobname'], seqinfo['email'],
-                        seqinfo['method_submission'])
-                main_logfile_query = "%s/%s/%s"%(SITE_ROOT, "static/log", "submitted_seq.log")
-                myfunc.WriteFile(log_record, main_logfile_query, "a")
-
-                divided_logfile_query =  "%s/%s/%s"%(SITE_ROOT, "static/log/divided",
-                        "%s_submitted_seq.log"%(seqinfo['client_ip']))
-                if seqinfo['client_ip'] != "":
-                    myfunc.WriteFile(log_record, divided_logfile_query, "a")
-
-                url = "http://" + hostname + g_params['BASEURL'] + "result/%s"%(jobid)
-
-                file_seq_warning = "%s/%s/%s/%s"%(SITE_ROOT, "static/result", jobid, "query.warn.txt")
-                if seqinfo['warninfo'] != "":
-                    myfunc.WriteFile(seqinfo['warninfo'], file_seq_warning, "a")
-                errinfo = seqinfo['errinfo']
-
-        for s in [jobid, url, numseq_str, errinfo, warninfo]:
+        soap_req = ctx.transport.req
+        client_ip = soap_req.META.get('REMOTE_ADDR', "")
+        hostname = soap_req.META.get('HTTP_HOST', "")
+        for s in SubmitJob_API(seq, para_str, jobname, email, client_ip, hostname):
             yield s
 #}}}
 
@@ -1081,49 +1714,24 @@ class Service_submitseq(ServiceBase):
 
     @rpc(Unicode, _returns=Iterable(Unicode))
     def checkjob(ctx, jobid=""):#{{{
-        rstdir = "%s/%s"%(path_result, jobid)
-        soap_req = ctx.transport.req
-        hostname = soap_req.META['HTTP_HOST']
-        result_url = "http://" + hostname + "/static/" + "result/%s/%s.zip"%(jobid, jobid)
-        status = "None"
-        url = ""
-        errinfo = ""
-        if not os.path.exists(rstdir):
-            status = "None"
-            errinfo = "Error! jobid %s does not exist."%(jobid)
-        else:
-            starttagfile = "%s/%s"%(rstdir, "runjob.start")
-            finishtagfile = "%s/%s"%(rstdir, "runjob.finish")
-            failedtagfile = "%s/%s"%(rstdir, "runjob.failed")
-            runjob_errfile = "%s/%s"%(rstdir, "runjob.err")
-            if os.path.exists(failedtagfile):
-                status = "Failed"
-                errinfo = ""
-                if os.path.exists(errfile):
-                    errinfo = myfunc.ReadFile(errfile)
-            elif os.path.exists(finishtagfile):
-                status = "Finished"
-                url = result_url
-                errinfo = ""
-            elif os.path.exists(starttagfile):
-                status = "Running"
-            else:
-                status = "Wait"
+        hostname = ctx.transport.req.META['HTTP_HOST']
+        (jobid, status, url, errinfo) = GetJobStatusList([jobid], hostname)[0]
         for s in [status, url, errinfo]:
             yield s
+#}}}
+    @rpc(Array(Unicode), _returns=Iterable(Unicode))
+    def checkjobs(ctx, jobidlist=None):#{{{
+        """Status of several jobs, four items are returned for each job:
+        jobid, status, url and errinfo"""
+        hostname = ctx.transport.req.META['HTTP_HOST']
+        jobidlist = list(jobidlist or [])[:g_params['MAX_JOBID_PER_CHECK']]
+        for tup in GetJobStatusList(jobidlist, hostname):
+            for s in tup:
+                yield s
 #}}}
     @rpc(Unicode, _returns=Iterable(Unicode))
     def deletejob(ctx, jobid=""):#{{{
-        rstdir = "%s/%s"%(path_result, jobid)
-        status = "None"
-        errinfo = ""
-        try: 
-            shutil.rmtree(rstdir)
-            status = "Succeeded"
-        except OSError as e:
-            errinfo = str(e)
-            status = "Failed"
-        for s in [status, errinfo]:
+        for s in DeleteJob_API(jobid):
             yield s
 #}}}
 